@@ -0,0 +1,80 @@
+#!/usr/bin/env python3 -u
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Micro-benchmark of the step time of the Apollo optimizer versus the number of
+parameters, for the single tensor, multi-tensor and flat parameter updates.
+
+    python -m fairseq.benchmark.benchmark_apollo --num-params 16 64 256 1024
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+
+from fairseq.optim.apollo import Apollo
+
+
+def build_params(num_params, args, device):
+    # mostly small parameters, like the EMA and normalization parameters of
+    # Mega, with a few large matrices
+    params = []
+    for i in range(num_params):
+        if i % args.large_every == 0:
+            shape = (args.embed_dim, args.embed_dim)
+        else:
+            shape = (args.embed_dim, 2)
+        params.append(torch.nn.Parameter(torch.randn(*shape, device=device)))
+    return params
+
+
+def measure(params, optimizer, args, device):
+    for p in params:
+        p.grad = torch.randn_like(p)
+    for _ in range(args.warmup):
+        optimizer.step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        optimizer.step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-params', type=int, nargs='+', default=[16, 64, 256, 1024])
+    parser.add_argument('--embed-dim', type=int, default=512)
+    parser.add_argument('--large-every', type=int, default=16)
+    parser.add_argument('--rebound', choices=['constant', 'belief'], default='constant')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--cpu', action='store_true')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    kwargs = dict(lr=0.01, rebound=args.rebound, weight_decay=0.01)
+
+    print('device={} rebound={}'.format(device, args.rebound))
+    for num_params in args.num_params:
+        params = build_params(num_params, args, device)
+        multi_params = copy.deepcopy(params)
+        flat = torch.nn.Parameter(torch.cat([p.data.view(-1) for p in params]))
+        flat.param_sizes = [p.numel() for p in params]
+
+        single = measure(params, Apollo(params, **kwargs), args, device)
+        multi = measure(multi_params, Apollo(multi_params, multi_tensor=True, **kwargs), args, device)
+        flat_time = measure([flat], Apollo([flat], **kwargs), args, device)
+        max_diff = max((p - q).abs().max().item() for p, q in zip(params, multi_params))
+
+        print('{:>6} params, {:>10} elements: single {:8.3f} ms | multi-tensor {:8.3f} ms | '
+              'flat {:8.3f} ms | max abs diff {:.3e}'.format(
+                  num_params, flat.numel(), single, multi, flat_time, max_diff))
+
+
+if __name__ == '__main__':
+    main()
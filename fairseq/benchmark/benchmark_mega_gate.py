@@ -0,0 +1,102 @@
+#!/usr/bin/env python3 -u
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Micro-benchmark of the fused inference gates of the Mega block against the
+reference implementation.
+
+    python -m fairseq.benchmark.benchmark_mega_gate --batch-size 8 --seq-len 1024
+"""
+
+import argparse
+import time
+
+import torch
+
+from fairseq.modules.fused_ops.mega_gate import (
+    mega_gate_inference,
+    mega_gate_reference,
+    mega_output_inference,
+    mega_output_reference,
+)
+
+
+def mega_block(gate_fn, output_fn, inputs, args):
+    mx, residual, mx_weight, mx_bias, gamma, beta, h_weight = inputs
+    u, q, k, r, hx = gate_fn(mx, mx_weight, mx_bias, gamma, beta, args.embed_dim, args.zdim, args.hdim)
+    # stands for the attention, which is not part of the benchmark
+    attn = r.clone()
+    return output_fn(attn.mul_(r), h_weight, hx, u, residual)
+
+
+def measure(fn, args, device):
+    for _ in range(args.warmup):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_mem = torch.cuda.memory_allocated()
+        num_allocs = torch.cuda.memory_stats()['allocation.all.allocated']
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    latency = (time.perf_counter() - start) / args.repeat * 1000
+
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated() - start_mem
+        num_allocs = (torch.cuda.memory_stats()['allocation.all.allocated'] - num_allocs) / args.repeat
+    else:
+        with torch.autograd.profiler.profile(profile_memory=True) as prof:
+            fn()
+        events = prof.function_events
+        # bytes and number of allocations made by the ops themselves
+        peak = sum(evt.cpu_memory_usage for evt in events if evt.cpu_memory_usage > 0 and evt.cpu_parent is None)
+        num_allocs = sum(1 for evt in events if evt.cpu_memory_usage > 0 and evt.cpu_parent is None)
+    return latency, peak, num_allocs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--seq-len', type=int, default=1024)
+    parser.add_argument('--embed-dim', type=int, default=512)
+    parser.add_argument('--zdim', type=int, default=128)
+    parser.add_argument('--hdim', type=int, default=1024)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--fp16', action='store_true')
+    parser.add_argument('--cpu', action='store_true')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    dtype = torch.half if args.fp16 else torch.float
+    B, L, D, S, E = args.batch_size, args.seq_len, args.embed_dim, args.zdim, args.hdim
+
+    def randn(*size):
+        return torch.randn(*size, device=device, dtype=dtype)
+
+    inputs = (
+        randn(B, L, D), randn(B, L, D), randn(2 * D + S + E, D) * 0.02, randn(2 * D + S + E),
+        randn(2, S), randn(2, S), randn(D, E) * 0.02,
+    )
+
+    with torch.no_grad():
+        expected = mega_block(mega_gate_reference, mega_output_reference, inputs, args)
+        out = mega_block(mega_gate_inference, mega_output_inference, inputs, args)
+        max_diff = (out - expected).abs().max().item()
+
+        print('B={} L={} D={} S={} E={} dtype={} device={}, max abs diff: {:.3e}'.format(
+            B, L, D, S, E, dtype, device, max_diff))
+        for name, gate_fn, output_fn in [
+            ('reference', mega_gate_reference, mega_output_reference),
+            ('fused', mega_gate_inference, mega_output_inference),
+        ]:
+            latency, peak, num_allocs = measure(lambda: mega_block(gate_fn, output_fn, inputs, args), args, device)
+            print('{:>10}: {:8.3f} ms, {:8.2f} MB allocated, {:.0f} allocations'.format(
+                name, latency, peak / 2 ** 20, num_allocs))
+
+
+if __name__ == '__main__':
+    main()
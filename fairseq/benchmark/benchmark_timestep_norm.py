@@ -0,0 +1,86 @@
+#!/usr/bin/env python3 -u
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Micro-benchmark of the timestep normalization versus the sequence length, for
+the extension (when it is built) and the pure-PyTorch reference, plus the
+per-token cost of incremental decoding.
+
+    python -m fairseq.benchmark.benchmark_timestep_norm --seq-len 512 2048 8192 --cpu
+"""
+
+import argparse
+import time
+
+import torch
+
+from fairseq.modules.fused_ops import backend
+from fairseq.modules.norm_layer.timestep_norm import timestep_norm
+
+
+def measure(fn, args, device):
+    for _ in range(args.warmup):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--seq-len', type=int, nargs='+', default=[512, 2048, 8192])
+    parser.add_argument('--embed-dim', type=int, default=512)
+    parser.add_argument('--num-groups', type=int, default=None)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--fp16', action='store_true')
+    parser.add_argument('--cpu', action='store_true')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    dtype = torch.half if args.fp16 else torch.float
+    B, D = args.batch_size, args.embed_dim
+    num_stats = D if args.num_groups is None else args.num_groups
+    backends = ['reference'] + (['extension'] if backend.has_mega2_extension else [])
+
+    prev_count = torch.full((B,), 2, dtype=torch.int64, device=device)
+    prev_mean = torch.zeros(B, num_stats, device=device, dtype=dtype)
+    prev_var = torch.ones(B, num_stats, device=device, dtype=dtype)
+    gamma = torch.ones(D, device=device, dtype=dtype, requires_grad=True)
+    beta = torch.zeros(D, device=device, dtype=dtype, requires_grad=True)
+
+    print('B={} D={} num_groups={} dtype={} device={}'.format(B, D, args.num_groups, dtype, device))
+    try:
+        for seq_len in args.seq_len:
+            x = torch.randn(B, seq_len, D, device=device, dtype=dtype, requires_grad=True)
+
+            def forward_backward():
+                y, _, _, _ = timestep_norm(x, prev_count, prev_mean, prev_var, gamma, beta, None, args.num_groups)
+                y.backward(torch.ones_like(y))
+
+            def decode():
+                count, mean, var = prev_count, prev_mean, prev_var
+                with torch.no_grad():
+                    for t in range(min(seq_len, 256)):
+                        _, count, mean, var = timestep_norm(
+                            x[:, t:t + 1], count, mean, var, gamma, beta, None, args.num_groups,
+                        )
+
+            for name in backends:
+                backend.set_backend(name)
+                fwd_bwd = measure(forward_backward, args, device)
+                per_token = measure(decode, args, device) / min(seq_len, 256)
+                print('L={:>6} {:>10}: fwd+bwd {:9.3f} ms | decode {:7.4f} ms/token'.format(
+                    seq_len, name, fwd_bwd, per_token))
+    finally:
+        backend.set_backend('auto')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,26 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import logging
 import os
-from collections import Counter
+import time
+from collections import Counter, deque
+from multiprocessing import Pool
 
+import numpy as np
 from fairseq.tokenizer import tokenize_line
 import torch
 from fairseq.file_io import PathManager
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+    has_shared_memory = True
+except ImportError:
+    has_shared_memory = False
+
+
+logger = logging.getLogger(__name__)
+
 def safe_readline(f):
     pos = f.tell()
     while True:
@@ -33,13 +46,17 @@ class Binarizer:
         end=-1,
         already_numberized=False,
     ):
-        nseq, ntok = 0, 0
-        replaced = Counter()
+        if not already_numberized:
+            def batch_consumer(ids, sizes):
+                for item in np.split(ids, np.cumsum(sizes)[:-1]):
+                    consumer(torch.from_numpy(item))
 
-        def replaced_consumer(word, idx):
-            if idx == dict.unk_index and word != dict.unk_word:
-                replaced.update([word])
+            return Binarizer.binarize_batches(
+                filename, dict, batch_consumer, tokenize=tokenize, append_eos=append_eos,
+                reverse_order=reverse_order, offset=offset, end=end,
+            )
 
+        nseq, ntok = 0, 0
         with open(PathManager.get_local_path(filename), "r", encoding="utf-8") as f:
             f.seek(offset)
             # next(f) breaks f.tell(), hence readline() must be used
@@ -47,31 +64,75 @@ class Binarizer:
             while line:
                 if end > 0 and f.tell() > end:
                     break
-                if already_numberized:
-                    id_strings = line.strip().split()
-                    id_list = [int(id_string) for id_string in id_strings]
-                    if reverse_order:
-                        id_list.reverse()
-                    if append_eos:
-                        id_list.append(dict.eos())
-                    ids = torch.IntTensor(id_list)
-                else:
-                    ids = dict.encode_line(
-                        line=line,
-                        line_tokenizer=tokenize,
-                        add_if_not_exist=False,
-                        consumer=replaced_consumer,
-                        append_eos=append_eos,
-                        reverse_order=reverse_order,
-                    )
+                id_strings = line.strip().split()
+                id_list = [int(id_string) for id_string in id_strings]
+                if reverse_order:
+                    id_list.reverse()
+                if append_eos:
+                    id_list.append(dict.eos())
+                ids = torch.IntTensor(id_list)
                 nseq += 1
                 ntok += len(ids)
                 consumer(ids)
                 line = f.readline()
         return {
             "nseq": nseq,
-            "nunk": sum(replaced.values()),
+            "nunk": 0,
             "ntok": ntok,
+            "replaced": Counter(),
+        }
+
+    @staticmethod
+    def binarize_batches(
+        filename,
+        dict,
+        consumer,
+        tokenize=tokenize_line,
+        append_eos=True,
+        reverse_order=False,
+        offset=0,
+        end=-1,
+        batch_size=1024,
+    ):
+        """Like :func:`binarize`, but encodes *batch_size* lines at a time
+        with :func:`~fairseq.data.Dictionary.encode_lines` and calls
+        *consumer* with the concatenated int32 ids and the sizes of each
+        batch."""
+        stats = {"nseq": 0, "ntok": 0}
+        replaced = Counter()
+        lines = []
+
+        def flush():
+            ids, offsets = dict.encode_lines(
+                lines,
+                line_tokenizer=tokenize,
+                add_if_not_exist=False,
+                append_eos=append_eos,
+                reverse_order=reverse_order,
+                replaced=replaced,
+            )
+            stats["nseq"] += len(lines)
+            stats["ntok"] += len(ids)
+            consumer(ids, np.diff(offsets))
+            del lines[:]
+
+        with open(PathManager.get_local_path(filename), "r", encoding="utf-8") as f:
+            f.seek(offset)
+            # next(f) breaks f.tell(), hence readline() must be used
+            line = safe_readline(f)
+            while line:
+                if end > 0 and f.tell() > end:
+                    break
+                lines.append(line)
+                if len(lines) >= batch_size:
+                    flush()
+                line = f.readline()
+        if len(lines) > 0:
+            flush()
+        return {
+            "nseq": stats["nseq"],
+            "nunk": sum(replaced.values()),
+            "ntok": stats["ntok"],
             "replaced": replaced,
         }
 
@@ -91,6 +152,132 @@ class Binarizer:
                 line = f.readline()
         return {"nseq": nseq}
 
+    @staticmethod
+    def iter_chunks(filename, chunk_size):
+        """Yield the (start, end) byte offsets of consecutive chunks of about
+        *chunk_size* bytes of *filename*, aligned on line boundaries. Only the
+        line at each boundary is read."""
+        with open(PathManager.get_local_path(filename), "r", encoding="utf-8") as f:
+            size = os.fstat(f.fileno()).st_size
+            start = 0
+            while start < size:
+                if start + chunk_size >= size:
+                    end = size
+                else:
+                    f.seek(start + chunk_size)
+                    safe_readline(f)
+                    end = f.tell()
+                yield start, end
+                start = end
+
+    @staticmethod
+    def binarize_pipelined(
+        filename,
+        dict,
+        builder,
+        num_workers=1,
+        chunk_size=1 << 22,
+        queue_size=None,
+        append_eos=True,
+        log_interval=100,
+    ):
+        """Binarize *filename* straight into an
+        :class:`~fairseq.data.indexed_dataset.MMapIndexedDatasetBuilder`.
+
+        *num_workers* processes encode chunks of about *chunk_size* bytes,
+        which they read themselves, and hand the token ids back through
+        shared memory buffers; the calling process appends the chunks to
+        *builder* in order as soon as they are ready. At most *queue_size*
+        chunks are in flight, so memory does not grow with the corpus and
+        the output is written in a single pass, without temporary shards.
+        """
+        queue_size = queue_size or 2 * num_workers
+        dtype = builder._dtype
+        # whitespace tokenization never yields more ids (tokens + eos) than
+        # bytes, plus one for a last line without newline
+        capacity = chunk_size + (1 << 16)
+        buffers = []
+        if has_shared_memory:
+            buffers = [
+                shared_memory.SharedMemory(create=True, size=capacity * np.dtype(dtype).itemsize)
+                for _ in range(queue_size)
+            ]
+        free_slots = list(range(queue_size))
+
+        stats = {
+            "nseq": 0, "ntok": 0, "replaced": Counter(), "nbytes": 0,
+            "encode_time": 0., "wait_time": 0., "write_time": 0.,
+        }
+        start_time = time.perf_counter()
+
+        def log_stats():
+            elapsed = time.perf_counter() - start_time
+            logger.info(
+                "{}: {} sents, {} tokens, {:.1f} MB | read+encode {:.1f} MB/s per worker | "
+                "write {:.1f} Mtok/s | waited {:.1f}s for workers | {:.1f} MB/s overall".format(
+                    filename, stats["nseq"], stats["ntok"], stats["nbytes"] / 2 ** 20,
+                    stats["nbytes"] / 2 ** 20 / max(stats["encode_time"], 1e-6),
+                    stats["ntok"] / 1e6 / max(stats["write_time"], 1e-6),
+                    stats["wait_time"], stats["nbytes"] / 2 ** 20 / max(elapsed, 1e-6),
+                )
+            )
+
+        def write(async_result):
+            wait_start = time.perf_counter()
+            result = async_result.get()
+            write_start = time.perf_counter()
+            slot = result["slot"]
+            if result["data"] is not None:
+                data = result["data"]
+            else:
+                data = np.ndarray(result["sizes"].sum(), dtype=dtype, buffer=buffers[slot].buf)
+            builder.add_items(data, result["sizes"])
+            del data
+            free_slots.append(slot)
+
+            stats["nseq"] += result["nseq"]
+            stats["ntok"] += result["ntok"]
+            stats["replaced"].update(result["replaced"])
+            stats["nbytes"] += result["nbytes"]
+            stats["encode_time"] += result["encode_time"]
+            stats["wait_time"] += write_start - wait_start
+            stats["write_time"] += time.perf_counter() - write_start
+
+        pending = deque()
+        pool = Pool(
+            processes=num_workers,
+            initializer=_init_pipelined_worker,
+            initargs=(dict, dtype, append_eos),
+        )
+        try:
+            for i, (start, end) in enumerate(Binarizer.iter_chunks(filename, chunk_size)):
+                if len(pending) >= queue_size:
+                    write(pending.popleft())
+                slot = free_slots.pop()
+                pending.append(pool.apply_async(
+                    _binarize_chunk,
+                    (filename, start, end, slot, buffers[slot].name if buffers else None, capacity),
+                ))
+                if log_interval > 0 and (i + 1) % log_interval == 0:
+                    log_stats()
+            while len(pending) > 0:
+                write(pending.popleft())
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            for buffer in buffers:
+                buffer.close()
+                buffer.unlink()
+        log_stats()
+
+        return {
+            "nseq": stats["nseq"],
+            "nunk": sum(stats["replaced"].values()),
+            "ntok": stats["ntok"],
+            "replaced": stats["replaced"],
+        }
+
     @staticmethod
     def find_offsets(filename, num_chunks):
         with open(PathManager.get_local_path(filename), "r", encoding="utf-8") as f:
@@ -102,3 +289,45 @@ class Binarizer:
                 safe_readline(f)
                 offsets[i] = f.tell()
             return offsets
+
+
+_pipelined_worker = {}
+
+
+def _init_pipelined_worker(dict, dtype, append_eos):
+    _pipelined_worker.update(dict=dict, dtype=dtype, append_eos=append_eos, buffers={})
+
+
+def _binarize_chunk(filename, offset, end, slot, buffer_name, capacity):
+    start_time = time.perf_counter()
+    items, item_sizes = [], []
+
+    def consumer(ids, sizes):
+        items.append(ids)
+        item_sizes.append(sizes)
+
+    res = Binarizer.binarize_batches(
+        filename, _pipelined_worker["dict"], consumer,
+        append_eos=_pipelined_worker["append_eos"], offset=offset, end=end,
+    )
+    sizes = np.concatenate(item_sizes).astype(np.int32) if len(items) > 0 else np.zeros(0, dtype=np.int32)
+    dtype = _pipelined_worker["dtype"]
+    data = np.concatenate(items).astype(dtype, copy=False) if len(items) > 0 else np.zeros(0, dtype=dtype)
+
+    if buffer_name is not None and data.size <= capacity:
+        buffers = _pipelined_worker["buffers"]
+        if buffer_name not in buffers:
+            buffers[buffer_name] = shared_memory.SharedMemory(name=buffer_name)
+            # the writer owns the buffer, don't let the tracker unlink it when this worker exits
+            resource_tracker.unregister(buffers[buffer_name]._name, "shared_memory")
+        np.ndarray(data.size, dtype=dtype, buffer=buffers[buffer_name].buf)[:] = data
+        data = None
+
+    res.update(
+        slot=slot,
+        sizes=sizes,
+        data=data,
+        nbytes=end - offset,
+        encode_time=time.perf_counter() - start_time,
+    )
+    return res
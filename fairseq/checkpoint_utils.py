@@ -3,10 +3,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import atexit
 import collections
 import logging
 import os
+import queue
 import re
+import threading
+import time
 import traceback
 from collections import OrderedDict
 from typing import Union
@@ -76,17 +80,30 @@ def save_checkpoint(args, trainer, epoch_itr, val_loss):
     checkpoints = [
         os.path.join(args.save_dir, fn) for fn, cond in checkpoint_conds.items() if cond
     ]
+    writer = get_checkpoint_writer(args)
     if len(checkpoints) > 0:
-        trainer.save_checkpoint(checkpoints[0], extra_state)
-        for cp in checkpoints[1:]:
-            PathManager.copy(checkpoints[0], cp, overwrite=True)
+        # the checkpoint is written once, the other names are linked or copied
+        num_bytes = trainer.save_checkpoint(
+            checkpoints[0], extra_state, aliases=checkpoints[1:], writer=writer
+        )
 
         write_timer.stop()
-        logger.info(
-            "saved checkpoint {} (epoch {} @ {} updates, score {}) (writing took {} seconds)".format(
-                checkpoints[0], epoch, updates, val_loss, write_timer.sum
+        if writer is None:
+            logger.info(
+                "saved checkpoint {} (epoch {} @ {} updates, score {}) (writing took {} seconds)".format(
+                    checkpoints[0], epoch, updates, val_loss, write_timer.sum
+                )
             )
-        )
+            _log_checkpoint_stats(write_timer.sum, num_bytes)
+        else:
+            logger.info(
+                "queued checkpoint {} (epoch {} @ {} updates, score {}) (snapshot took {} seconds)".format(
+                    checkpoints[0], epoch, updates, val_loss, write_timer.sum
+                )
+            )
+    if writer is not None:
+        for _, seconds, num_bytes in writer.pop_completed():
+            _log_checkpoint_stats(seconds, num_bytes)
 
     if not end_of_epoch and args.keep_interval_updates > 0:
         # remove old checkpoints; checkpoints are sorted in descending order
@@ -115,6 +132,194 @@ def save_checkpoint(args, trainer, epoch_itr, val_loss):
                 os.remove(old_chk)
 
 
+def _log_checkpoint_stats(seconds, num_bytes):
+    from fairseq.logging import metrics
+
+    metrics.log_scalar("ckpt_save_s", seconds, weight=0, priority=1000, round=2)
+    if num_bytes is not None:
+        metrics.log_scalar("ckpt_mb", num_bytes / 2 ** 20, weight=0, priority=1000, round=1)
+
+
+def snapshot_state_dict(state_dict):
+    """Copies the tensors of *state_dict* to CPU memory, so that it can be
+    serialized while training continues. Tensors are copied from the GPU to
+    pinned memory without blocking, then the device is synchronized once."""
+    has_cuda = [False]
+
+    def _snapshot(tensor):
+        # PyTorch has poor support for half tensors (float16) on CPU.
+        # Move any such tensors to float32.
+        if tensor.dtype in {torch.bfloat16, torch.float16}:
+            tensor = tensor.to(dtype=torch.float32)
+            if tensor.device.type == "cpu":
+                return tensor
+        if tensor.device.type == "cpu":
+            return tensor.clone()
+        if not tensor.is_cuda:
+            return tensor.cpu()
+        has_cuda[0] = True
+        out = torch.empty(tensor.size(), dtype=tensor.dtype, pin_memory=True)
+        return out.copy_(tensor, non_blocking=True)
+
+    from fairseq import utils
+
+    state_dict = utils.apply_to_sample(_snapshot, state_dict)
+    if has_cuda[0]:
+        torch.cuda.synchronize()
+    return state_dict
+
+
+def _is_local_path(path):
+    return "://" not in path
+
+
+def write_checkpoint(state_dict, filenames):
+    """Writes *state_dict* to the first of *filenames* and makes the other
+    names point to it.
+
+    Local checkpoints are written through a temporary file renamed atomically
+    and the other names are hard links to it. Other paths are written and
+    copied with :class:`~fairseq.file_io.PathManager`.
+
+    Returns the number of bytes written, or ``None`` if the path is not local.
+    """
+    filename = filenames[0]
+    if not _is_local_path(filename):
+        torch_persistent_save(state_dict, filename)
+        for alias in filenames[1:]:
+            PathManager.copy(filename, alias, overwrite=True)
+        return None
+
+    tmp_filename = filename + ".tmp"
+    with PathManager.open(tmp_filename, "wb") as f:
+        torch_persistent_save(state_dict, f)
+    os.replace(tmp_filename, filename)
+    for alias in filenames[1:]:
+        # replacing the alias never modifies the file it pointed to before
+        tmp_alias = alias + ".tmp"
+        if os.path.lexists(tmp_alias):
+            os.remove(tmp_alias)
+        try:
+            os.link(filename, tmp_alias)
+        except OSError:
+            PathManager.copy(filename, tmp_alias, overwrite=True)
+        os.replace(tmp_alias, alias)
+    return os.path.getsize(filename)
+
+
+class AsyncCheckpointWriter(object):
+    """Writes checkpoints in a background thread.
+
+    :func:`save` snapshots the state dict to CPU memory and returns, the
+    checkpoint is then written with :func:`write_checkpoint` by the worker
+    thread. At most *max_pending* saves are outstanding, :func:`save` blocks
+    until an older one is written. Errors of the worker are raised by the next
+    call to :func:`save` or :func:`wait`.
+
+    Args:
+        max_pending (int, optional): maximum number of outstanding saves
+            (default: 1)
+    """
+
+    def __init__(self, max_pending=1):
+        assert max_pending > 0
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._num_pending = 0
+        self._completed = []
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            state_dict, filenames, start = item
+            try:
+                num_bytes = write_checkpoint(state_dict, filenames)
+                seconds = time.perf_counter() - start
+                logger.info(
+                    "wrote checkpoint {} in {:.2f} seconds".format(filenames[0], seconds)
+                )
+                with self._cond:
+                    self._completed.append((filenames[0], seconds, num_bytes))
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                with self._cond:
+                    self._error = e
+            finally:
+                del state_dict
+                with self._cond:
+                    self._num_pending -= 1
+                    self._cond.notify_all()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("failed to write checkpoint") from error
+
+    def save(self, state_dict, filenames):
+        """Queues the write of *state_dict* to *filenames*."""
+        start = time.perf_counter()
+        with self._cond:
+            while self._num_pending >= self.max_pending:
+                self._cond.wait()
+            self._raise_error()
+            self._num_pending += 1
+        try:
+            state_dict = snapshot_state_dict(state_dict)
+        except Exception:
+            with self._cond:
+                self._num_pending -= 1
+            raise
+        self._queue.put((state_dict, list(filenames), start))
+
+    def pop_completed(self):
+        """Returns the (filename, seconds, bytes) of the checkpoints written
+        since the last call."""
+        with self._cond:
+            completed, self._completed = self._completed, []
+        return completed
+
+    def wait(self):
+        """Blocks until all the queued checkpoints are written."""
+        with self._cond:
+            while self._num_pending > 0:
+                self._cond.wait()
+            self._raise_error()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.wait()
+            self._queue.put(None)
+            self._thread.join()
+
+
+_checkpoint_writer = None
+
+
+def get_checkpoint_writer(args):
+    """Returns the background checkpoint writer with --async-checkpoint, None
+    otherwise."""
+    global _checkpoint_writer
+    if not getattr(args, "async_checkpoint", False):
+        return None
+    if _checkpoint_writer is None:
+        _checkpoint_writer = AsyncCheckpointWriter(getattr(args, "max_pending_checkpoints", 1))
+        # the worker is a daemon thread, flush it before the interpreter exits
+        atexit.register(_checkpoint_writer.close)
+    return _checkpoint_writer
+
+
+def wait_for_checkpoints():
+    """Blocks until the checkpoints queued with --async-checkpoint are written."""
+    if _checkpoint_writer is not None:
+        _checkpoint_writer.wait()
+
+
 def load_checkpoint(args, trainer, **passthrough_args):
     """
     Load a checkpoint and restore the training iterator.
@@ -286,6 +491,8 @@ def save_state(
     num_updates,
     optim_history=None,
     extra_state=None,
+    aliases=(),
+    writer=None,
 ):
     from fairseq import utils
 
@@ -312,11 +519,14 @@ def save_state(
     if not args.no_save_optimizer_state:
         state_dict["last_optimizer_state"] = optimizer.state_dict()
 
+    if writer is not None:
+        writer.save(state_dict, [filename] + list(aliases))
+        return
+
     # convert all state to CPU
     state_dict = utils.move_to_cpu(state_dict)
 
-    with PathManager.open(filename, "wb") as f:
-        torch_persistent_save(state_dict, f)
+    return write_checkpoint(state_dict, [filename] + list(aliases))
 
 
 def _upgrade_state_dict(state):
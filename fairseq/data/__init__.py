@@ -34,7 +34,7 @@ from .numel_dataset import NumelDataset
 from .num_samples_dataset import NumSamplesDataset
 from .offset_tokens_dataset import OffsetTokensDataset
 from .pad_dataset import LeftPadDataset, PadDataset, RightPadDataset
-from .pixel_sequence_dataset import PixelSequenceDataset
+from .pixel_sequence_dataset import MMapPixelSequenceDataset, PixelSequenceDataset
 from .prepend_dataset import PrependDataset
 from .prepend_token_dataset import PrependTokenDataset
 from .raw_label_dataset import RawLabelDataset
@@ -86,6 +86,7 @@ __all__ = [
     'LRUCacheDataset',
     'MaskTokensDataset',
     'MMapIndexedDataset',
+    'MMapPixelSequenceDataset',
     'MonolingualDataset',
     'MultiCorpusSampledDataset',
     'NestedDictionaryDataset',
@@ -47,6 +47,17 @@ def save_data(dir, **tensors):
         torch.save(tensor_value, str(dir / tensor_name) + ".pt")
 
 
+def save_mmap_data(dir, **arrays):
+    # write under a temporary name, so that concurrent readers never map a
+    # partially written file
+    for array_name, array_value in arrays.items():
+        path = str(dir / array_name) + ".npy"
+        tmp_path = "{}.tmp{}".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array_value))
+        os.replace(tmp_path, path)
+
+
 def load_data(dir):
     tensors = {}
     for filename in os.listdir(dir):
@@ -207,6 +218,8 @@ class SpeechCommandsDataset(FairseqDataset):
             gen: bool = False,  # whether we are doing speech generation
             discrete_input: bool = False,  # whether we are using discrete inputs
             resolution: int = 1,  # resolution of the input
+            mmap: bool = False,  # memory-map a contiguous copy of the processed data
+            mmap_dtype: str = "float32",  # dtype of the memory-mapped features, `float32` or `float16`
     ):
         # compatible with fairseq
         if partition == 'valid':
@@ -266,6 +279,16 @@ class SpeechCommandsDataset(FairseqDataset):
                 test_y=test_y,
             )
 
+        if mmap:
+            # features are padded once when the cache is built, the subsampling
+            # is a strided view and the collater only reads the samples it keeps
+            self.mmap_paths = self.build_mmap_cache(
+                data_loc, partition, length if not mfcc and not gen else None, mmap_dtype,
+            )
+            self.sr = sr if not mfcc else 1
+            self._open_mmap()
+            return
+
         X, y = self.load_data(data_loc, partition) # (batch, length, 1)
         if self.gen: y = y.transpose(1, 2)
 
@@ -282,8 +305,28 @@ class SpeechCommandsDataset(FairseqDataset):
         # import pdb; pdb.set_trace()
         self.src = X
         self.tgt = y
+        self.mmap_paths = None
         # super(SpeechCommands, self).__init__(X, y)
 
+    def _open_mmap(self):
+        X_path, y_path = self.mmap_paths
+        self.src = np.load(X_path, mmap_mode="r")[:, ::self.sr]
+        self.tgt = np.load(y_path, mmap_mode="r")
+        if self.gen:
+            self.tgt = self.tgt.transpose(0, 2, 1)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.mmap_paths is not None:
+            # workers map the cache again rather than receiving a copy
+            del state["src"], state["tgt"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.mmap_paths is not None:
+            self._open_mmap()
+
     def __getitem__(self, index):
 
         example = {
@@ -331,6 +374,11 @@ class SpeechCommandsDataset(FairseqDataset):
                 if resolution is not None:
                     x = x[:, ::resolution] # assume length is first axis after batch
                 return x
+            elif isinstance(elem, np.ndarray):
+                x = torch.from_numpy(np.stack(batch))
+                if resolution is not None:
+                    x = x[:, ::resolution]
+                return x
             else:
                 batch = torch.tensor(batch)
                 if resolution is not None:
@@ -338,7 +386,14 @@ class SpeechCommandsDataset(FairseqDataset):
                 return batch
 
         src_lengths = torch.LongTensor(sizes)
-        src_tokens = _collate(sources, resolution=self.resolution)
+        if isinstance(sources[0], np.ndarray):
+            # memory-mapped samples: copy the strided samples straight into the batch
+            src_tokens = self._new_source_buffer(len(sources), sources[0][::self.resolution].shape)
+            out = src_tokens.numpy()
+            for i, source in enumerate(sources):
+                out[i] = source[::self.resolution]
+        else:
+            src_tokens = _collate(sources, resolution=self.resolution)
         src_tokens = src_tokens.squeeze(-1)
         target = _collate(targets, resolution=None)
 
@@ -359,6 +414,39 @@ class SpeechCommandsDataset(FairseqDataset):
 
         return batch
 
+    def _new_source_buffer(self, batch_size, shape):
+        dtype = torch.long if self.discrete_input else torch.float
+        return torch.empty((batch_size,) + tuple(shape), dtype=dtype)
+
+    @property
+    def supports_fetch_batch(self):
+        return self.mmap_paths is not None
+
+    def fetch_batch(self, indices):
+        """Gather the mini-batch *indices* from the memory-mapped cache with a
+        single strided read, without building the samples."""
+        if not self.supports_fetch_batch:
+            return super().fetch_batch(indices)
+        if len(indices) == 0:
+            return {}
+
+        indices = np.asarray(indices, dtype=np.int64)
+        cols = np.arange(0, self.src.shape[1], self.resolution)
+        src_tokens = self._new_source_buffer(len(indices), (len(cols),) + self.src.shape[2:])
+        src_tokens.numpy()[:] = self.src[indices[:, None], cols]
+        src_lengths = torch.full((len(indices),), self.src.shape[1], dtype=torch.long)
+
+        return {
+            'id': torch.from_numpy(indices),
+            'nsentences': len(indices),
+            'ntokens': src_lengths.sum().item(),
+            'net_input': {
+                'src_tokens': src_tokens.squeeze(-1),
+                'src_lengths': src_lengths,
+            },
+            'target': torch.from_numpy(np.ascontiguousarray(self.tgt[indices])),
+        }
+
     # def set_epoch(self, epoch):
     #     super().set_epoch(epoch)
 
@@ -630,6 +718,33 @@ class SpeechCommandsDataset(FairseqDataset):
         return X.transpose(1, 2), y
 
 
+    @staticmethod
+    def build_mmap_cache(data_loc, partition, length=None, dtype="float32"):
+        """Convert the processed *partition* to contiguous ``.npy`` arrays of
+        shape (batch, length, channels) on first use, and return their paths.
+        Floating-point features are stored as *dtype* and zero-padded to
+        *length* if given."""
+        cache_loc = pathlib.Path(
+            str(data_loc / "mmap_{}".format(dtype)) + ("_{}".format(length) if length is not None else "")
+        )
+        X_path = cache_loc / "{}_X.npy".format(partition)
+        y_path = cache_loc / "{}_y.npy".format(partition)
+        if not (os.path.exists(X_path) and os.path.exists(y_path)):
+            logger.info("building memory-mapped cache of {} in {}".format(partition, cache_loc))
+            X, y = SpeechCommandsDataset.load_data(data_loc, partition)
+            if length is not None:
+                X = F.pad(X, (0, 0, 0, length - X.size(1)))
+            X = X.numpy()
+            if np.issubdtype(X.dtype, np.floating):
+                X = X.astype(dtype)
+            os.makedirs(cache_loc, exist_ok=True)
+            save_mmap_data(cache_loc, **{
+                "{}_X".format(partition): X,
+                "{}_y".format(partition): y.numpy(),
+            })
+        return X_path, y_path
+
+
 class SCTruncateDataset(BaseWrapperDataset):
     """Truncate a sequence by returning the first truncation_length tokens
     tailored for speech command dataset
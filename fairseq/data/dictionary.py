@@ -7,6 +7,7 @@ import os
 from collections import Counter
 from multiprocessing import Pool
 
+import numpy as np
 import torch
 from fairseq import utils
 from fairseq.binarizer import safe_readline
@@ -317,6 +318,71 @@ class Dictionary(object):
             ids[nwords] = self.eos_index
         return ids
 
+    def encode_lines(
+        self,
+        lines,
+        line_tokenizer=tokenize_line,
+        add_if_not_exist=False,
+        append_eos=True,
+        reverse_order=False,
+        replaced=None,
+    ):
+        """Encodes a batch of lines, with the same semantics as calling
+        :func:`encode_line` on each of them.
+
+        Only the distinct words of the batch are looked up in the
+        dictionary, and the ids of all lines are assembled with NumPy. The
+        words are kept as Python strings, so a very long word does not
+        inflate the memory used by the other ones.
+
+        Args:
+            lines (List[str]): lines to encode
+            replaced (Counter, optional): if given, is updated with the words
+                that were replaced by the unknown symbol
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the int32 ids of all lines
+            concatenated, and ``len(lines) + 1`` int64 offsets such that the
+            ids of line *i* are ``ids[offsets[i]:offsets[i + 1]]``.
+        """
+        words, lengths = [], np.zeros(len(lines), dtype=np.int64)
+        for i, line in enumerate(lines):
+            line_words = line_tokenizer(line)
+            if reverse_order:
+                line_words = line_words[::-1]
+            words.extend(line_words)
+            lengths[i] = len(line_words)
+        # distinct words in order of first occurrence
+        uniq = {}
+        inverse = np.fromiter(
+            (uniq.setdefault(word, len(uniq)) for word in words), dtype=np.int64, count=len(words)
+        )
+        uniq = list(uniq)
+        counts = np.bincount(inverse, minlength=len(uniq))
+
+        if add_if_not_exist:
+            # add new symbols in order of first occurrence, like encode_line
+            uniq_ids = [self.add_symbol(word, n=int(n)) for word, n in zip(uniq, counts)]
+        else:
+            uniq_ids = [self.indices.get(word, self.unk_index) for word in uniq]
+        uniq_ids = np.array(uniq_ids, dtype=np.int32)
+        word_ids = uniq_ids[inverse]
+
+        if replaced is not None:
+            for word, idx, n in zip(uniq, uniq_ids, counts):
+                if idx == self.unk_index and word != self.unk_word:
+                    replaced[word] += int(n)
+
+        offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+        np.cumsum(lengths + int(append_eos), out=offsets[1:])
+        if not append_eos:
+            return word_ids, offsets
+        ids = np.empty(len(word_ids) + len(lines), dtype=np.int32)
+        ids[offsets[1:] - 1] = self.eos_index
+        line_of_word = np.repeat(np.arange(len(lines)), lengths)
+        ids[np.arange(len(word_ids)) + line_of_word] = word_ids
+        return ids, offsets
+
     @staticmethod
     def _add_file_to_dictionary_single_worker(
         filename, tokenize, eos_word, worker_id=0, num_workers=1
@@ -37,6 +37,17 @@ class FairseqDataset(torch.utils.data.Dataset, EpochListening):
         """
         raise NotImplementedError
 
+    @property
+    def supports_fetch_batch(self):
+        """Whether :func:`fetch_batch` builds mini-batches without going
+        through :func:`__getitem__` for each sample."""
+        return False
+
+    def fetch_batch(self, indices):
+        """Return the mini-batch of the samples *indices*, same as
+        ``self.collater([self[i] for i in indices])``."""
+        return self.collater([self[i] for i in indices])
+
     def num_tokens(self, index):
         """Return the number of tokens in a sample. This value is used to
         enforce ``--max-tokens`` during batching."""
@@ -3,6 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import array
 from functools import lru_cache
 import os
 import shutil
@@ -367,21 +368,16 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                 @staticmethod
                 def _get_pointers(sizes):
                     dtype_size = dtype().itemsize
-                    address = 0
-                    pointers = []
-
-                    for size in sizes:
-                        pointers.append(address)
-                        address += size * dtype_size
-
-                    return pointers
+                    pointers = np.zeros(len(sizes), dtype=np.int64)
+                    np.cumsum(sizes[:-1], dtype=np.int64, out=pointers[1:])
+                    return pointers * dtype_size
 
                 def write(self, sizes):
+                    sizes = np.array(sizes, dtype=np.int32)
                     pointers = self._get_pointers(sizes)
 
                     self._file.write(struct.pack('<Q', len(sizes)))
 
-                    sizes = np.array(sizes, dtype=np.int32)
                     self._file.write(sizes.tobytes(order='C'))
                     del sizes
 
@@ -431,7 +427,10 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         def sizes(self):
             return self._sizes
 
-        @lru_cache(maxsize=8)
+        @property
+        def pointers(self):
+            return self._pointers
+
         def __getitem__(self, i):
             return self._pointers[i], self._sizes[i]
 
@@ -460,8 +459,11 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
         _warmup_mmap_file(data_file_path(self._path))
         self._bin_buffer_mmap = np.memmap(data_file_path(self._path), mode='r', order='C')
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        # all the tokens, items are stored back to back
+        self._tokens = np.frombuffer(self._bin_buffer, dtype=self._index.dtype)
 
     def __del__(self):
+        del self._tokens
         self._bin_buffer_mmap._mmap.close()
         del self._bin_buffer_mmap
         del self._index
@@ -469,7 +471,6 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
     def __len__(self):
         return len(self._index)
 
-    @lru_cache(maxsize=8)
     def __getitem__(self, i):
         ptr, size = self._index[i]
         np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr)
@@ -478,6 +479,42 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
 
         return torch.from_numpy(np_array)
 
+    def token_offsets(self, indices):
+        """Offsets, in tokens, of the items *indices* in the data file."""
+        return self._index.pointers[indices] // self._index.dtype().itemsize
+
+    def gather(self, offsets, lengths, pad_idx, left_pad=False, pad_to_length=None, dtype=np.int64):
+        """Copy the token spans ``[offsets[i], offsets[i] + lengths[i])`` of
+        the data file into a padded ``len(offsets) x max(lengths)`` tensor.
+
+        Spans may cross item boundaries. *dtype* is the numpy dtype of the
+        result, e.g. ``np.int32`` to keep a compact batch until the embedding
+        lookup.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        width = int(lengths.max()) if len(lengths) > 0 else 0
+        if pad_to_length is not None:
+            width = max(width, pad_to_length)
+
+        cols = np.arange(width, dtype=np.int64)[None, :]
+        if left_pad:
+            cols = cols - (width - lengths)[:, None]
+        mask = (cols >= 0) & (cols < lengths[:, None])
+        batch = np.full((len(lengths), width), pad_idx, dtype=dtype)
+        batch[mask] = self._tokens[(offsets[:, None] + cols)[mask]]
+        return torch.from_numpy(batch)
+
+    def get_batch(self, indices, pad_idx, left_pad=False, pad_to_length=None, dtype=np.int64):
+        """Vectorized version of ``collate_tokens([self[i] for i in indices])``
+        which copies the items straight from the data file into the padded
+        batch, see :func:`gather`."""
+        indices = np.asarray(indices, dtype=np.int64)
+        return self.gather(
+            self.token_offsets(indices), self.sizes[indices], pad_idx,
+            left_pad=left_pad, pad_to_length=pad_to_length, dtype=dtype,
+        )
+
     @property
     def sizes(self):
         return self._index.sizes
@@ -497,13 +534,23 @@ class MMapIndexedDatasetBuilder(object):
     def __init__(self, out_file, dtype=np.int64):
         self._data_file = open(out_file, 'wb')
         self._dtype = dtype
-        self._sizes = []
+        # 4 bytes per item
+        self._sizes = array.array('i')
 
     def add_item(self, tensor):
         np_array = np.array(tensor.numpy(), dtype=self._dtype)
         self._data_file.write(np_array.tobytes(order='C'))
         self._sizes.append(np_array.size)
 
+    def add_items(self, np_array, sizes):
+        """Append the items of *np_array*, the concatenation of items of
+        lengths *sizes*."""
+        sizes = np.asarray(sizes, dtype=np.int32)
+        assert np_array.size == sizes.sum()
+        np_array = np.asarray(np_array, dtype=self._dtype)
+        self._data_file.write(np_array.tobytes(order='C'))
+        self._sizes.frombytes(sizes.tobytes())
+
     def merge_file_(self, another_file):
         # Concatenate index
         index = MMapIndexedDataset.Index(index_file_path(another_file))
@@ -377,13 +377,22 @@ class EpochBatchIterator(EpochBatchIterating):
             os.environ['PYTHONWARNINGS'] = 'ignore:semaphore_tracker:UserWarning'
 
         # Create data loader
-        itr = torch.utils.data.DataLoader(
-            self.dataset,
-            collate_fn=self.collate_fn,
-            batch_sampler=batches[offset:],
-            num_workers=self.num_workers,
-            timeout=self.timeout,
-        )
+        if getattr(self.dataset, 'supports_fetch_batch', False) and self.collate_fn == self.dataset.collater:
+            # the dataset builds whole mini-batches, one loader item per batch
+            itr = torch.utils.data.DataLoader(
+                BatchFetchingDataset(self.dataset, batches[offset:]),
+                batch_size=None,
+                num_workers=self.num_workers,
+                timeout=self.timeout,
+            )
+        else:
+            itr = torch.utils.data.DataLoader(
+                self.dataset,
+                collate_fn=self.collate_fn,
+                batch_sampler=batches[offset:],
+                num_workers=self.num_workers,
+                timeout=self.timeout,
+            )
 
         # Wrap with a BufferedIterator if needed
         if self.buffer_size > 0:
@@ -394,6 +403,21 @@ class EpochBatchIterator(EpochBatchIterating):
         return itr
 
 
+class BatchFetchingDataset(torch.utils.data.Dataset):
+    """Dataset of the mini-batches *batches* of *dataset*, built with
+    :func:`~fairseq.data.FairseqDataset.fetch_batch`."""
+
+    def __init__(self, dataset, batches):
+        self.dataset = dataset
+        self.batches = batches
+
+    def __getitem__(self, index):
+        return self.dataset.fetch_batch(self.batches[index])
+
+    def __len__(self):
+        return len(self.batches)
+
+
 class GroupedIterator(CountingIterator):
     """Wrapper around an iterable that returns groups (chunks) of items.
 
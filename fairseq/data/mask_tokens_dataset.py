@@ -13,6 +13,35 @@ from fairseq.data import data_utils, Dictionary
 from . import BaseWrapperDataset, LRUCacheDataset
 
 
+# splitmix64 constants, as signed int64
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15 - 2 ** 64
+_MIX_MULT1 = 0xBF58476D1CE4E5B9 - 2 ** 64
+_MIX_MULT2 = 0x94D049BB133111EB - 2 ** 64
+
+# independent random streams of every token position
+_NUM_STREAMS = 8
+
+
+def _shift_right(x, bits):
+    # logical shift of int64 tensors
+    return (x >> bits) & ((1 << (64 - bits)) - 1)
+
+
+def _mix64(x):
+    """splitmix64 finalizer of an int64 tensor, wrapping around on overflow."""
+    x = x + _GOLDEN_GAMMA
+    x = (x ^ _shift_right(x, 30)) * _MIX_MULT1
+    x = (x ^ _shift_right(x, 27)) * _MIX_MULT2
+    return x ^ _shift_right(x, 31)
+
+
+def _counter_uniform(keys, counters):
+    """Uniform float64 numbers in [0, 1) which only depend on *keys* and
+    *counters* (a counter-based RNG)."""
+    x = _mix64(keys ^ _mix64(counters))
+    return _shift_right(x, 11).double() * (2.0 ** -53)
+
+
 class MaskTokensDataset(BaseWrapperDataset):
     """
     A wrapper Dataset for masked language modeling.
@@ -40,16 +69,25 @@ class MaskTokensDataset(BaseWrapperDataset):
             over vocab indices, indicating whether it is the beginning of a
             word. We will extend any mask to encompass the whole word.
         bpe: BPE to use for whole-word masking.
+        collate_masking: return the unmasked items and mask the whole batch
+            in :func:`collater`, with a counter-based RNG keyed on (*seed*,
+            epoch, index). The masks differ from the per-item masking but
+            they do not depend on the batch and the source and target
+            datasets agree on them. The collated batch is padded with
+            *pad_idx*, so the dataset should not be wrapped by a
+            :class:`~fairseq.data.PadDataset`.
     """
 
     @classmethod
     def apply_mask(cls, dataset: torch.utils.data.Dataset, *args, **kwargs):
         """Return the source and target datasets for masked LM training."""
         dataset = LRUCacheDataset(dataset)
-        return (
-            LRUCacheDataset(cls(dataset, *args, **kwargs, return_masked_tokens=False)),
-            LRUCacheDataset(cls(dataset, *args, **kwargs, return_masked_tokens=True)),
-        )
+        src_dataset = cls(dataset, *args, **kwargs, return_masked_tokens=False)
+        tgt_dataset = cls(dataset, *args, **kwargs, return_masked_tokens=True)
+        if kwargs.get('collate_masking', False):
+            # the batches are masked by the collaters, which cannot be cached
+            return src_dataset, tgt_dataset
+        return LRUCacheDataset(src_dataset), LRUCacheDataset(tgt_dataset)
 
     def __init__(
         self,
@@ -64,6 +102,7 @@ class MaskTokensDataset(BaseWrapperDataset):
         random_token_prob: float = 0.1,
         freq_weighted_replacement: bool = False,
         mask_whole_words: torch.Tensor = None,
+        collate_masking: bool = False,
     ):
         assert 0.0 < mask_prob < 1.0
         assert 0.0 <= random_token_prob <= 1.0
@@ -80,6 +119,7 @@ class MaskTokensDataset(BaseWrapperDataset):
         self.leave_unmasked_prob = leave_unmasked_prob
         self.random_token_prob = random_token_prob
         self.mask_whole_words = mask_whole_words
+        self.collate_masking = collate_masking
 
         if random_token_prob > 0.0:
             if freq_weighted_replacement:
@@ -88,6 +128,7 @@ class MaskTokensDataset(BaseWrapperDataset):
                 weights = np.ones(len(self.vocab))
             weights[:self.vocab.nspecial] = 0
             self.weights = weights / weights.sum()
+            self.weights_cdf = torch.from_numpy(np.cumsum(self.weights))
 
         self.epoch = 0
 
@@ -97,6 +138,8 @@ class MaskTokensDataset(BaseWrapperDataset):
 
     @lru_cache(maxsize=8)
     def __getitem__(self, index: int):
+        if self.collate_masking:
+            return {'id': index, 'tokens': self.dataset[index]}
         with data_utils.numpy_seed(self.seed, self.epoch, index):
             item = self.dataset[index]
             sz = len(item)
@@ -171,3 +214,99 @@ class MaskTokensDataset(BaseWrapperDataset):
                     )
 
             return torch.from_numpy(new_item)
+
+    def collater(self, samples):
+        if not self.collate_masking:
+            return super().collater(samples)
+        if len(samples) == 0:
+            return {}
+        items = [s['tokens'] for s in samples]
+        tokens = data_utils.collate_tokens(items, self.pad_idx, left_pad=False)
+        lengths = torch.LongTensor([len(item) for item in items])
+        indices = torch.LongTensor([s['id'] for s in samples])
+        return self.mask_batch(tokens, lengths, indices)
+
+    def mask_batch(self, tokens, lengths, indices):
+        """Masks a right-padded batch of items.
+
+        Args:
+            tokens (LongTensor): items of shape `(bsz, seq_len)`
+            lengths (LongTensor): lengths of the items of shape `(bsz)`
+            indices (LongTensor): indices of the items in the dataset, which
+                seed their masks
+
+        Returns:
+            LongTensor: the masked items, or the original masked token IDs
+            (and *pad_idx* elsewhere) if *return_masked_tokens*
+        """
+        assert not tokens.eq(self.mask_idx).any(), \
+            'Dataset contains mask_idx (={}), this is not expected!'.format(
+                self.mask_idx,
+            )
+        device = tokens.device
+        seq_len = tokens.size(1)
+        positions = torch.arange(seq_len, device=device).unsqueeze(0)
+        not_pad = positions < lengths.to(device).unsqueeze(1)
+
+        seed_key = _mix64(_mix64(torch.tensor(self.seed, dtype=torch.long)) + self.epoch)
+        keys = _mix64(seed_key.to(device) + indices.to(device)).unsqueeze(1)
+
+        def uniform(stream):
+            return _counter_uniform(keys, positions * _NUM_STREAMS + stream)
+
+        # the units to mask are the words, drawn at the first token of every
+        # word and expanded to the following tokens
+        if self.mask_whole_words is not None:
+            mask_whole_words = self.mask_whole_words.to(device)
+            word_begins = mask_whole_words[tokens].bool() & not_pad
+            word_starts = torch.where(word_begins, positions, torch.zeros_like(positions)).cummax(dim=1)[0]
+
+            def expand(mask):
+                return mask.gather(1, word_starts) & not_pad
+        else:
+            word_begins = not_pad
+
+            def expand(mask):
+                return mask
+
+        # decide elements to mask, without replacement: the num_mask units
+        # with the lowest random scores
+        sz = word_begins.sum(dim=1)
+        num_mask = (
+            # add a random number for probabilistic rounding
+            self.mask_prob * sz.double() + _counter_uniform(keys, positions[:, :1] * _NUM_STREAMS)[:, 0]
+        ).long()
+        scores = uniform(1).masked_fill(~word_begins, 2.0)
+        order = scores.argsort(dim=1)
+        ranks = torch.empty_like(order).scatter_(1, order, positions.expand_as(order))
+        mask = ranks < num_mask.unsqueeze(1)
+
+        if self.return_masked_tokens:
+            return tokens.masked_fill(~expand(mask), self.pad_idx)
+
+        # decide unmasking and random replacement
+        rand_or_unmask_prob = self.random_token_prob + self.leave_unmasked_prob
+        unmask = rand_mask = None
+        if rand_or_unmask_prob > 0.0:
+            rand_or_unmask = mask & (uniform(2) < rand_or_unmask_prob)
+            if self.random_token_prob == 0.0:
+                unmask = rand_or_unmask
+            elif self.leave_unmasked_prob == 0.0:
+                rand_mask = rand_or_unmask
+            else:
+                unmask_prob = self.leave_unmasked_prob / rand_or_unmask_prob
+                decision = uniform(3) < unmask_prob
+                unmask = rand_or_unmask & decision
+                rand_mask = rand_or_unmask & (~decision)
+
+        if unmask is not None:
+            mask = mask & (~unmask)
+
+        new_tokens = tokens.masked_fill(expand(mask), self.mask_idx)
+        if rand_mask is not None:
+            # inverse transform sampling of the replacement words
+            weights_cdf = self.weights_cdf.to(device)
+            rand_tokens = torch.searchsorted(weights_cdf, uniform(4), right=True)
+            rand_tokens = rand_tokens.clamp_(max=len(weights_cdf) - 1)
+            new_tokens = torch.where(expand(rand_mask), rand_tokens, new_tokens)
+        return new_tokens
@@ -173,6 +173,52 @@ class MonolingualDataset(FairseqDataset):
         """
         return collate(samples, self.vocab.pad(), self.vocab.eos())
 
+    @property
+    def supports_fetch_batch(self):
+        return (
+            getattr(self.dataset, 'supports_get_batch', False)
+            and getattr(self.dataset, 'include_targets', False)
+            and self.targets is not None
+            and not self.add_bos_token
+            # an eos may have to be appended to some of the sources
+            and not (self.add_eos_for_other_targets and ('self' in self.targets or 'past' in self.targets))
+        )
+
+    def fetch_batch(self, indices):
+        """Build the mini-batch *indices* at once with the ``get_batch`` of
+        the underlying dataset, see :attr:`supports_fetch_batch`."""
+        if not self.supports_fetch_batch:
+            return super().fetch_batch(indices)
+        if len(indices) == 0:
+            return {}
+
+        indices = np.asarray(indices, dtype=np.int64)
+        source, future_target, past_target = self.dataset.get_batch(indices)
+        target = []
+        for t in self.targets:
+            if t == 'self':
+                target.append(source)
+            elif t == 'future':
+                target.append(future_target)
+            elif t == 'past':
+                target.append(past_target)
+            else:
+                raise Exception('invalid target ' + t)
+        if len(target) == 1:
+            target = target[0]
+        src_lengths = torch.from_numpy(self.dataset.sizes[indices].astype(np.int64))
+
+        return {
+            'id': torch.from_numpy(indices),
+            'nsentences': len(indices),
+            'ntokens': src_lengths.sum().item(),
+            'net_input': {
+                'src_tokens': source,
+                'src_lengths': src_lengths,
+            },
+            'target': self._filter_vocab(target),
+        }
+
     def num_tokens(self, index):
         """Return the number of tokens in a sample. This value is used to
         enforce ``--max-tokens`` during batching."""
@@ -9,7 +9,7 @@ import os
 import numpy as np
 import torch
 
-from . import FairseqDataset
+from . import FairseqDataset, indexed_dataset
 from fairseq.tokenizer import tokenize_line
 
 
@@ -72,3 +72,98 @@ class PixelSequenceDataset(FairseqDataset):
     @staticmethod
     def exists(path):
         return os.path.exists(path)
+
+
+def binarize_pixels(input_file, out_prefix, reverse_order=False):
+    """Convert a text file with one image of space-separated pixel values per
+    line into uint8 ``out_prefix.{bin,idx}`` files readable with
+    :class:`MMapPixelSequenceDataset`.
+
+    Returns:
+        int: the number of images written.
+    """
+    builder = indexed_dataset.MMapIndexedDatasetBuilder(
+        indexed_dataset.data_file_path(out_prefix), dtype=np.uint8,
+    )
+    num_images = 0
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            pixels = np.fromstring(line, dtype=np.int64, sep=' ')
+            if pixels.size > 0 and (pixels.min() < 0 or pixels.max() > 255):
+                raise ValueError('line {} of {}: pixel values must be in [0, 255]'.format(i + 1, input_file))
+            if reverse_order:
+                pixels = pixels[::-1]
+            builder.add_item(torch.from_numpy(pixels.astype(np.uint8)))
+            num_images += 1
+    builder.finalize(indexed_dataset.index_file_path(out_prefix))
+    return num_images
+
+
+class MMapPixelSequenceDataset(FairseqDataset):
+    """Pixel sequences stored as uint8 in memory-mapped
+    ``path.{bin,idx}`` files (see :func:`binarize_pixels`).
+
+    Items are returned as raw uint8 tensors read from the page cache, which
+    is shared between data loader workers. They are cast to the default float
+    dtype and normalized for the whole batch at once in :func:`collater`.
+    """
+
+    def __init__(self, path, normalization):
+        super().__init__()
+        self.mean = normalization[0]
+        self.std = normalization[1]
+        self._path = None
+        self._index = None
+        self._do_init(path)
+
+    def __getstate__(self):
+        return self._path, self.mean, self.std
+
+    def __setstate__(self, state):
+        path, self.mean, self.std = state
+        self._do_init(path)
+
+    def _do_init(self, path):
+        self._path = path
+        self._index = indexed_dataset.MMapIndexedDataset.Index(indexed_dataset.index_file_path(path))
+        assert self._index.dtype == np.uint8, 'expected uint8 pixels, found {}'.format(self._index.dtype)
+        self._bin_buffer_mmap = np.memmap(indexed_dataset.data_file_path(path), mode='r', order='C')
+        self._bin_buffer = memoryview(self._bin_buffer_mmap)
+
+    def __del__(self):
+        if getattr(self, '_bin_buffer_mmap', None) is not None:
+            self._bin_buffer_mmap._mmap.close()
+            del self._bin_buffer_mmap
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        ptr, size = self._index[i]
+        pixels = np.frombuffer(self._bin_buffer, dtype=np.uint8, count=size, offset=ptr)
+        # copy out of the read-only buffer, one byte per pixel
+        return torch.from_numpy(pixels.copy())
+
+    def collater(self, samples):
+        if len(samples) == 0:
+            return torch.empty(0, dtype=torch.get_default_dtype())
+        pixels = torch.stack(samples, dim=0).to(torch.get_default_dtype())
+        return pixels.div_(255.).sub_(self.mean).div_(self.std)
+
+    @property
+    def sizes(self):
+        return self._index.sizes
+
+    def num_tokens(self, index):
+        return self.sizes[index]
+
+    def size(self, index):
+        return self.sizes[index]
+
+    @property
+    def supports_prefetch(self):
+        return False
+
+    @staticmethod
+    def exists(path):
+        return indexed_dataset.MMapIndexedDataset.exists(path)
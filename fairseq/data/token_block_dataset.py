@@ -7,6 +7,7 @@ import numpy as np
 import torch
 
 from fairseq.data import FairseqDataset, plasma_utils
+from fairseq.data.indexed_dataset import MMapIndexedDataset
 
 from fairseq.data.token_block_utils_fast import (
     _get_slice_indices_fast,
@@ -208,6 +209,39 @@ class TokenBlockDataset(FairseqDataset):
 
         return item
 
+    @property
+    def supports_get_batch(self):
+        return isinstance(self.dataset, MMapIndexedDataset)
+
+    def get_batch(self, indices, dtype=np.int64):
+        """Vectorized version of ``[self[i] for i in indices]``, where each
+        element is right-padded with *pad* into a tensor of size
+        ``len(indices) x max(self.sizes[indices])``. The blocks are copied
+        straight from the underlying
+        :class:`~fairseq.data.indexed_dataset.MMapIndexedDataset`."""
+        indices = np.asarray(indices, dtype=np.int64)
+        start_ds_idx, start_offset, _ = self.block_to_dataset_index[indices].T
+        slice_indices = self.slice_indices[indices]
+        lengths = slice_indices[:, 1] - slice_indices[:, 0]
+        # items are contiguous in the data file, so each block is a single span
+        starts = self.dataset.token_offsets(start_ds_idx) + start_offset
+        item = self.dataset.gather(starts, lengths, self.pad, dtype=dtype)
+
+        if self.include_targets:
+            # the tokens before the start of the first item are overwritten
+            # below, like the padding of __getitem__
+            source = self.dataset.gather(starts - 1, lengths, self.pad, dtype=dtype)
+            past_target = self.dataset.gather(starts - 2, lengths, self.pad, dtype=dtype)
+            s0 = torch.from_numpy((start_offset == 0) & (lengths > 0))
+            s1 = torch.from_numpy((start_offset == 1) & (lengths > 0))
+            source[s0, 0] = self.eos
+            past_target[s0, 0] = self.pad
+            past_target[s0 & torch.from_numpy(lengths > 1), 1] = self.eos
+            past_target[s1, 0] = self.eos
+            return source, item, past_target
+
+        return item
+
     def __len__(self):
         return len(self.slice_indices)
 
@@ -11,7 +11,9 @@ import socket
 import struct
 import subprocess
 import warnings
+import zlib
 from collections import OrderedDict
+from itertools import chain
 from typing import Any, Dict, Mapping
 
 import torch
@@ -229,11 +231,18 @@ def all_gather_list(data, group=None, max_size=16384):
     rank = get_rank()
     world_size = get_world_size()
 
+    # the gloo backend reduces CPU tensors
+    use_cuda = torch.cuda.is_available() and dist.get_backend(group) == 'nccl'
     buffer_size = max_size * world_size
     if not hasattr(all_gather_list, '_buffer') or \
-            all_gather_list._buffer.numel() < buffer_size:
-        all_gather_list._buffer = torch.cuda.ByteTensor(buffer_size)
-        all_gather_list._cpu_buffer = torch.ByteTensor(max_size).pin_memory()
+            all_gather_list._buffer.numel() < buffer_size or \
+            all_gather_list._buffer.is_cuda != use_cuda:
+        if use_cuda:
+            all_gather_list._buffer = torch.cuda.ByteTensor(buffer_size)
+            all_gather_list._cpu_buffer = torch.ByteTensor(max_size).pin_memory()
+        else:
+            all_gather_list._buffer = torch.ByteTensor(buffer_size)
+            all_gather_list._cpu_buffer = torch.ByteTensor(max_size)
     buffer = all_gather_list._buffer
     buffer.zero_()
     cpu_buffer = all_gather_list._cpu_buffer
@@ -323,3 +332,200 @@ def all_reduce_dict(
         raise KeyError
 
     return OrderedDict([(key, get_from_stack(key)) for key in data_keys])
+
+
+def _stat_type(v):
+    """Type code of a scalar logging output, or None if it is not a number."""
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, int):
+        return 'int'
+    if isinstance(v, float):
+        return 'float'
+    if torch.is_tensor(v) and v.numel() == 1 and not v.is_complex():
+        return str(v.dtype)
+    return None
+
+
+def _from_stat(v, stat_type):
+    if stat_type == 'int':
+        return int(v)
+    if stat_type == 'float':
+        return v
+    return torch.tensor(v, dtype=getattr(torch, stat_type[len('torch.'):]))
+
+
+class LoggingOutputsGather(object):
+    """Gathers the logging outputs of all workers, like :func:`all_gather_list`.
+
+    When the logging outputs of all workers are flat dicts of numbers with the
+    same keys, they are written in a pre-allocated float64 tensor which is
+    gathered with a single :func:`all_reduce`, instead of being pickled. The
+    keys (the schema) are agreed on by a pickled :func:`all_gather_list`, which
+    only happens on the first call and when the keys change on some worker.
+
+    Every worker writes its slot of the buffer, headed by the hash of its
+    schema and its number of logging outputs. All the workers see the same
+    reduced headers, so they all fall back to :func:`all_gather_list` together
+    if any of them does not match the agreed schema.
+
+    Args:
+        device (torch.device): device for the reduction
+        group (optional): group of the collective
+        max_size (int, optional): maximum size of the pickled data, for
+            :func:`all_gather_list`
+    """
+
+    def __init__(self, device, group=None, max_size=16384):
+        self.device = device
+        self.group = group
+        self.max_size = max_size
+        self.keys = None
+        self.types = None
+        self.schema_hash = None
+        self.capacity = 0  # maximum number of logging outputs per worker
+        self.num_extra_stats = 0
+        # set when the logging outputs cannot be flattened
+        self.unsupported = False
+        self.num_gathers = 0
+        self.num_fallbacks = 0
+        self._buffer = None
+
+    @property
+    def slot_size(self):
+        return 2 + self.capacity * len(self.keys) + self.num_extra_stats
+
+    def __call__(self, logging_outputs, *extra_stats_to_sum):
+        """Returns the logging outputs of all the workers and the sums of
+        *extra_stats_to_sum*."""
+        self.num_gathers += 1
+        if self.schema_hash is not None:
+            result = self._reduce(logging_outputs, extra_stats_to_sum)
+            if result is not None:
+                return result
+
+        self.num_fallbacks += 1
+        results = list(zip(
+            *all_gather_list(
+                [logging_outputs] + list(extra_stats_to_sum),
+                group=self.group,
+                max_size=self.max_size,
+            )
+        ))
+        gathered, extra_stats_to_sum = results[0], results[1:]
+        if not self.unsupported:
+            self._update_schema(gathered, extra_stats_to_sum)
+        logging_outputs = list(chain.from_iterable(gathered))
+        extra_stats_to_sum = [sum(s) for s in extra_stats_to_sum]
+        return logging_outputs, extra_stats_to_sum
+
+    def _update_schema(self, gathered, extra_stats_to_sum):
+        """Derives the schema from the logging outputs of all the workers,
+        which is the same on every worker."""
+        self.schema_hash = None
+        logs = list(chain.from_iterable(gathered))
+        if len(logs) == 0:
+            # nothing to derive the schema from, try again on the next call
+            return
+        if not all(_stat_type(v) is not None for s in extra_stats_to_sum for v in s):
+            self.unsupported = True
+            return
+        keys = list(logs[0].keys())
+        types = {}
+        for log in logs:
+            if log.keys() != logs[0].keys():
+                self.unsupported = True
+                return
+            for k, v in log.items():
+                t = _stat_type(v)
+                if t is None or (k in types and types[k] != t and {types[k], t} != {'int', 'float'}):
+                    self.unsupported = True
+                    return
+                types[k] = 'float' if k in types and types[k] != t else t
+
+        self.keys = keys
+        self.types = [types[k] for k in keys]
+        self.capacity = max(len(logs) for logs in gathered)
+        self.num_extra_stats = len(extra_stats_to_sum)
+        # crc32 is exactly representable as a float64
+        self.schema_hash = float(zlib.crc32(
+            repr((self.keys, self.types, self.num_extra_stats)).encode('utf-8')
+        ))
+        size = get_world_size() * self.slot_size
+        self._buffer = torch.zeros(size, dtype=torch.double, device=self.device)
+
+    def _flatten(self, logging_outputs, extra_stats_to_sum):
+        """Returns the values of the local slot, or None if they do not match
+        the schema."""
+        if len(logging_outputs) > self.capacity or len(extra_stats_to_sum) != self.num_extra_stats:
+            return None
+        values = [self.schema_hash, len(logging_outputs)]
+        for log in logging_outputs:
+            if len(log) != len(self.keys):
+                return None
+            for k, t in zip(self.keys, self.types):
+                if k not in log:
+                    return None
+                v = log[k]
+                vt = _stat_type(v)
+                if vt != t and not (vt == 'int' and t == 'float'):
+                    return None
+                values.append(v)
+        values.extend([0.0] * ((self.capacity - len(logging_outputs)) * len(self.keys)))
+        for v in extra_stats_to_sum:
+            if _stat_type(v) is None:
+                return None
+            values.append(v)
+        return values
+
+    def _reduce(self, logging_outputs, extra_stats_to_sum):
+        slot_size = self.slot_size
+        world_size = self._buffer.numel() // slot_size
+        buffer = self._buffer
+        buffer.zero_()
+        start = get_rank() * slot_size
+        slot = buffer[start:start + slot_size]
+
+        values = self._flatten(logging_outputs, extra_stats_to_sum)
+        if values is None:
+            slot[0] = -1
+        else:
+            # values on the device are copied without synchronizing
+            host_values, device_index, device_values = [], [], []
+            for i, v in enumerate(values):
+                if torch.is_tensor(v) and v.device.type != 'cpu':
+                    host_values.append(0.0)
+                    device_index.append(i)
+                    device_values.append(v.detach().view(()).to(dtype=torch.double))
+                else:
+                    host_values.append(float(v))
+            slot.copy_(torch.tensor(host_values, dtype=torch.double))
+            if len(device_values) > 0:
+                slot.index_copy_(
+                    0,
+                    torch.tensor(device_index, device=slot.device),
+                    torch.stack(device_values).to(slot.device),
+                )
+
+        all_reduce(buffer, group=self.group)
+
+        buffer = buffer.view(world_size, slot_size).cpu()
+        if not bool((buffer[:, 0] == self.schema_hash).all()) or \
+                not bool((buffer[:, 1] <= self.capacity).all()):
+            return None
+
+        num_keys = len(self.keys)
+        buffer = buffer.tolist()
+        logging_outputs = []
+        for row in buffer:
+            for i in range(int(row[1])):
+                offset = 2 + i * num_keys
+                logging_outputs.append({
+                    k: _from_stat(v, t)
+                    for k, t, v in zip(self.keys, self.types, row[offset:offset + num_keys])
+                })
+        extra_stats_to_sum = [
+            sum(row[slot_size - self.num_extra_stats + i] for row in buffer)
+            for i in range(self.num_extra_stats)
+        ]
+        return logging_outputs, extra_stats_to_sum
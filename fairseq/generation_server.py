@@ -0,0 +1,436 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import asyncio
+import itertools
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+from fairseq.logging.meters import AverageMeter, TimeMeter
+
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest(object):
+    """A prompt waiting for, or being decoded in, a slot of a
+    :class:`ContinuousBatchGenerator`."""
+
+    def __init__(self, id, prompt: List[int], max_len: int, deadline: Optional[float] = None):
+        self.id = id
+        self.prompt = prompt
+        self.max_len = max_len
+        # time.perf_counter() after which the request is dropped
+        self.deadline = deadline
+        self.cancelled = False
+        self.timed_out = False
+
+        self.num_fed = 0
+        self.tokens: List[int] = []
+        self.positional_scores: List[float] = []
+
+        self.submit_time = time.perf_counter()
+        self.start_time: Optional[float] = None
+        self.first_token_time: Optional[float] = None
+        self.finish_time: Optional[float] = None
+
+    def expired(self, now: float) -> bool:
+        return self.deadline is not None and now > self.deadline
+
+    def result(self) -> Dict[str, Tensor]:
+        positional_scores = torch.tensor(self.positional_scores)
+        return {
+            'tokens': torch.tensor(self.tokens, dtype=torch.long),
+            'score': positional_scores.sum() / max(len(self.tokens), 1),
+            'positional_scores': positional_scores,
+        }
+
+
+class ContinuousBatchGenerator(object):
+    """Decodes requests in a persistent batch of at most *num_slots* slots
+    (iteration-level scheduling).
+
+    Every :func:`step` feeds one token per slot to the decoders: the next
+    prompt token for the slots that are still reading their prompt, the last
+    generated token for the others. A request admitted with :func:`add` takes
+    a free slot at the next step and the incremental state of that slot is
+    reset in place (see
+    :func:`~fairseq.models.FairseqIncrementalDecoder.reset_incremental_state`),
+    so requests never wait for the rest of the batch to finish. The batch
+    grows and shrinks with :func:`~fairseq.models.FairseqIncrementalDecoder.reorder_incremental_state`
+    when slots are added or evicted with :func:`compact`.
+
+    Only language models whose incremental decoders support resetting their
+    state, such as Mega LMs, can be used. With chunked attention
+    (``chunk_size > 0`` on the decoder), all the slots share the position
+    within the current chunk, so new requests wait in their slot until the
+    next chunk boundary before starting.
+    """
+
+    def __init__(self, models, tgt_dict, num_slots, sampling=False, temperature=1.0):
+        self.models = models
+        self.pad = tgt_dict.pad()
+        self.eos = tgt_dict.eos()
+        self.num_slots = num_slots
+        self.sampling = sampling
+        self.temperature = temperature
+        assert self.num_slots > 0
+        assert self.temperature > 0, '--temperature must be greater than 0'
+        for model in self.models:
+            model.eval()
+
+        self.device = next(self.models[0].parameters()).device
+        # chunk sizes of the decoders with chunked attention
+        self.chunk_sizes = [
+            model.decoder.chunk_size for model in self.models if getattr(model.decoder, 'chunk_size', -1) > 0
+        ]
+        self.slots: List[Optional[GenerationRequest]] = []
+        self.incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]] = []
+        # batch size of the incremental states, 0 before the first step
+        self._state_bsz = 0
+        # number of steps since the incremental states were created
+        self._num_steps = 0
+        self._clear_states()
+
+    @property
+    def num_active(self) -> int:
+        return sum(1 for request in self.slots if request is not None)
+
+    @property
+    def num_free_slots(self) -> int:
+        return self.num_slots - self.num_active
+
+    def add(self, request: GenerationRequest):
+        """Admit *request* into a free slot; decoding starts at the next step."""
+        assert self.num_free_slots > 0, 'no free slot'
+        assert len(request.prompt) > 0
+        for i, slot in enumerate(self.slots):
+            if slot is None:
+                self.slots[i] = request
+                return
+        self.slots.append(request)
+
+    def compact(self):
+        """Evict the free slots from the batch."""
+        order = [i for i, request in enumerate(self.slots) if request is not None]
+        if len(order) == len(self.slots):
+            return
+        if len(order) == 0:
+            self.slots = []
+            self._clear_states()
+            return
+        if self._state_bsz > 0:
+            new_order = torch.tensor([i for i in order if i < self._state_bsz], dtype=torch.long, device=self.device)
+            self._reorder_states(new_order)
+        self.slots = [self.slots[i] for i in order]
+
+    def reset(self):
+        """Drop every request and the incremental states, e.g. after a failed
+        :func:`step`."""
+        self.slots = []
+        self._clear_states()
+
+    def _clear_states(self):
+        self.incremental_states = [
+            torch.jit.annotate(Dict[str, Dict[str, Optional[Tensor]]], {}) for _ in self.models
+        ]
+        self._state_bsz = 0
+        self._num_steps = 0
+
+    def _reorder_states(self, new_order: Tensor):
+        for model, incremental_state in zip(self.models, self.incremental_states):
+            model.decoder.reorder_incremental_state_scripting(incremental_state, new_order)
+        self._state_bsz = new_order.numel()
+
+    def _forward(self, tokens: Tensor) -> Tensor:
+        avg_lprobs = None
+        for model, incremental_state in zip(self.models, self.incremental_states):
+            decoder_out = model.decoder.forward(tokens, incremental_state)
+            lprobs = model.get_normalized_probs(decoder_out, log_probs=True)[:, -1, :]
+            if avg_lprobs is None:
+                avg_lprobs = lprobs
+            else:
+                avg_lprobs = torch.logaddexp(avg_lprobs, lprobs)
+        if len(self.models) > 1:
+            avg_lprobs = avg_lprobs - math.log(len(self.models))
+        return avg_lprobs
+
+    @torch.no_grad()
+    def step(self, compact: bool = False) -> List[GenerationRequest]:
+        """Decode one token for every slot.
+
+        Args:
+            compact (bool, optional): evict the free slots first, e.g. when
+                no request is waiting for one (default: False).
+
+        Returns:
+            the requests which finished, were cancelled or went past their
+            deadline at this step, and left their slot.
+        """
+        now = time.perf_counter()
+        finished = []
+        for i, request in enumerate(self.slots):
+            if request is not None and (request.cancelled or request.expired(now)):
+                request.timed_out = not request.cancelled
+                request.finish_time = now
+                finished.append(request)
+                self.slots[i] = None
+        if compact:
+            self.compact()
+        if self.num_active == 0:
+            return finished
+
+        bsz = len(self.slots)
+        if 0 < self._state_bsz < bsz:
+            # new slots start as copies of the first one and are reset below
+            new_order = torch.cat([
+                torch.arange(self._state_bsz), torch.zeros(bsz - self._state_bsz, dtype=torch.long)
+            ]).to(self.device)
+            self._reorder_states(new_order)
+
+        # the incremental states can only be reset at chunk boundaries
+        can_start = self._state_bsz == 0 or all(self._num_steps % c == 0 for c in self.chunk_sizes)
+
+        # free and waiting slots are fed eos, their outputs are ignored
+        tokens = [self.eos] * bsz
+        reset_mask = [False] * bsz
+        decoding = []
+        force_eos = []
+        for i, request in enumerate(self.slots):
+            if request is None:
+                continue
+            if request.num_fed == 0:
+                if not can_start:
+                    continue
+                request.start_time = now
+                reset_mask[i] = self._state_bsz > 0
+            if request.num_fed < len(request.prompt):
+                tokens[i] = request.prompt[request.num_fed]
+                request.num_fed += 1
+                if request.num_fed < len(request.prompt):
+                    continue
+            else:
+                tokens[i] = request.tokens[-1]
+            decoding.append(i)
+            if len(request.tokens) + 1 >= request.max_len:
+                force_eos.append(i)
+
+        if any(reset_mask):
+            reset_mask = torch.tensor(reset_mask).to(self.device)
+            for model, incremental_state in zip(self.models, self.incremental_states):
+                model.decoder.reset_incremental_state_scripting(incremental_state, reset_mask)
+
+        tokens = torch.tensor(tokens, dtype=torch.long).view(bsz, 1).to(self.device)
+        lprobs = self._forward(tokens)
+        self._state_bsz = bsz
+        self._num_steps += 1
+        if len(decoding) == 0:
+            return finished
+
+        lprobs[:, self.pad] = -math.inf
+        if len(force_eos) > 0:
+            force_eos = torch.tensor(force_eos, dtype=torch.long).to(self.device)
+            lprobs[force_eos, :self.eos] = -math.inf
+            lprobs[force_eos, self.eos + 1:] = -math.inf
+
+        if self.sampling:
+            probs = torch.softmax(lprobs.float() / self.temperature, dim=-1)
+            next_tokens = torch.multinomial(probs, 1)
+        else:
+            next_tokens = lprobs.argmax(dim=-1, keepdim=True)
+        next_scores = lprobs.gather(1, next_tokens)
+        # a single copy to the host per step
+        next_tokens = next_tokens.view(-1).tolist()
+        next_scores = next_scores.view(-1).tolist()
+
+        now = time.perf_counter()
+        for i in decoding:
+            request = self.slots[i]
+            request.tokens.append(next_tokens[i])
+            request.positional_scores.append(next_scores[i])
+            if request.first_token_time is None:
+                request.first_token_time = now
+            if next_tokens[i] == self.eos:
+                request.finish_time = now
+                finished.append(request)
+                self.slots[i] = None
+        return finished
+
+
+class GenerationServer(object):
+    """Local asyncio serving engine with continuous batching.
+
+    Requests are encoded with *hub* (a
+    :class:`~fairseq.hub_utils.GeneratorHubInterface`) and decoded by a
+    :class:`ContinuousBatchGenerator`, which runs in a worker thread so that
+    new requests keep being accepted while the model runs. At most
+    *max_queue_size* requests wait for a slot, further ones are rejected with
+    :class:`asyncio.QueueFull`. Requests which are still waiting or decoding
+    after their timeout fail with :class:`asyncio.TimeoutError` and release
+    their slot.
+
+    Usage::
+
+        async with hub.serve(num_slots=16) as server:
+            hypo = await server.generate('Hello', timeout=2.)
+            print(hypo['output'], server.metrics())
+    """
+
+    def __init__(self, hub, num_slots=8, max_queue_size=64, timeout=None, max_len=200, sampling=False,
+                 temperature=1.0):
+        self.hub = hub
+        self.generator = ContinuousBatchGenerator(
+            list(hub.models), hub.tgt_dict, num_slots, sampling=sampling, temperature=temperature,
+        )
+        self.eos = hub.tgt_dict.eos()
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.max_len = max_len
+
+        self._ids = itertools.count()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task = None
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.latency = AverageMeter()
+        self.queue_time = AverageMeter()
+        self.first_token_latency = AverageMeter()
+        self.throughput = TimeMeter()
+        self.num_completed = 0
+        self.num_timed_out = 0
+        self.num_rejected = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.throughput.reset()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for future in self._futures.values():
+            if not future.done():
+                future.cancel()
+        self._futures.clear()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def generate(self, sentence: str, max_len: Optional[int] = None,
+                       timeout: Optional[float] = None) -> Dict[str, object]:
+        """Continue *sentence*. Returns the hypothesis dict with the decoded
+        ``output`` string."""
+        hypo = await self.generate_tokens(self.hub.encode(sentence), max_len, timeout)
+        hypo['output'] = self.hub.decode(hypo['tokens'])
+        return hypo
+
+    async def generate_tokens(self, tokens: Tensor, max_len: Optional[int] = None,
+                              timeout: Optional[float] = None) -> Dict[str, Tensor]:
+        """Continue the binarized prompt *tokens* (with or without a trailing
+        eos)."""
+        assert self._task is not None, 'the server is not started'
+        prompt = tokens.tolist()
+        if len(prompt) > 0 and prompt[-1] == self.eos:
+            prompt = prompt[:-1]
+        timeout = timeout if timeout is not None else self.timeout
+        request = GenerationRequest(
+            next(self._ids), [self.eos] + prompt, max_len or self.max_len,
+            deadline=time.perf_counter() + timeout if timeout is not None else None,
+        )
+        future = asyncio.get_running_loop().create_future()
+        self._futures[request.id] = future
+        try:
+            self._queue.put_nowait(request)
+        except asyncio.QueueFull:
+            del self._futures[request.id]
+            self.num_rejected += 1
+            raise
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # the client went away, free the slot at the next step
+            request.cancelled = True
+            raise
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            'completed': self.num_completed,
+            'timed_out': self.num_timed_out,
+            'rejected': self.num_rejected,
+            'active': self.generator.num_active,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'latency': self.latency.avg,
+            'queue_time': self.queue_time.avg,
+            'first_token_latency': self.first_token_latency.avg,
+            'tokens_per_second': self.throughput.avg,
+        }
+
+    def _admit(self, request: GenerationRequest):
+        if request.cancelled or request.expired(time.perf_counter()):
+            request.timed_out = not request.cancelled
+            self._finish(request)
+        else:
+            self.generator.add(request)
+
+    def _finish(self, request: GenerationRequest):
+        future = self._futures.pop(request.id, None)
+        if future is None or future.done():
+            return
+        if request.timed_out:
+            self.num_timed_out += 1
+            future.set_exception(asyncio.TimeoutError('request {} timed out'.format(request.id)))
+            return
+        self.num_completed += 1
+        self.latency.update(request.finish_time - request.submit_time)
+        self.queue_time.update(request.start_time - request.submit_time)
+        self.first_token_latency.update(request.first_token_time - request.submit_time)
+        self.throughput.update(len(request.tokens))
+        future.set_result(request.result())
+
+    def _fail(self, exc: Exception):
+        """Fail the active, queued and pending requests with *exc* and reset
+        the generator, so that the server keeps serving new requests."""
+        self.generator.reset()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._futures.clear()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.generator.num_active == 0:
+                # idle, wait for work
+                self._admit(await self._queue.get())
+            while self.generator.num_free_slots > 0 and not self._queue.empty():
+                self._admit(self._queue.get_nowait())
+            if self.generator.num_active == 0:
+                continue
+            try:
+                finished = await loop.run_in_executor(
+                    self._executor, self.generator.step, self._queue.empty(),
+                )
+            except Exception as exc:
+                logger.exception('generation step failed')
+                self._fail(exc)
+                continue
+            for request in finished:
+                self._finish(request)
@@ -187,6 +187,13 @@ class GeneratorHubInterface(nn.Module):
                         ))
         return outputs
 
+    def serve(self, num_slots: int = 8, **kwargs):
+        """Returns a :class:`~fairseq.generation_server.GenerationServer`
+        decoding requests for this (language) model with continuous
+        batching."""
+        from fairseq.generation_server import GenerationServer
+        return GenerationServer(self, num_slots=num_slots, **kwargs)
+
     def encode(self, sentence: str) -> torch.LongTensor:
         sentence = self.tokenize(sentence)
         sentence = self.apply_bpe(sentence)
@@ -0,0 +1,60 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import OrderedDict
+
+import torch
+
+
+class ModelEMA(object):
+    """Exponential moving average of the weights of a model.
+
+    The average is kept in fp32 on the device of the model and updated after
+    every optimizer step with ``ema = decay * ema + (1 - decay) * weights``.
+    Non floating point entries of the state dict (e.g. counters) are copied.
+
+    Args:
+        model (nn.Module): the model to average
+        decay (float): decay of the moving average
+    """
+
+    def __init__(self, model, decay):
+        assert 0.0 < decay < 1.0
+        self.decay = decay
+        self.num_updates = 0
+        with torch.no_grad():
+            self.params = OrderedDict(
+                (name, p.detach().float().clone() if p.is_floating_point() else p.detach().clone())
+                for name, p in model.state_dict().items()
+            )
+
+    @torch.no_grad()
+    def update(self, model):
+        ema, weights = [], []
+        for name, p in model.state_dict().items():
+            e = self.params[name]
+            if e.is_floating_point():
+                ema.append(e)
+                weights.append(p.detach().to(e.dtype))
+            else:
+                e.copy_(p)
+        if hasattr(torch, '_foreach_mul_'):
+            torch._foreach_mul_(ema, self.decay)
+            torch._foreach_add_(ema, weights, alpha=1.0 - self.decay)
+        else:
+            for e, p in zip(ema, weights):
+                e.mul_(self.decay).add_(p, alpha=1.0 - self.decay)
+        self.num_updates += 1
+
+    def state_dict(self):
+        return {'decay': self.decay, 'num_updates': self.num_updates, 'model': self.params}
+
+    def load_state_dict(self, state_dict):
+        self.num_updates = state_dict['num_updates']
+        for name, p in state_dict['model'].items():
+            if name in self.params:
+                self.params[name].copy_(p)
+
+    def copy_to(self, model):
+        """Loads the averaged weights into *model*."""
+        model.load_state_dict(self.params)
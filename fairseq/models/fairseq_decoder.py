@@ -78,6 +78,25 @@ class FairseqDecoder(nn.Module):
         else:
             return utils.softmax(logits, dim=-1, onnx_trace=self.onnx_trace)
 
+    def get_target_log_probs(self, features: Tensor, target: Tensor, vocab_block_size: int = 8192):
+        """Get the log probs of *target* from the features returned with
+        ``features_only=True``, without normalizing over the full vocabulary
+        at once: adaptive softmax tails are only evaluated where needed and a
+        linear ``output_projection`` is streamed in blocks of
+        *vocab_block_size* words."""
+
+        if hasattr(self, "adaptive_softmax") and self.adaptive_softmax is not None:
+            return self.adaptive_softmax.get_target_log_prob(features, target)
+
+        output_projection = getattr(self, "output_projection", None)
+        if isinstance(output_projection, nn.Linear):
+            return utils.blockwise_target_log_softmax(
+                features, output_projection.weight, target, output_projection.bias, vocab_block_size,
+            )
+
+        lprobs = self.get_normalized_probs((self.output_layer(features), None), log_probs=True)
+        return lprobs.gather(dim=-1, index=target.unsqueeze(-1)).squeeze(-1)
+
     def max_positions(self):
         """Maximum input length supported by the decoder."""
         return 1e6  # an arbitrary large number
@@ -97,6 +97,38 @@ class FairseqIncrementalDecoder(FairseqDecoder):
                 if result is not None:
                     incremental_state = result
 
+    def reset_incremental_state(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        reset_mask: Tensor,
+    ):
+        """Reset the incremental state of some batch elements.
+
+        This will be called when new sequences replace finished ones in a
+        persistent batch, e.g. when streaming documents through a fixed number
+        of lanes. *reset_mask* is a BoolTensor of shape `(batch)` where the
+        elements to reset to the initial state are indicated by 1s.
+        """
+        pass
+
+    def reset_incremental_state_scripting(
+        self,
+        incremental_state: Dict[str, Dict[str, Optional[Tensor]]],
+        reset_mask: Tensor,
+    ):
+        """Main entry point for resetting the incremental state of some batch
+        elements. Modules that keep an incremental state must implement
+        :func:`reset_incremental_state` to support it."""
+        for module in self.modules():
+            if hasattr(module, 'reset_incremental_state'):
+                result = module.reset_incremental_state(incremental_state, reset_mask)
+                if result is not None:
+                    incremental_state = result
+            elif hasattr(module, 'reorder_incremental_state'):
+                raise NotImplementedError(
+                    '{} does not support resetting its incremental state'.format(module.__class__.__name__)
+                )
+
     def set_beam_size(self, beam_size):
         """Sets the beam size in the decoder and all children."""
         if getattr(self, '_beam_size', -1) != beam_size:
@@ -3,7 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Tuple, List, Union
+from typing import Optional, Tuple, List, Union
 import math
 
 import torch
@@ -37,6 +37,7 @@ class MegaLRAEncoder(nn.Module):
         attention_dropout: float = 0.0,
         hidden_dropout: float = 0.0,
         efficient_attn: bool = False,
+        attention_block_size: Optional[int] = None,
         chunk_size: int = -1,
         moving_layer: str = 'cema',
         moving_act='rmsnorm',
@@ -91,6 +92,7 @@ class MegaLRAEncoder(nn.Module):
                 attention_dropout=attention_dropout,
                 hidden_dropout=hidden_dropout,
                 efficient_attn=efficient_attn,
+                attention_block_size=attention_block_size,
                 chunk_size=chunk_size,
                 moving_layer=moving_layer,
                 moving_act=moving_act,
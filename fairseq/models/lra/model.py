@@ -118,6 +118,9 @@ class LRAModel(FairseqEncoderModel):
         parser.add_argument('--rel-pos-bias', choices=['simple', 'rotary'], default='rotary')
         parser.add_argument('--efficient-attention', default=False, action='store_true',
                             help='use efficient attention')
+        parser.add_argument('--attention-block-size', type=int, metavar='N', default=None,
+                            help='compute the attention over blocks of N queries and keys with a memory-efficient '
+                                 'pure-PyTorch implementation.')
 
         # Arguments related to sentence level prediction
         parser.add_argument('--sentence-class-num', type=int, metavar='N',
@@ -305,6 +308,7 @@ class LRAEncoder(FairseqEncoder):
                 attention_dropout=args.attention_dropout,
                 hidden_dropout=args.act_dropout,
                 efficient_attn=args.efficient_attention,
+                attention_block_size=getattr(args, 'attention_block_size', None),
                 chunk_size=getattr(args, 'chunk_size', -1),
                 moving_layer=args.moving_layer,
                 moving_act=args.moving_act,
@@ -380,6 +384,7 @@ def base_architecture(args):
     args.attention_activation_fn = getattr(args, 'attention_activation_fn', 'softmax')
     args.moving_act = getattr(args, 'moving_act', 'rmsnorm')
     args.efficient_attention = getattr(args, 'efficient_attention', False)
+    args.attention_block_size = getattr(args, 'attention_block_size', None)
 
     args.norm_type = getattr(args, 'norm_type', 'layernorm')
     args.no_affine_norm = getattr(args, 'no_affine_norm', False)
@@ -127,6 +127,10 @@ class LunaModel(FairseqEncoderDecoderModel):
                             help='fix projection length for all input sequences')
         parser.add_argument('--untie-luna-kv', action='store_true',
                             help='Untie key and value parameters in Luna attention')
+        parser.add_argument('--luna-causal-attention', choices=['seq', 'parallel', 'chunked'],
+                            help='implementation of the causal linear attention of the decoder')
+        parser.add_argument('--luna-causal-chunk-size', type=int, metavar='N',
+                            help='number of steps in each chunk of the chunked causal attention')
         parser.add_argument('--share-decoder-input-output-embed', action='store_true',
                             help='share decoder input and output embeddings')
         parser.add_argument('--share-all-embeddings', action='store_true',
@@ -953,6 +957,8 @@ def base_architecture(args):
     args.projection_length = getattr(args, 'projection_length', 32)
     args.fix_projection_length = getattr(args, "fix_projection_length", False)
     args.untie_luna_kv = getattr(args, "untie_luna_kv", False)
+    args.luna_causal_attention = getattr(args, "luna_causal_attention", "parallel")
+    args.luna_causal_chunk_size = getattr(args, "luna_causal_chunk_size", 64)
 
     args.attention_dropout = getattr(args, "attention_dropout", 0.0)
     args.activation_dropout = getattr(args, "activation_dropout", 0.0)
@@ -109,8 +109,14 @@ class MegaLanguageModel(FairseqLanguageModel):
         parser.add_argument('--moving-layer', choices=['ema', 'cema'], default='cema')
         parser.add_argument('--truncation-length', type=int, metavar='N', default=0,
                             help='truncation length of moving average layer.')
+        parser.add_argument('--ema-scan-chunk-size', type=int, metavar='N', default=None,
+                            help='compute the incremental EMA state with a chunk-parallel scan '
+                                 'over chunks of this size (for long prompts).')
         parser.add_argument('--efficient-attention', default=False, action='store_true',
                             help='use efficient attention')
+        parser.add_argument('--attention-block-size', type=int, metavar='N', default=None,
+                            help='compute the attention over blocks of N queries and keys with a memory-efficient '
+                                 'pure-PyTorch implementation.')
         parser.add_argument('--norm-type', choices=['layernorm', 'rmsnorm'], default='layernorm')
         parser.add_argument('--norm-num-groups', type=int, default=None, help='normalization eps')
         parser.add_argument('--norm-eps', type=float, default=1e-5, help='normalization eps')
@@ -433,6 +439,7 @@ def base_lm_architecture(args):
 
     args.rel_pos_bias = getattr(args, 'rel_pos_bias', 'rotary')
     args.efficient_attention = getattr(args, 'efficient_attention', False)
+    args.attention_block_size = getattr(args, 'attention_block_size', None)
 
     args.adaptive_input = getattr(args, 'adaptive_input', False)
     args.adaptive_input_factor = getattr(args, 'adaptive_input_factor', 4)
@@ -444,6 +451,7 @@ def base_lm_architecture(args):
     args.attention_activation_fn = getattr(args, 'attention_activation_fn', 'softmax')
     args.moving_layer = getattr(args, 'moving_layer', 'cema')
     args.truncation_length = getattr(args, 'truncation_length', 0)
+    args.ema_scan_chunk_size = getattr(args, 'ema_scan_chunk_size', None)
     args.tie_adaptive_weights = getattr(args, "tie_adaptive_weights", False)
 
     args.norm_type = getattr(args, 'norm_type', 'layernorm')
@@ -0,0 +1,359 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from functools import partial
+
+import torch
+import torch.nn as nn
+
+from fairseq.logging import metrics
+
+try:
+    import resource
+
+    has_resource = True
+except ImportError:
+    has_resource = False
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MODULE_TYPES = (
+    'MovingAverageGatedAttention',
+    'MultiHeadEMA',
+    'MultiHeadComplexEMA',
+    'NormalizedFeedForwardNetwork',
+    'TimestepNorm',
+    'SequenceNorm',
+)
+
+REPORT_COLUMNS = (
+    'module', 'type', 'calls', 'fwd_ms', 'bwd_ms', 'total_ms', 'peak_mb', 'cpu_peak_mb', 'gflops', 'tflops_per_s',
+)
+
+
+def _ema_flops(module, inputs, output):
+    # FFT convolution: three real FFTs of length 2L for every channel
+    bsz, embed_dim, seq_len = inputs[0].size()
+    fft_len = 2 * seq_len
+    return 7.5 * fft_len * math.log2(fft_len) * bsz * embed_dim
+
+
+def _gated_attention_flops(module, inputs, output):
+    # query-key products and attention over the values, the projections
+    # are counted by the nn.Linear submodules
+    bsz, seq_len, _ = inputs[0].size()
+    key_len = seq_len if module.chunk_size <= 0 else min(module.chunk_size, seq_len)
+    return 2.0 * bsz * seq_len * key_len * (module.zdim + module.hdim)
+
+
+# FLOP estimates of the forward pass, in addition to the nn.Linear submodules
+FLOP_ESTIMATORS = {
+    'MultiHeadEMA': _ema_flops,
+    'MultiHeadComplexEMA': _ema_flops,
+    'MovingAverageGatedAttention': _gated_attention_flops,
+}
+
+
+def _tensors(x):
+    if torch.is_tensor(x):
+        yield x
+    elif isinstance(x, (list, tuple)):
+        for v in x:
+            yield from _tensors(v)
+    elif isinstance(x, dict):
+        for v in x.values():
+            yield from _tensors(v)
+
+
+def _max_rss_mb():
+    if not has_resource:
+        return 0.0
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class ModuleStats(object):
+
+    __slots__ = ('type', 'calls', 'fwd_time', 'bwd_time', 'peak_mem', 'cpu_peak_mem', 'flops')
+
+    def __init__(self, module_type):
+        self.type = module_type
+        self.calls = 0
+        self.fwd_time = 0.0
+        self.bwd_time = 0.0
+        self.peak_mem = 0.0
+        self.cpu_peak_mem = 0.0
+        self.flops = 0.0
+
+    def update(self, other):
+        self.calls += other.calls
+        self.fwd_time += other.fwd_time
+        self.bwd_time += other.bwd_time
+        self.peak_mem = max(self.peak_mem, other.peak_mem)
+        self.cpu_peak_mem = max(self.cpu_peak_mem, other.cpu_peak_mem)
+        self.flops += other.flops
+
+
+class _Frame(object):
+    """A forward call of a profiled module."""
+
+    __slots__ = ('name', 'start', 'mem', 'peak', 'cpu_mem', 'flops', 'bwd_start', 'bwd_end')
+
+    def __init__(self, name, start, mem, cpu_mem):
+        self.name = name
+        self.start = start
+        self.mem = mem
+        self.peak = mem
+        self.cpu_mem = cpu_mem
+        self.flops = 0.0
+        self.bwd_start = None
+        self.bwd_end = None
+
+
+class ModuleProfiler(object):
+    """Measures the forward and backward wall time, the memory high-water mark
+    and a FLOP estimate of the submodules of *model* whose class (or one of
+    its base classes) is named in *module_types*.
+
+    The hooks do nothing outside of :func:`start_step` and :func:`end_step`,
+    so profiling one update every N updates has a negligible cost. The times
+    include the nested submodules and, on CUDA, the hooks synchronize the
+    device. The backward time of a module is measured between the gradient
+    hooks of its outputs and inputs.
+
+    Args:
+        model (nn.Module): the model to profile
+        module_types (List[str], optional): class names of the modules to
+            profile (default: the Mega layers and normalization modules)
+        device (torch.device, optional): device of the model
+    """
+
+    def __init__(self, model, module_types=DEFAULT_MODULE_TYPES, device=None):
+        self.enabled = False
+        if device is None:
+            param = next(model.parameters(), None)
+            device = param.device if param is not None else torch.device('cpu')
+        self.cuda = device.type == 'cuda'
+        self.module_types = set(module_types)
+        self.num_steps = 0
+        self.stats = OrderedDict()
+        self._step_stats = OrderedDict()
+        self._active = []
+        self._frames = []
+        self._hooks = []
+
+        for name, module in model.named_modules():
+            if self._profiled_type(module) is not None:
+                self.stats[name] = ModuleStats(type(module).__name__)
+                self._hooks.append(module.register_forward_pre_hook(partial(self._forward_pre_hook, name)))
+                self._hooks.append(module.register_forward_hook(partial(self._forward_hook, name)))
+            elif isinstance(module, nn.Linear):
+                self._hooks.append(module.register_forward_hook(self._linear_hook))
+        if len(self.stats) == 0:
+            logger.warning('no module to profile, --profile-modules: {}'.format(','.join(module_types)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _profiled_type(self, module):
+        for cls in type(module).__mro__:
+            if cls.__name__ in self.module_types:
+                return cls.__name__
+        return None
+
+    def _synchronize(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _memory_allocated(self):
+        return torch.cuda.memory_allocated() if self.cuda else 0
+
+    def _update_peaks(self):
+        # the peak is reset when a module starts, so it is propagated to all
+        # the modules running their forward
+        if self.cuda:
+            peak = torch.cuda.max_memory_allocated()
+            for frame in self._active:
+                frame.peak = max(frame.peak, peak)
+            torch.cuda.reset_peak_memory_stats()
+
+    def _get_stats(self, name, module_type):
+        if name not in self._step_stats:
+            self._step_stats[name] = ModuleStats(module_type)
+        return self._step_stats[name]
+
+    def _forward_pre_hook(self, name, module, inputs):
+        if not self.enabled:
+            return
+        self._update_peaks()
+        self._synchronize()
+        frame = _Frame(name, time.perf_counter(), self._memory_allocated(), _max_rss_mb())
+        if torch.is_grad_enabled():
+            for x in _tensors(inputs):
+                if x.requires_grad:
+                    x.register_hook(partial(self._backward_end_hook, frame))
+        self._active.append(frame)
+
+    def _forward_hook(self, name, module, inputs, output):
+        if not self.enabled or len(self._active) == 0 or self._active[-1].name != name:
+            return
+        self._update_peaks()
+        self._synchronize()
+        end = time.perf_counter()
+        frame = self._active.pop()
+        estimator = FLOP_ESTIMATORS.get(type(module).__name__, None)
+        if estimator is not None:
+            frame.flops += estimator(module, inputs, output)
+        if len(self._active) > 0:
+            self._active[-1].flops += frame.flops
+
+        stats = self._get_stats(name, type(module).__name__)
+        stats.calls += 1
+        stats.fwd_time += end - frame.start
+        stats.peak_mem = max(stats.peak_mem, (frame.peak - frame.mem) / 2 ** 20)
+        stats.cpu_peak_mem = max(stats.cpu_peak_mem, _max_rss_mb() - frame.cpu_mem)
+        stats.flops += frame.flops
+
+        if torch.is_grad_enabled():
+            for y in _tensors(output):
+                if y.requires_grad:
+                    y.register_hook(partial(self._backward_start_hook, frame))
+        self._frames.append(frame)
+
+    def _linear_hook(self, module, inputs, output):
+        if self.enabled and len(self._active) > 0:
+            self._active[-1].flops += 2.0 * output.numel() * module.in_features
+
+    def _backward_start_hook(self, frame, grad):
+        if self.enabled and frame.bwd_start is None:
+            self._synchronize()
+            frame.bwd_start = time.perf_counter()
+
+    def _backward_end_hook(self, frame, grad):
+        if self.enabled:
+            self._synchronize()
+            frame.bwd_end = time.perf_counter()
+
+    def start_step(self):
+        """Enables the hooks for the next forward and backward passes."""
+        self._active = []
+        self._frames = []
+        self._step_stats = OrderedDict()
+        self.enabled = True
+
+    def cancel_step(self):
+        """Disables the hooks and discards the statistics of the step, e.g.
+        after an OOM."""
+        self.enabled = False
+        self._active = []
+        self._frames = []
+        self._step_stats = OrderedDict()
+
+    @contextlib.contextmanager
+    def record(self, name):
+        """Profiles a block of code outside of the modules, e.g. the optimizer
+        step, reported under *name*."""
+        if not self.enabled:
+            yield
+            return
+        self._synchronize()
+        start = time.perf_counter()
+        yield
+        self._synchronize()
+        stats = self._get_stats(name, name)
+        stats.calls += 1
+        stats.fwd_time += time.perf_counter() - start
+
+    def end_step(self, log_metrics=True):
+        """Disables the hooks and accumulates the statistics of the step.
+
+        Args:
+            log_metrics (bool, optional): log the time, memory and FLOPs of
+                every module type to :mod:`fairseq.logging.metrics`
+                (default: True)
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        for frame in self._frames:
+            if frame.bwd_start is not None and frame.bwd_end is not None:
+                self._step_stats[frame.name].bwd_time += max(frame.bwd_end - frame.bwd_start, 0.0)
+        self._frames = []
+        self._active = []
+
+        for name, stats in self._step_stats.items():
+            if name not in self.stats:
+                self.stats[name] = ModuleStats(stats.type)
+            self.stats[name].update(stats)
+        self.num_steps += 1
+
+        if log_metrics:
+            by_type = OrderedDict()
+            for stats in self._step_stats.values():
+                if stats.type not in by_type:
+                    by_type[stats.type] = ModuleStats(stats.type)
+                by_type[stats.type].update(stats)
+            for module_type, stats in by_type.items():
+                prefix = 'prof_' + module_type
+                metrics.log_scalar(prefix + '_fwd_ms', stats.fwd_time * 1000, priority=900, round=2)
+                if stats.bwd_time > 0:
+                    metrics.log_scalar(prefix + '_bwd_ms', stats.bwd_time * 1000, priority=900, round=2)
+                if stats.peak_mem > 0:
+                    metrics.log_scalar(prefix + '_peak_mb', stats.peak_mem, priority=900, round=1)
+                if stats.flops > 0:
+                    metrics.log_scalar(prefix + '_gflops', stats.flops / 1e9, priority=900, round=2)
+
+    def report(self, sort_by='total_ms'):
+        """Returns the statistics of every module, averaged over the profiled
+        steps and sorted by *sort_by* in decreasing order."""
+        num_steps = max(self.num_steps, 1)
+        rows = []
+        for name, stats in self.stats.items():
+            if stats.calls == 0:
+                continue
+            total_time = stats.fwd_time + stats.bwd_time
+            rows.append(OrderedDict([
+                ('module', name),
+                ('type', stats.type),
+                ('calls', stats.calls / num_steps),
+                ('fwd_ms', stats.fwd_time * 1000 / num_steps),
+                ('bwd_ms', stats.bwd_time * 1000 / num_steps),
+                ('total_ms', total_time * 1000 / num_steps),
+                ('peak_mb', stats.peak_mem),
+                ('cpu_peak_mb', stats.cpu_peak_mem),
+                ('gflops', stats.flops / 1e9 / num_steps),
+                ('tflops_per_s', stats.flops / 1e12 / stats.fwd_time if stats.fwd_time > 0 else 0.0),
+            ]))
+        if sort_by not in REPORT_COLUMNS:
+            raise ValueError('unknown report column: {}'.format(sort_by))
+        reverse = sort_by not in ('module', 'type')
+        return sorted(rows, key=lambda row: row[sort_by], reverse=reverse)
+
+    def format_report(self, sort_by='total_ms'):
+        lines = ['\t'.join(REPORT_COLUMNS)]
+        for row in self.report(sort_by):
+            lines.append('\t'.join(
+                '{:.3f}'.format(v) if isinstance(v, float) else str(v) for v in row.values()
+            ))
+        return '\n'.join(lines) + '\n'
+
+    def dump_report(self, path, sort_by='total_ms'):
+        """Writes the report to *path* as tab separated values."""
+        with open(path, 'w') as f:
+            f.write(self.format_report(sort_by))
+
+    def close(self):
+        self.enabled = False
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
@@ -212,3 +212,28 @@ class AdaptiveSoftmax(nn.Module):
 
         log_probs = log_probs.view(bsz, length, -1)
         return log_probs
+
+    def get_target_log_prob(self, input, target):
+        """
+        Computes the log probabilities of the targets only, given a 3D tensor
+        of hidden vectors. The tail clusters are only evaluated for the
+        positions whose target falls into them, and the full vocabulary
+        distribution is never built.
+        """
+
+        bsz, length, dim = input.size()
+        input = input.contiguous().view(-1, dim)
+
+        new_target, target_idxs = self.adapt_target(target)
+
+        head_lprobs = self.lsm(self.head(input))
+        # log-prob of the word, or of its cluster for words in the tail
+        out = head_lprobs.gather(1, new_target[0].unsqueeze(1)).squeeze(1)
+
+        for i in range(len(self.tail)):
+            if target_idxs[i] is not None:
+                idxs = target_idxs[i]
+                tail_lprobs = self.lsm(self.tail[i](input[idxs]))
+                out[idxs] += tail_lprobs.gather(1, new_target[i + 1].unsqueeze(1)).squeeze(1)
+
+        return out.view(bsz, length)
@@ -5,7 +5,7 @@ import torch.nn as nn
 
 from torch.autograd.function import FunctionCtx
 
-import fairseq.mega2_extension.ops as mega2_ops
+from fairseq.modules.fused_ops.backend import mega2_ops, register_reference_op, use_extension
 
 
 class AttentionSoftmaxFunc(torch.autograd.Function):
@@ -38,7 +38,56 @@ class AttentionSoftmaxFunc(torch.autograd.Function):
         return x_grad, None, None, None
 
 
-attention_softmax = AttentionSoftmaxFunc.apply
+def _causal_mask(
+    outer_size: int, inner_size: int, device: torch.device, row_offset: int = 0, total_rows: int = -1
+) -> torch.Tensor:
+    # row r of the full outer_size x inner_size score matrix attends to the first inner_size - total_rows + r + 1 keys.
+    total_rows = outer_size if total_rows < 0 else total_rows
+    mask = torch.ones(outer_size, inner_size, dtype=torch.bool, device=device)
+    return mask.triu(inner_size - total_rows + row_offset + 1)
+
+
+@register_reference_op('attention_softmax')
+def attention_softmax_reference(
+    x: torch.Tensor,
+    dropout: float = 0.0,
+    use_causal_mask: bool = True,
+    training: bool = True,
+    row_offset: int = 0,
+    total_rows: int = -1,
+) -> torch.Tensor:
+    """Softmax over the last dim with the same semantics as the fused kernel:
+    an optional causal mask, drop-key dropout (dropped keys are masked out
+    before the softmax, no rescaling) and all-zero rows for rows without any
+    visible key.
+
+    ``row_offset`` and ``total_rows`` locate x inside a larger score matrix
+    when the rows are processed in chunks.
+    """
+    dtype = x.dtype
+    x = x.float()
+    if use_causal_mask:
+        mask = _causal_mask(x.size(-2), x.size(-1), x.device, row_offset, total_rows)
+        x = x.masked_fill(mask, float('-inf'))
+    if training and dropout > 0.0:
+        x = x.masked_fill(torch.rand_like(x) < dropout, float('-inf'))
+    m = x.detach().amax(dim=-1, keepdim=True)
+    m = m.masked_fill(torch.isinf(m), 0.0)
+    y = torch.exp(x - m)
+    s = y.sum(dim=-1, keepdim=True)
+    y = y / s.masked_fill(s == 0.0, 1.0)
+    return y.to(dtype)
+
+
+def attention_softmax(
+    x: torch.Tensor,
+    dropout: float = 0.0,
+    use_causal_mask: bool = True,
+    training: bool = True
+) -> torch.Tensor:
+    if use_extension(x, cuda_only=True):
+        return AttentionSoftmaxFunc.apply(x, dropout, use_causal_mask, training)
+    return attention_softmax_reference(x, dropout, use_causal_mask, training)
 
 
 class AttentionSoftmax(nn.Module):
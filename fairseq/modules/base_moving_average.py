@@ -11,8 +11,9 @@ import torch.nn.functional as F
 from torch import Tensor, nn
 
 from fairseq.incremental_decoding_utils import with_incremental_state
-from .fused_ops.fftconv import fftconv, bidirectional_fftconv
+from .fused_ops.fftconv import fftconv, fftconv_with_kernel_f, bidirectional_fftconv
 from .fused_ops.ema_hidden import ema_hidden
+from .fused_ops.ema_scan import ema_chunked_scan
 
 
 @with_incremental_state
@@ -20,7 +21,7 @@ class BaseMovingLayer(nn.Module):
     """Base Class for Moving Layers
     """
 
-    def __init__(self, bidirectional=False, truncation=None, shift=True):
+    def __init__(self, bidirectional=False, truncation=None, shift=True, scan_chunk_size=None):
         super().__init__()
         self._parameters_no_weight_decay = OrderedDict()
         self.complex = False
@@ -29,6 +30,11 @@ class BaseMovingLayer(nn.Module):
         self.shift = shift
         assert self.bidirectional or (self.truncation is None or self.truncation < 1), \
             'one directional moving average should not have positive trunction: {}'.format(truncation)
+        # incremental calls longer than scan_chunk_size use the chunk-parallel scan
+        self.scan_chunk_size = scan_chunk_size
+        # inference-only cache of convolution kernels, keyed by (name, bucketed length, dtype, device)
+        self.kernel_cache_size = 16
+        self._kernel_cache = OrderedDict()
 
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
@@ -57,10 +63,84 @@ class BaseMovingLayer(nn.Module):
                 self._coeffs = self._calc_coeffs()
             return self._coeffs
 
+    def clear_cache(self):
+        """Drop the memoized coefficients and kernels."""
+        self._coeffs = None
+        self._kernel_cache.clear()
+
+    def train(self, mode: bool = True):
+        self.clear_cache()
+        return super().train(mode)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.clear_cache()
+        return super()._load_from_state_dict(*args, **kwargs)
+
+    def use_cache(self) -> bool:
+        # kernels are only memoized for inference, where parameters are frozen and no graph is built.
+        return not self.training and not torch.is_grad_enabled()
+
     def kernel(self, length: int, hx: Optional[Tensor]):
         kernel_size = length if self.truncation is None or self.truncation < 1 else min(self.truncation, length)
+        if hx is None and self.use_cache():
+            return self._cached_kernel(kernel_size), None
         return self._compute_kernel(kernel_size, hx)
 
+    def kernel_f(self, length: int) -> Tensor:
+        """rfft of the (cached) kernel for inputs of the given length, padded to
+        the FFT size used by :func:`fftconv_with_kernel_f`. Inference only."""
+        fft_size = 2 * (1 << (length - 1).bit_length())
+        key = ('kernel_f', fft_size, self.gamma.dtype, self.gamma.device)
+        k_f = self._kernel_cache.get(key, None)
+        if k_f is None:
+            k = self._cached_kernel(fft_size // 2)
+            k_f = torch.fft.rfft(k.float(), n=fft_size, norm="forward")
+            self._put_cache(key, k_f)
+        else:
+            self._kernel_cache.move_to_end(key)
+        return k_f
+
+    def _cached_kernel(self, length: int) -> Tensor:
+        # kernel[:, j] only depends on j, so the prefix of a longer kernel is exact.
+        return self._cached_prefix('kernel', length, lambda n: self._compute_kernel(n, None)[0])
+
+    def _cached_bias(self, length: int, hx: Tensor) -> Tensor:
+        """Contribution of the carried hidden state hx (B x D x N) to the next length outputs."""
+        def _bias_vander(n):
+            p, q, gamma = self.coeffs()
+            # D x N x L, gamma * q^(j+1)
+            exponents = torch.arange(1, n + 1, dtype=p.dtype, device=p.device)
+            return torch.exp(torch.log(q) * exponents) * gamma.unsqueeze(-1)
+
+        vander = self._cached_prefix('bias', length, _bias_vander)
+        # B x D x L
+        bias = torch.einsum('bdn,dnl->bdl', hx, vander)
+        if bias.is_complex():
+            bias = bias.real
+        return bias
+
+    def _cached_prefix(self, name: str, length: int, compute_fn) -> Tensor:
+        param = self.gamma
+        for key, value in self._kernel_cache.items():
+            if key[0] == name and key[1] >= length and key[2] == param.dtype and key[3] == param.device:
+                self._kernel_cache.move_to_end(key)
+                return value[..., :length]
+
+        # round up to the next power of two so that nearby lengths share one entry.
+        bucket = 1 << (length - 1).bit_length()
+        value = compute_fn(bucket)
+        # shorter entries on the same dtype and device are prefixes of the new one.
+        for key in list(self._kernel_cache.keys()):
+            if key[0] == name and key[2] == param.dtype and key[3] == param.device:
+                del self._kernel_cache[key]
+        self._put_cache((name, bucket, param.dtype, param.device), value)
+        return value[..., :length]
+
+    def _put_cache(self, key, value: Tensor):
+        self._kernel_cache[key] = value
+        while len(self._kernel_cache) > self.kernel_cache_size:
+            self._kernel_cache.popitem(last=False)
+
     def step(self, x, length, hx=None):
         if length == 1:
             return self.one_step(x, hx=hx)
@@ -135,7 +215,7 @@ class BaseMovingLayer(nn.Module):
         assert embed_dim == self.embed_dim
 
         # B x D x L
-        residual = x * self.omega
+        residual = x * self.omega.view(embed_dim, 1)
 
         if padding_mask is not None:
             x = x * (1.0 - padding_mask.unsqueeze(1).to(x))
@@ -150,23 +230,35 @@ class BaseMovingLayer(nn.Module):
             # out, h = self.step(x.float(), seq_len, hx=h)
             # out = out.to(x)
             # D x N x 1
-            p, q, _ = self.coeffs()
-            k, b = self.kernel(seq_len, hx=h)
-            out = fftconv(x, k)
-            if b is not None:
-                out = out + b
-            h = ema_hidden(x, p, q, h)
+            p, q, gamma = self.coeffs()
+            if self.scan_chunk_size is not None and 0 < self.scan_chunk_size < seq_len:
+                # B x D x L, B x D x N
+                out, h = ema_chunked_scan(x, p, q, gamma, h, self.scan_chunk_size)
+            else:
+                if self.use_cache():
+                    out = fftconv_with_kernel_f(x, self.kernel_f(seq_len))
+                    if h is not None:
+                        out = out + self._cached_bias(seq_len, h).to(out)
+                else:
+                    k, b = self.kernel(seq_len, hx=h)
+                    out = fftconv(x, k)
+                    if b is not None:
+                        out = out + b
+                h = ema_hidden(x, p, q, h)
             saved_state['prev_state'] = h
             self._set_input_buffer(incremental_state, saved_state)
         else:
-            # D x L
-            k, b = self.kernel(seq_len, None)
-            assert b is None
             # B x D x L
-            if self.bidirectional:
-                out = bidirectional_fftconv(x, k, self.shift)
+            if not self.bidirectional and self.use_cache():
+                out = fftconv_with_kernel_f(x, self.kernel_f(seq_len))
             else:
-                out = fftconv(x, k)
+                # D x L
+                k, b = self.kernel(seq_len, None)
+                assert b is None
+                if self.bidirectional:
+                    out = bidirectional_fftconv(x, k, self.shift)
+                else:
+                    out = fftconv(x, k)
 
         out = out + residual
         return out
@@ -195,3 +287,16 @@ class BaseMovingLayer(nn.Module):
                     input_buffer[k] = input_buffer_k.index_select(0, new_order)
             incremental_state = self._set_input_buffer(incremental_state, input_buffer)
         return incremental_state
+
+    @torch.jit.export
+    def reset_incremental_state(
+            self, incremental_state: Dict[str, Dict[str, Optional[Tensor]]], reset_mask: Tensor
+    ):
+        """Reset the hidden state of the batch elements in reset_mask to zeros."""
+        input_buffer = self._get_input_buffer(incremental_state)
+        prev_state = input_buffer.get('prev_state', None)
+        if prev_state is not None:
+            # B x D x N
+            input_buffer['prev_state'] = prev_state.masked_fill(reset_mask.view(-1, 1, 1), 0.)
+            incremental_state = self._set_input_buffer(incremental_state, input_buffer)
+        return incremental_state
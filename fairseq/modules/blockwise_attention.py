@@ -0,0 +1,294 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import List, Optional, Tuple
+
+import torch
+
+from torch.autograd.function import FunctionCtx
+
+
+# constants of the approximate laplace attention function, see utils.laplace
+_LAPLACE_MU = 0.707107
+_LAPLACE_ALPHA = 1.702 / 0.282095
+
+
+def _activation(s: torch.Tensor, activation: str) -> torch.Tensor:
+    if activation == 'relu2':
+        return torch.square(torch.relu(s))
+    elif activation == 'laplace':
+        return torch.sigmoid((s - _LAPLACE_MU) * _LAPLACE_ALPHA)
+    else:
+        raise ValueError('Unknown attention activation function: {}'.format(activation))
+
+
+def _activation_grad(s: torch.Tensor, activation: str) -> torch.Tensor:
+    if activation == 'relu2':
+        return 2.0 * torch.relu(s)
+    elif activation == 'laplace':
+        y = torch.sigmoid((s - _LAPLACE_MU) * _LAPLACE_ALPHA)
+        return y * (1.0 - y) * _LAPLACE_ALPHA
+    else:
+        raise ValueError('Unknown attention activation function: {}'.format(activation))
+
+
+class _Tiles(object):
+    """Iterates over the (query block, key block) tiles of an attention and
+    recomputes their scores, masks and dropout masks."""
+
+    def __init__(self, q, k, rel_bias, scale, key_padding_mask, causal, dropout, block_size):
+        self.q = q
+        self.k = k
+        self.rel_bias = rel_bias
+        self.scale = scale
+        self.key_padding_mask = key_padding_mask
+        self.causal = causal
+        self.dropout = dropout
+        self.block_size = block_size
+        # float32 or wider accumulation, double inputs stay double
+        self.acc_dtype = torch.promote_types(q.dtype, torch.float32)
+        self.tgt_len = q.size(1)
+        self.src_len = k.size(1)
+        # the queries are the last tgt_len positions of the keys
+        self.q_offset = self.src_len - self.tgt_len
+        self.bias_offset = (rel_bias.size(0) - 1) // 2 if rel_bias is not None else 0
+
+    def query_blocks(self):
+        for q_start in range(0, self.tgt_len, self.block_size):
+            yield q_start, min(q_start + self.block_size, self.tgt_len)
+
+    def key_blocks(self, q_start: int, q_end: int):
+        # keys after the last query of the block are never visible with a causal mask
+        src_end = min(self.src_len, self.q_offset + q_end) if self.causal else self.src_len
+        for k_start in range(0, src_end, self.block_size):
+            yield k_start, min(k_start + self.block_size, src_end)
+
+    def bias_index(self, q_start: int, q_end: int, k_start: int, k_end: int) -> torch.Tensor:
+        device = self.q.device
+        rows = torch.arange(q_start + self.q_offset, q_end + self.q_offset, device=device)
+        cols = torch.arange(k_start, k_end, device=device)
+        # bias of query i and key j is rel_bias[M - 1 + j - i]
+        return cols.unsqueeze(0) - rows.unsqueeze(1) + self.bias_offset
+
+    def scores(self, q_start: int, q_end: int, k_start: int, k_end: int) -> torch.Tensor:
+        # B x Tq x Tk
+        s = torch.bmm(self.q[:, q_start:q_end], self.k[:, k_start:k_end].transpose(1, 2)).to(self.acc_dtype)
+        if self.scale is not None:
+            s = s * self.row_scale(q_start, q_end)
+        if self.rel_bias is not None:
+            s = s + self.rel_bias[self.bias_index(q_start, q_end, k_start, k_end)].to(self.acc_dtype)
+        return s
+
+    def row_scale(self, q_start: int, q_end: int) -> torch.Tensor:
+        scale = self.scale
+        scale = scale[:, q_start:q_end] if scale.size(1) > 1 else scale
+        return scale.to(self.acc_dtype)
+
+    def mask(self, q_start: int, q_end: int, k_start: int, k_end: int) -> Optional[torch.Tensor]:
+        # B x Tq x Tk (broadcastable) with hidden keys indicated by 1s
+        mask = None
+        if self.key_padding_mask is not None:
+            mask = self.key_padding_mask[:, k_start:k_end].unsqueeze(1)
+        if self.causal and k_end - 1 > q_start + self.q_offset:
+            rows = torch.arange(q_start + self.q_offset, q_end + self.q_offset, device=self.q.device)
+            cols = torch.arange(k_start, k_end, device=self.q.device)
+            future = (cols.unsqueeze(0) > rows.unsqueeze(1)).unsqueeze(0)
+            mask = future if mask is None else torch.logical_or(mask, future)
+        return mask
+
+    def dropout_mask(self, s: torch.Tensor) -> Optional[torch.Tensor]:
+        if self.dropout <= 0.0:
+            return None
+        keep = torch.empty_like(s).bernoulli_(1.0 - self.dropout)
+        return keep.div_(1.0 - self.dropout)
+
+
+def _rng_states(x: torch.Tensor) -> List[torch.Tensor]:
+    states = [torch.get_rng_state()]
+    if x.is_cuda:
+        states.append(torch.cuda.get_rng_state(x.device))
+    return states
+
+
+def _set_rng_states(x: torch.Tensor, states: List[torch.Tensor]):
+    torch.set_rng_state(states[0])
+    if x.is_cuda:
+        torch.cuda.set_rng_state(states[1], x.device)
+
+
+class BlockwiseAttentionFunc(torch.autograd.Function):
+
+    @staticmethod
+    def forward(
+        ctx: FunctionCtx,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        rel_bias: Optional[torch.Tensor],
+        scale: Optional[torch.Tensor],
+        key_padding_mask: Optional[torch.Tensor],
+        causal: bool,
+        activation: str,
+        dropout: float,
+        block_size: int,
+    ) -> torch.Tensor:
+        tiles = _Tiles(q, k, rel_bias, scale, key_padding_mask, causal, dropout, block_size)
+        rng_states = _rng_states(q) if dropout > 0.0 else None
+
+        bsz, tgt_len = q.size(0), q.size(1)
+        out = v.new_empty(bsz, tgt_len, v.size(2))
+        acc_dtype = tiles.acc_dtype
+        lse = q.new_empty(bsz, tgt_len, 1, dtype=acc_dtype) if activation == 'softmax' else None
+        for q_start, q_end in tiles.query_blocks():
+            acc = v.new_zeros(bsz, q_end - q_start, v.size(2), dtype=acc_dtype)
+            if activation == 'softmax':
+                # running max and normalizer of the online softmax
+                m = acc.new_full((bsz, q_end - q_start, 1), float('-inf'))
+                l = acc.new_zeros(bsz, q_end - q_start, 1)
+            for k_start, k_end in tiles.key_blocks(q_start, q_end):
+                s = tiles.scores(q_start, q_end, k_start, k_end)
+                mask = tiles.mask(q_start, q_end, k_start, k_end)
+                if activation == 'softmax':
+                    if mask is not None:
+                        s = s.masked_fill(mask, float('-inf'))
+                    m_new = torch.maximum(m, s.amax(dim=-1, keepdim=True))
+                    # rows without any visible key so far
+                    m_safe = m_new.masked_fill(torch.isinf(m_new), 0.0)
+                    p = torch.exp(s - m_safe)
+                    alpha = torch.exp(m - m_safe)
+                    l = l * alpha + p.sum(dim=-1, keepdim=True)
+                    acc = acc * alpha
+                    m = m_new
+                else:
+                    p = _activation(s, activation)
+                    if mask is not None:
+                        p = p.masked_fill(mask, 0.0)
+                drop = tiles.dropout_mask(p)
+                if drop is not None:
+                    p = p * drop
+                acc = acc + torch.bmm(p.to(v), v[:, k_start:k_end]).to(acc_dtype)
+
+            if activation == 'softmax':
+                # rows without any visible key are all zeros
+                empty = l.eq(0.0)
+                acc = acc / l.masked_fill(empty, 1.0)
+                lse[:, q_start:q_end] = (m + torch.log(l)).masked_fill(empty, float('inf'))
+            out[:, q_start:q_end] = acc.to(out)
+
+        ctx.save_for_backward(q, k, v, rel_bias, scale, key_padding_mask, out, lse)
+        ctx.causal = causal
+        ctx.activation = activation
+        ctx.dropout = dropout
+        ctx.block_size = block_size
+        ctx.rng_states = rng_states
+        return out
+
+    @staticmethod
+    def backward(
+        ctx: FunctionCtx,
+        out_grad: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor],
+               None, None, None, None, None, None]:
+        q, k, v, rel_bias, scale, key_padding_mask, out, lse = ctx.saved_tensors
+        activation = ctx.activation
+        tiles = _Tiles(q, k, rel_bias, scale, key_padding_mask, ctx.causal, ctx.dropout, ctx.block_size)
+
+        acc_dtype = tiles.acc_dtype
+        q_grad = torch.zeros_like(q, dtype=acc_dtype)
+        k_grad = torch.zeros_like(k, dtype=acc_dtype)
+        v_grad = torch.zeros_like(v, dtype=acc_dtype)
+        need_bias_grad = rel_bias is not None and ctx.needs_input_grad[3]
+        bias_grad = torch.zeros_like(rel_bias, dtype=acc_dtype) if need_bias_grad else None
+        if activation == 'softmax':
+            # B x L x 1
+            delta = (out_grad.to(acc_dtype) * out.to(acc_dtype)).sum(dim=-1, keepdim=True)
+
+        devices = [q.device] if q.is_cuda else []
+        with torch.random.fork_rng(devices=devices, enabled=ctx.rng_states is not None):
+            if ctx.rng_states is not None:
+                # replay the dropout masks of the forward pass, tile by tile in the same order
+                _set_rng_states(q, ctx.rng_states)
+            for q_start, q_end in tiles.query_blocks():
+                q_blk = q[:, q_start:q_end]
+                dout = out_grad[:, q_start:q_end]
+                for k_start, k_end in tiles.key_blocks(q_start, q_end):
+                    k_blk = k[:, k_start:k_end]
+                    v_blk = v[:, k_start:k_end]
+                    s = tiles.scores(q_start, q_end, k_start, k_end)
+                    mask = tiles.mask(q_start, q_end, k_start, k_end)
+                    if activation == 'softmax':
+                        if mask is not None:
+                            s = s.masked_fill(mask, float('-inf'))
+                        p = torch.exp(s - lse[:, q_start:q_end])
+                        p_grad_act = None
+                    else:
+                        p = _activation(s, activation)
+                        if mask is not None:
+                            p = p.masked_fill(mask, 0.0)
+                        p_grad_act = _activation_grad(s, activation)
+                    drop = tiles.dropout_mask(p)
+                    pd = p * drop if drop is not None else p
+
+                    v_grad[:, k_start:k_end] += torch.bmm(pd.transpose(1, 2).to(dout), dout).to(acc_dtype)
+                    dp = torch.bmm(dout, v_blk.transpose(1, 2)).to(acc_dtype)
+                    if drop is not None:
+                        dp = dp * drop
+                    if activation == 'softmax':
+                        ds = p * (dp - delta[:, q_start:q_end])
+                    else:
+                        if mask is not None:
+                            dp = dp.masked_fill(mask, 0.0)
+                        ds = dp * p_grad_act
+
+                    if bias_grad is not None:
+                        index = tiles.bias_index(q_start, q_end, k_start, k_end)
+                        bias_grad.index_add_(0, index.reshape(-1), ds.sum(dim=0).reshape(-1))
+                    if scale is not None:
+                        ds = ds * tiles.row_scale(q_start, q_end)
+                    ds = ds.to(q)
+                    q_grad[:, q_start:q_end] += torch.bmm(ds, k_blk).to(acc_dtype)
+                    k_grad[:, k_start:k_end] += torch.bmm(ds.transpose(1, 2), q_blk).to(acc_dtype)
+
+        if bias_grad is not None:
+            bias_grad = bias_grad.to(rel_bias)
+        return q_grad.to(q), k_grad.to(k), v_grad.to(v), bias_grad, None, None, None, None, None, None
+
+
+def blockwise_attention(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    rel_bias: Optional[torch.Tensor] = None,
+    scale: Optional[torch.Tensor] = None,
+    key_padding_mask: Optional[torch.Tensor] = None,
+    causal: bool = False,
+    activation: str = 'softmax',
+    dropout: float = 0.0,
+    block_size: int = 256,
+) -> torch.Tensor:
+    """Attention computed over tiles of ``block_size`` queries x
+    ``block_size`` keys, with an online softmax for ``softmax``. The score
+    matrix is never materialized: the backward pass recomputes the tiles
+    (replaying the dropout masks), so memory is linear in the sequence length.
+
+    scores[b, i, j] = (q[b, i] . k[b, j]) * scale[b, i] + rel_bias[M - 1 + j - i']
+
+    where i' is the position of query i among the keys (queries are the last
+    Lq positions) and rel_bias holds 2M - 1 relative position biases.
+
+    Args:
+        q: B x Lq x S
+        k: B x Lk x S
+        v: B x Lk x E
+        rel_bias: 2M-1 relative positional biases, optional.
+        scale: row scales broadcastable to B x Lq x 1, optional.
+        key_padding_mask: B x Lk with padded keys indicated by 1s, optional.
+        causal: whether query i' only attends to keys j <= i'.
+        activation: ``softmax``, ``relu2`` or ``laplace``; the element-wise
+            activations are not normalized.
+        dropout: dropout probability of the attention weights.
+    """
+    if scale is not None:
+        assert scale.dim() == 3 and scale.size(-1) == 1
+    return BlockwiseAttentionFunc.apply(q, k, v, rel_bias, scale, key_padding_mask,
+                                        causal, activation, dropout, block_size)
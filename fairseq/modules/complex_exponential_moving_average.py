@@ -25,8 +25,9 @@ class MultiHeadComplexEMA(BaseMovingLayer):
         bidirectional=False,
         truncation=None,
         shift=True,
+        scan_chunk_size=None,
     ):
-        super().__init__(bidirectional, truncation, shift)
+        super().__init__(bidirectional, truncation, shift, scan_chunk_size)
         self.complex = True
         self.embed_dim = embed_dim
         self.ndim = ndim
@@ -98,15 +99,8 @@ class MultiHeadComplexEMA(BaseMovingLayer):
     def _compute_kernel(self, length: int, hx: torch.Tensor):
         # D x N x 1
         p, q, gamma = self._calc_coeffs()
-        if p.is_cuda:
-            return ema_parameters(p, q, gamma, hx, length)
-
-        # D x N x L
-        vander = torch.arange(length, dtype=p.dtype, device=p.device).view(1, 1, length) * torch.log(q)
-        # D x N x L
-        kernel = p * torch.exp(vander)
-        # D x L
-        return torch.einsum('dnl,dn->dl', kernel, gamma).real, None
+        # D x L, B x D x L
+        return ema_parameters(p, q, gamma, hx, length)
 
     def extra_repr(self) -> str:
         return 'edim={}, ndim={}, bidirectional={}, trunction={}, shift={}'.format(self.embed_dim, self.ndim, self.bidirectional,
@@ -5,7 +5,8 @@ import torch.nn as nn
 
 from torch.autograd.function import FunctionCtx
 
-import fairseq.mega2_extension.ops as mega2_ops
+from fairseq.modules.attention_softmax import attention_softmax_reference
+from fairseq.modules.fused_ops.backend import mega2_ops, register_reference_op, use_extension
 
 
 class AttentionFunc(torch.autograd.Function):
@@ -39,7 +40,55 @@ class AttentionFunc(torch.autograd.Function):
         return q_grad, k_grad, v_grad, None, None, None, None
 
 
-attention = AttentionFunc.apply
+@register_reference_op('attention')
+def attention_reference(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    scale: float = 1.0,
+    dropout: float = 0.0,
+    use_causal_mask: bool = True,
+    training: bool = True,
+    chunk_size: int = 1024,
+) -> torch.Tensor:
+    """Scaled dot-product attention matching the fused kernel (causal mask and
+    drop-key dropout), computed over chunks of ``chunk_size`` queries so that
+    at most a chunk_size x L score matrix per head is alive at once.
+
+    Args:
+        q, k: B x L x N x H1
+        v: B x L x N x H2
+    """
+    L = q.size(1)
+    # B x N x L x H
+    q = q.transpose(1, 2)
+    k = k.transpose(1, 2)
+    v = v.transpose(1, 2)
+    out = []
+    for start in range(0, L, chunk_size):
+        end = min(start + chunk_size, L)
+        # B x N x C x L
+        w = torch.matmul(q[:, :, start:end], k.transpose(2, 3)) * scale
+        w = attention_softmax_reference(w, dropout, use_causal_mask, training,
+                                        row_offset=start, total_rows=L)
+        out.append(torch.matmul(w, v))
+    # B x N x L x H2 -> B x L x N x H2
+    y = out[0] if len(out) == 1 else torch.cat(out, dim=2)
+    return y.transpose(1, 2).contiguous()
+
+
+def attention(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    scale: float = 1.0,
+    dropout: float = 0.0,
+    use_causal_mask: bool = True,
+    training: bool = True
+) -> torch.Tensor:
+    if use_extension(q, cuda_only=True):
+        return AttentionFunc.apply(q, k, v, scale, dropout, use_causal_mask, training)
+    return attention_reference(q, k, v, scale, dropout, use_causal_mask, training)
 
 
 class EfficientAttention(nn.Module):
@@ -8,6 +8,7 @@ import torch
 from torch import nn
 
 from .base_moving_average import BaseMovingLayer
+from .fused_ops.ema_parameters import ema_parameters
 
 
 class MultiHeadEMA(BaseMovingLayer):
@@ -23,8 +24,9 @@ class MultiHeadEMA(BaseMovingLayer):
         bidirectional=False,
         truncation=None,
         shift=True,
+        scan_chunk_size=None,
     ):
-        super().__init__(bidirectional, truncation, shift)
+        super().__init__(bidirectional, truncation, shift, scan_chunk_size)
         self.complex = False
         self.embed_dim = embed_dim
         self.ndim = ndim
@@ -79,15 +81,12 @@ class MultiHeadEMA(BaseMovingLayer):
         gamma = self.gamma.float() * self.scale
         return p, q, gamma
 
-    def _compute_kernel(self, length: int):
+    def _compute_kernel(self, length: int, hx: torch.Tensor):
         self._kernel = None
         # D x N x 1
         p, q, gamma = self._calc_coeffs()
-        # D x N x L
-        vander = torch.arange(length).to(q).view(1, 1, length) * torch.log(q)
-        kernel = p * torch.exp(vander)
-        # D x L
-        return torch.einsum('dnl,dn->dl', kernel, gamma)
+        # D x L, B x D x L
+        return ema_parameters(p, q, gamma, hx, length)
 
     def extra_repr(self) -> str:
         return 'edim={}, ndim={}, bidirectional={}, trunction={}, shift={}'.format(self.embed_dim, self.ndim, self.bidirectional,
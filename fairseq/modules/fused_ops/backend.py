@@ -0,0 +1,101 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Backend selection for the Mega fused ops.
+
+The fused ops are implemented by the compiled ``fairseq.mega2_extension``
+module. When the extension is not built (e.g. on CPU-only hosts) every op
+falls back to a vectorized pure-PyTorch reference implementation registered
+with :func:`register_reference_op`.
+
+The backend can be forced with the ``FAIRSEQ_MEGA2_BACKEND`` environment
+variable or :func:`set_backend`:
+
+- ``auto`` (default): use the extension when it is available and supports
+  the inputs, the reference implementation otherwise.
+- ``extension``: always use the extension (fails if it is not built).
+- ``reference``: always use the pure-PyTorch reference implementation.
+"""
+
+import logging
+import os
+from typing import Callable, Dict
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    import fairseq.mega2_extension.ops as mega2_ops
+
+    has_mega2_extension = True
+except ImportError:
+    mega2_ops = None
+    has_mega2_extension = False
+
+    logger.info('fairseq.mega2_extension is not available, using pure-PyTorch Mega ops')
+
+
+BACKENDS = ('auto', 'extension', 'reference')
+
+_REFERENCE_OPS: Dict[str, Callable] = {}
+_backend = os.environ.get('FAIRSEQ_MEGA2_BACKEND', 'auto')
+assert _backend in BACKENDS, 'unknown mega2 backend: {}'.format(_backend)
+
+
+def register_reference_op(name: str):
+    """Decorator registering the pure-PyTorch reference implementation of
+    the fused op *name*."""
+
+    def register_reference_op_fn(fn):
+        if name in _REFERENCE_OPS:
+            raise ValueError('Cannot register duplicate reference op ({})'.format(name))
+        _REFERENCE_OPS[name] = fn
+        return fn
+
+    return register_reference_op_fn
+
+
+def reference_op(name: str) -> Callable:
+    return _REFERENCE_OPS[name]
+
+
+def reference_ops():
+    return sorted(_REFERENCE_OPS.keys())
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def set_backend(backend: str):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError('unknown mega2 backend: {}'.format(backend))
+    if backend == 'extension' and not has_mega2_extension:
+        raise ImportError('fairseq.mega2_extension is not available, please run `python setup.py build_ext --inplace`')
+    _backend = backend
+
+
+def use_extension(x: torch.Tensor, cuda_only: bool = False) -> bool:
+    """Whether the op applied to *x* should dispatch to the extension.
+
+    Args:
+        x (Tensor): the main input of the op.
+        cuda_only (bool, optional): the extension only implements the op
+            for CUDA tensors (default: False).
+    """
+    if _backend == 'reference' or not has_mega2_extension:
+        return False
+    if _backend == 'extension':
+        return True
+    return x.is_cuda or not cuda_only
+
+
+def require_extension(op_name: str):
+    if not has_mega2_extension:
+        raise ImportError(
+            '{} requires fairseq.mega2_extension, please run `python setup.py build_ext --inplace`'.format(op_name)
+        )
+    return mega2_ops
@@ -2,7 +2,7 @@ from typing import Optional, Tuple
 import torch
 from torch.autograd.function import FunctionCtx
 
-import fairseq.mega2_extension.ops as mega2_ops
+from .backend import mega2_ops, register_reference_op, use_extension
 
 
 class EMAHiddenFunc(torch.autograd.Function):
@@ -27,4 +27,36 @@ class EMAHiddenFunc(torch.autograd.Function):
         return x_grad, p_grad, q_grad, h_grad
 
 
-ema_hidden = EMAHiddenFunc.apply
+@register_reference_op('ema_hidden')
+def ema_hidden_reference(x: torch.Tensor, p: torch.Tensor, q: torch.Tensor,
+                         h: Optional[torch.Tensor]) -> torch.Tensor:
+    """Closed-form EMA hidden state after consuming x.
+
+    h'[b, d, n] = p[d, n] * sum_j q[d, n]^(L-1-j) * x[b, d, j] + q[d, n]^L * h[b, d, n]
+
+    Args:
+        x: B x D x L input.
+        p: D x N (x 1) real coefficients.
+        q: D x N (x 1) real or complex decay rates.
+        h: B x D x N previous hidden state, optional.
+    """
+    L = x.size(-1)
+    # D x N
+    p = p.reshape(p.size(0), -1)
+    log_q = torch.log(q.reshape(q.size(0), -1))
+    # D x N x L, powers q^(L-1) ... q^0
+    exponents = torch.arange(L - 1, -1, -1, dtype=p.dtype, device=p.device)
+    vander = torch.exp(log_q.unsqueeze(-1) * exponents)
+    # B x D x N
+    y = torch.einsum('bdl,dnl->bdn', x.to(vander), vander) * p
+    if h is not None:
+        y = y + torch.exp(log_q * L) * h
+    return y
+
+
+def ema_hidden(x: torch.Tensor, p: torch.Tensor, q: torch.Tensor,
+               h: Optional[torch.Tensor]) -> torch.Tensor:
+    # the extension only supports complex decay rates.
+    if q.is_complex() and use_extension(x):
+        return EMAHiddenFunc.apply(x, p, q, h)
+    return ema_hidden_reference(x, p, q, h)
@@ -4,7 +4,7 @@ import torch
 
 from torch.autograd.function import FunctionCtx
 
-import fairseq.mega2_extension.ops as mega2_ops
+from .backend import mega2_ops, register_reference_op, use_extension
 
 
 class EMAParametersFunc(torch.autograd.Function):
@@ -32,4 +32,43 @@ class EMAParametersFunc(torch.autograd.Function):
         return p_grad, q_grad, gamma_grad, h_grad, None
 
 
-ema_parameters = EMAParametersFunc.apply
+@register_reference_op('ema_parameters')
+def ema_parameters_reference(p: torch.Tensor, q: torch.Tensor, gamma: torch.Tensor,
+                             h: Optional[torch.Tensor], length: int) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """EMA convolution kernel and the contribution of the carried hidden state.
+
+    weight[d, j] = Re(sum_n p[d, n] * gamma[d, n] * q[d, n]^j)
+    bias[b, d, j] = Re(sum_n gamma[d, n] * q[d, n]^(j+1) * h[b, d, n])
+
+    Args:
+        p: D x N (x 1) real coefficients.
+        q: D x N (x 1) real or complex decay rates.
+        gamma: D x N projection.
+        h: B x D x N previous hidden state, optional.
+        length: kernel length L.
+    """
+    # D x N
+    p = p.reshape(p.size(0), -1)
+    log_q = torch.log(q.reshape(q.size(0), -1))
+    # D x N x L+1, powers q^0 ... q^L
+    exponents = torch.arange(length + 1, dtype=p.dtype, device=p.device)
+    vander = torch.exp(log_q.unsqueeze(-1) * exponents)
+    # D x L
+    weight = torch.einsum('dnl,dn->dl', vander[:, :, :-1], p * gamma)
+    if weight.is_complex():
+        weight = weight.real
+    if h is None:
+        return weight, None
+    # B x D x L
+    bias = torch.einsum('bdn,dnl->bdl', h * gamma, vander[:, :, 1:])
+    if bias.is_complex():
+        bias = bias.real
+    return weight, bias
+
+
+def ema_parameters(p: torch.Tensor, q: torch.Tensor, gamma: torch.Tensor,
+                   h: Optional[torch.Tensor], length: int) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    # the extension only supports complex decay rates.
+    if q.is_complex() and use_extension(p):
+        return EMAParametersFunc.apply(p, q, gamma, h, length)
+    return ema_parameters_reference(p, q, gamma, h, length)
@@ -0,0 +1,110 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import Optional, Tuple
+
+import torch
+
+from .ema_hidden import ema_hidden
+from .ema_parameters import ema_parameters
+from .fftconv import fftconv
+
+
+def _linear_scan(u: torch.Tensor, a: torch.Tensor) -> torch.Tensor:
+    """Inclusive scan of s[k] = a * s[k-1] + u[k] along dim 2 in ceil(log2(K)) steps.
+
+    Args:
+        u: B x D x K x N
+        a: D x N
+    """
+    num_chunks = u.size(2)
+    shift = 1
+    while shift < num_chunks:
+        u = torch.cat([u[:, :, :shift], u[:, :, shift:] + a.unsqueeze(1) * u[:, :, :-shift]], dim=2)
+        a = a * a
+        shift *= 2
+    return u
+
+
+def ema_chunked_scan(
+    x: torch.Tensor,
+    p: torch.Tensor,
+    q: torch.Tensor,
+    gamma: torch.Tensor,
+    h: Optional[torch.Tensor],
+    chunk_size: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """EMA recurrence h[t] = q * h[t-1] + p * x[t], y[t] = Re(gamma * h[t]) over
+    chunks of ``chunk_size`` steps.
+
+    Each chunk is convolved with a kernel of length ``chunk_size`` and reduced
+    to its local final state; the states are then combined across chunks with
+    a log-depth parallel prefix scan, so no kernel of the full length is ever
+    built and memory grows linearly with the sequence length.
+
+    Args:
+        x: B x D x L input.
+        p: D x N x 1 real coefficients.
+        q: D x N x 1 real or complex decay rates.
+        gamma: D x N projection.
+        h: B x D x N hidden state carried from the previous call, optional.
+
+    Returns:
+        the B x D x L output and the B x D x N hidden state after the last step.
+    """
+    bsz, embed_dim, seq_len = x.size()
+    num_chunks = seq_len // chunk_size
+    aligned_len = num_chunks * chunk_size
+
+    outputs = []
+    if num_chunks > 0:
+        # D x N
+        p2 = p.reshape(embed_dim, -1)
+        log_q = torch.log(q.reshape(embed_dim, -1))
+        # D x N x C+1, powers q^0 ... q^C
+        exponents = torch.arange(chunk_size + 1, dtype=p2.dtype, device=p2.device)
+        vander = torch.exp(log_q.unsqueeze(-1) * exponents)
+
+        # B x D x K x C
+        xc = x[..., :aligned_len].reshape(bsz, embed_dim, num_chunks, chunk_size)
+
+        # intra-chunk outputs with a C-length kernel
+        kernel = torch.einsum('dnl,dn->dl', vander[:, :, :-1], p2 * gamma)
+        if kernel.is_complex():
+            kernel = kernel.real
+        # B*K x D x C
+        xk = xc.transpose(1, 2).reshape(bsz * num_chunks, embed_dim, chunk_size)
+        out = fftconv(xk, kernel).view(bsz, num_chunks, embed_dim, chunk_size).transpose(1, 2)
+
+        # B x D x K x N, state at the end of each chunk ignoring earlier chunks
+        local = torch.einsum('bdkc,dnc->bdkn', xc.to(vander), vander[:, :, :-1].flip(-1)) * p2.unsqueeze(1)
+        # D x N
+        decay = vander[:, :, -1]
+        if h is None:
+            h = torch.zeros_like(local[:, :, 0])
+        else:
+            local = torch.cat([local[:, :, :1] + (decay.unsqueeze(1) * h.unsqueeze(2)), local[:, :, 1:]], dim=2)
+        states = _linear_scan(local, decay)
+
+        # B x D x K x N, state entering each chunk
+        prev = torch.cat([h.unsqueeze(2).to(states), states[:, :, :-1]], dim=2)
+        # B x D x K x C
+        carry = torch.einsum('bdkn,dnc->bdkc', prev, vander[:, :, 1:] * gamma.unsqueeze(-1))
+        if carry.is_complex():
+            carry = carry.real
+        out = out + carry.to(out)
+        outputs.append(out.reshape(bsz, embed_dim, aligned_len))
+        h = states[:, :, -1]
+
+    if aligned_len < seq_len:
+        # remainder shorter than a chunk
+        x_rem = x[..., aligned_len:]
+        k, b = ema_parameters(p, q, gamma, h, seq_len - aligned_len)
+        out = fftconv(x_rem, k)
+        if b is not None:
+            out = out + b.to(out)
+        outputs.append(out)
+        h = ema_hidden(x_rem, p, q, h)
+
+    out = outputs[0] if len(outputs) == 1 else torch.cat(outputs, dim=-1)
+    return out, h
@@ -5,7 +5,7 @@ import torch.nn.functional as F
 
 from torch.autograd.function import FunctionCtx
 
-from fairseq.mega2_extension.ops import rfft, fftconv_fwd, fftconv_bwd
+from .backend import mega2_ops, register_reference_op, use_extension
 
 
 class FFTConvFunc(torch.autograd.Function):
@@ -13,34 +13,57 @@ class FFTConvFunc(torch.autograd.Function):
     @staticmethod
     def forward(ctx: FunctionCtx, x: torch.Tensor, k: torch.Tensor) -> torch.Tensor:
         L = x.size(-1)
-        if not x.is_cuda or L < 32 or L > 8192:
+        use_ext = use_extension(x, cuda_only=True) and 32 <= L <= 8192
+        if not use_ext:
             y, x_f, k_f = _fftconv_fwd(x, k)
         else:
             N = L if (L & (L - 1)) == 0 else (1 << L.bit_length())
             if k.dtype == torch.float32 or k.dtype == torch.float64:
                 k_f = torch.fft.rfft(k, 2 * N)
             else:
-                k_f = rfft(k, False)
-            y, x_f = fftconv_fwd(x, k_f)
+                k_f = mega2_ops.rfft(k, False)
+            y, x_f = mega2_ops.fftconv_fwd(x, k_f)
         ctx.save_for_backward(x_f, k_f)
         ctx.k_dtype = k.dtype  # k_dtype is not a torch.Tensor
+        ctx.use_ext = use_ext  # use_ext is not a torch.Tensor
         return y
 
     @staticmethod
     def backward(ctx: FunctionCtx, y_grad: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor]]:
-        L = y_grad.size(-1)
         x_f, k_f = ctx.saved_tensors
         k_dtype = ctx.k_dtype
 
-        if not y_grad.is_cuda or L < 32 or L > 8192:
+        if not ctx.use_ext:
             return _fftconv_bwd(y_grad, x_f, k_f)
         else:
-            return fftconv_bwd(y_grad, x_f, k_f, k_dtype)
+            return mega2_ops.fftconv_bwd(y_grad, x_f, k_f, k_dtype)
 
 
 fftconv = FFTConvFunc.apply
 
 
+@register_reference_op('fftconv')
+def fftconv_reference(x: torch.Tensor, k: torch.Tensor) -> torch.Tensor:
+    """Causal convolution of x (B x D x L) with k (D x L) through rfft, differentiated by autograd."""
+    y, _, _ = _fftconv_fwd(x, k)
+    return y
+
+
+def fftconv_with_kernel_f(x: torch.Tensor, k_f: torch.Tensor) -> torch.Tensor:
+    """Causal convolution of x (B x D x L) with a precomputed kernel spectrum.
+
+    Args:
+        k_f: D x (N+1) spectrum ``torch.fft.rfft(k, n=2 * N, norm="forward")``
+            of a kernel of length at least L, with N >= L.
+    """
+    L = x.size(-1)
+    fft_size = 2 * (k_f.size(-1) - 1)
+    assert L <= fft_size // 2, 'FFT size {} is too small for length {}'.format(fft_size, L)
+    x_f = torch.fft.rfft(x.float(), n=fft_size)
+    y = torch.fft.irfft(x_f * k_f, n=fft_size, norm="forward")[..., :L]
+    return y.to(x)
+
+
 # @torch.jit.script
 def _fftconv_fwd(x: torch.Tensor, k: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
     L: int = x.size(-1)
@@ -0,0 +1,74 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import Tuple
+
+import torch
+import torch.nn.functional as F
+
+
+def mega_gate_reference(mx: torch.Tensor, weight: torch.Tensor, bias: torch.Tensor,
+                        gamma: torch.Tensor, beta: torch.Tensor, embed_dim: int, zdim: int,
+                        hdim: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Gates, queries and keys of the Mega block.
+
+    Args:
+        mx: B x L x D output of the moving average.
+        weight, bias: parameters of mx_proj, (D+S+E+D) x D and (D+S+E+D).
+        gamma, beta: 2 x S affine parameters of the queries and keys.
+
+    Returns:
+        u (B x L x D), q (B x L x S), k (B x L x S), r (B x L x E) and hx (B x L x D).
+    """
+    base = F.linear(mx, weight, bias)
+    u, z, r, hx = torch.split(base, [embed_dim, zdim, hdim, embed_dim], dim=-1)
+    u = torch.sigmoid(u)
+    z = F.normalize(z, p=2, dim=-1, eps=1e-5)
+    z = z.unsqueeze(2) * (gamma + 1.0) + beta
+    q, k = torch.unbind(z, dim=2)
+    r = F.silu(r)
+    return u, q, k, r, hx
+
+
+def mega_gate_inference(mx: torch.Tensor, weight: torch.Tensor, bias: torch.Tensor,
+                        gamma: torch.Tensor, beta: torch.Tensor, embed_dim: int, zdim: int,
+                        hdim: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Inference-only :func:`mega_gate_reference`.
+
+    u, r and hx are views of the single mx_proj output buffer, with the
+    activations applied in place; q and k share one B x L x 2 x S buffer.
+    Does not support autograd.
+    """
+    # B x L x (D+S+E+D)
+    base = F.linear(mx, weight, bias)
+    u, z, r, hx = torch.split(base, [embed_dim, zdim, hdim, embed_dim], dim=-1)
+    u = u.sigmoid_()
+    r = F.silu(r, inplace=True)
+    z = z.div_(torch.norm(z, p=2, dim=-1, keepdim=True).clamp_min_(1e-5))
+    # B x L x 2 x S
+    qk = torch.addcmul(beta, z.unsqueeze(2), gamma + 1.0)
+    q, k = torch.unbind(qk, dim=2)
+    return u, q, k, r, hx
+
+
+def mega_output_reference(attn: torch.Tensor, weight: torch.Tensor, hx: torch.Tensor,
+                          u: torch.Tensor, residual: torch.Tensor) -> torch.Tensor:
+    """Output of the Mega block, residual + u * (silu(hx + attn @ weight^T) - residual).
+
+    Args:
+        attn: B x L x E gated attention output.
+        weight: D x E parameters of h_proj.
+        hx, u, residual: B x L x D
+    """
+    h = F.silu(hx + F.linear(attn, weight))
+    return torch.addcmul(residual, u, h - residual)
+
+
+def mega_output_inference(attn: torch.Tensor, weight: torch.Tensor, hx: torch.Tensor,
+                          u: torch.Tensor, residual: torch.Tensor) -> torch.Tensor:
+    """Inference-only :func:`mega_output_reference` computed in the h_proj
+    output buffer. Does not support autograd."""
+    # B x L x D
+    h = F.linear(attn, weight).add_(hx)
+    h = F.silu(h, inplace=True)
+    return h.sub_(residual).mul_(u).add_(residual)
@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import math
+from functools import partial
 from typing import Dict, Optional, Tuple, Union
 
 import torch
@@ -387,11 +388,16 @@ class LunarCausalAttention(nn.Module):
         q_noise=0.0,
         qn_block_size=8,
         parallel=True,
+        chunk_size=64,
     ):
         super().__init__()
         self.embed_dim = embed_dim
         self.num_heads = num_heads
+        # True: cumulative sums over the steps, False: loop over the steps,
+        # 'chunked': chunked scan with a custom backward
+        assert parallel in (True, False, 'chunked')
         self.parallel = parallel
+        self.chunk_size = chunk_size
         self.dropout_module = FairseqDropout(dropout, module_name=self.__class__.__name__)
 
         self.head_dim = embed_dim // num_heads
@@ -522,7 +528,12 @@ class LunarCausalAttention(nn.Module):
             k = self.k_proj(query).view(tgt_len, bsz * self.num_heads, self.head_dim).transpose(0, 1)
             v = self.v_proj(query).view(tgt_len, bsz * self.num_heads, self.head_dim).transpose(0, 1)
 
-        efficient_causal_attention = efficient_causal_attention_parallel if self.parallel else efficient_causal_attention_seq
+        if self.parallel == 'chunked':
+            efficient_causal_attention = partial(efficient_causal_attention_chunked, chunk_size=self.chunk_size)
+        elif self.parallel:
+            efficient_causal_attention = efficient_causal_attention_parallel
+        else:
+            efficient_causal_attention = efficient_causal_attention_seq
 
         if saved_state is not None:
             # key accumulative matrix are store with shape (bsz, num_heads, head_dim, plen)
@@ -709,6 +720,101 @@ def efficient_causal_attention_parallel(x, y, z):
     return res
 
 
+class ChunkedCausalAttentionFunc(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, x, y, z, chunk_size):
+        out = _chunked_causal_attention_fwd(x, y, z, chunk_size)
+        ctx.save_for_backward(x, y, z)
+        ctx.chunk_size = chunk_size
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x, y, z = ctx.saved_tensors
+        chunk_size = ctx.chunk_size
+        bsz, n, d1 = x.size()
+        d2 = z.size(2)
+        # (1, n, 1)
+        length_div = torch.arange(1, n + 1, device=x.device, dtype=grad_out.dtype).view(1, n, 1)
+        # B x K x C x D
+        xc, yc, zc, gc = _split_chunks([x, y, z, grad_out / length_div], chunk_size)
+        num_chunks = xc.size(1)
+        mask = _causal_chunk_mask(chunk_size, x.device)
+
+        # states accumulated over the previous chunks: B x K x d1 x d2
+        prev_state = _exclusive_cumsum(torch.matmul(yc.transpose(2, 3), zc), reverse=False)
+        # gradients accumulated over the next chunks: B x K x d1 x d2
+        next_grad = _exclusive_cumsum(torch.matmul(xc.transpose(2, 3), gc), reverse=True)
+
+        # B x K x C x C
+        gz_scores = torch.matmul(gc, zc.transpose(2, 3)).masked_fill(~mask, 0.)
+        x_grad = torch.matmul(gz_scores, yc) + torch.matmul(gc, prev_state.transpose(2, 3))
+        y_grad = torch.matmul(gz_scores.transpose(2, 3), xc) + torch.matmul(zc, next_grad.transpose(2, 3))
+        xy_scores = torch.matmul(xc, yc.transpose(2, 3)).masked_fill(~mask, 0.)
+        z_grad = torch.matmul(xy_scores.transpose(2, 3), gc) + torch.matmul(yc, next_grad)
+
+        x_grad = x_grad.view(bsz, num_chunks * chunk_size, d1)[:, :n]
+        y_grad = y_grad.view(bsz, num_chunks * chunk_size, d1)[:, :n]
+        z_grad = z_grad.view(bsz, num_chunks * chunk_size, d2)[:, :n]
+        return x_grad, y_grad, z_grad, None
+
+
+def _split_chunks(tensors, chunk_size):
+    # B x N x D -> B x K x C x D, zero padded to a multiple of chunk_size
+    n = tensors[0].size(1)
+    num_chunks = (n + chunk_size - 1) // chunk_size
+    pad = num_chunks * chunk_size - n
+    return [F.pad(t, (0, 0, 0, pad)).view(t.size(0), num_chunks, chunk_size, t.size(2)) for t in tensors]
+
+
+def _causal_chunk_mask(chunk_size, device):
+    # C x C, True where the query (row) attends to the key (column)
+    return torch.ones(chunk_size, chunk_size, dtype=torch.bool, device=device).tril()
+
+
+def _exclusive_cumsum(x, reverse=False):
+    # cumulative sum over the chunks (dim 1) excluding the current chunk
+    if reverse:
+        x = x.flip(1)
+    x = torch.cumsum(x, dim=1) - x
+    if reverse:
+        x = x.flip(1)
+    return x
+
+
+def _chunked_causal_attention_fwd(x, y, z, chunk_size):
+    bsz, n, d1 = x.size()
+    d2 = z.size(2)
+    # B x K x C x D
+    xc, yc, zc = _split_chunks([x, y, z], chunk_size)
+    num_chunks = xc.size(1)
+    # intra-chunk: B x K x C x C
+    scores = torch.matmul(xc, yc.transpose(2, 3)).masked_fill(~_causal_chunk_mask(chunk_size, x.device), 0.)
+    # inter-chunk: B x K x d1 x d2
+    prev_state = _exclusive_cumsum(torch.matmul(yc.transpose(2, 3), zc), reverse=False)
+    res = torch.matmul(scores, zc) + torch.matmul(xc, prev_state)
+    res = res.view(bsz, num_chunks * chunk_size, d2)[:, :n]
+    # (1, n, 1)
+    length_div = torch.arange(1, n + 1, device=x.device).unsqueeze(0).unsqueeze(2)
+    return res / length_div
+
+
+def efficient_causal_attention_chunked(x, y, z, chunk_size=64):
+    """
+    efficient causal attention operation, computed over chunks of
+    *chunk_size* steps: quadratic attention within the chunks and a carried
+    d1 x d2 state across the chunks.
+    Args:
+        x (Tensor): Tensor with shape `(batch, n, d1)`
+        y (Tensor): Tensor with shape `(batch, n, d1)`
+        z (Tensor): Tensor with shape '(batch, n, d2)`
+        chunk_size (int): number of steps in each chunk
+    return:
+    """
+    return ChunkedCausalAttentionFunc.apply(x, y, z, chunk_size)
+
+
 def incremental_causal_attention(x, y, z, accum_mat, n):
     """
     efficient causal attention operation
@@ -206,6 +206,7 @@ class LunaDecoderLayer(nn.Module):
         return quant_noise(nn.Linear(input_dim, output_dim), q_noise, qn_block_size)
 
     def build_self_attention(self, embed_dim, args):
+        causal_attention = getattr(args, 'luna_causal_attention', 'parallel')
         return LunarCausalAttention(
             embed_dim,
             args.decoder_attention_heads,
@@ -213,6 +214,8 @@ class LunaDecoderLayer(nn.Module):
             tie_kv=not args.untie_luna_kv,
             q_noise=self.quant_noise,
             qn_block_size=self.quant_noise_block_size,
+            parallel={'seq': False, 'parallel': True, 'chunked': 'chunked'}[causal_attention],
+            chunk_size=getattr(args, 'luna_causal_chunk_size', 64),
         )
 
     def build_encoder_attention(self, embed_dim, args):
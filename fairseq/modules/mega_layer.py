@@ -39,6 +39,7 @@ class MegaEncoderLayer(nn.Module):
             attention_dropout=args.attention_dropout,
             hidden_dropout=args.hidden_dropout,
             efficient_attn=args.efficient_attention,
+            attention_block_size=getattr(args, 'attention_block_size', None),
             chunk_size=args.encoder_chunk_size,
             moving_layer=args.moving_layer,
             truncation=args.truncation_length,
@@ -112,6 +113,7 @@ class MegaDecoderLayer(nn.Module):
             attention_dropout=args.attention_dropout,
             hidden_dropout=args.hidden_dropout,
             efficient_attn=args.efficient_attention,
+            attention_block_size=getattr(args, 'attention_block_size', None),
             chunk_size=args.decoder_chunk_size,
             moving_layer=args.moving_layer,
             truncation=args.truncation_length,
@@ -123,6 +125,7 @@ class MegaDecoderLayer(nn.Module):
             norm_eps=args.norm_eps,
             bidirectional=False,
             init_mode=args.init_mode,
+            ema_scan_chunk_size=getattr(args, 'ema_scan_chunk_size', None),
         )
 
     def build_cross_attn(self, embed_dim, args):
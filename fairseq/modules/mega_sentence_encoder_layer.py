@@ -28,6 +28,7 @@ class MegaSentenceEncoderLayer(nn.Module):
         attention_dropout: float = 0.0,
         hidden_dropout: float = 0.0,
         efficient_attn: bool = False,
+        attention_block_size: Optional[int] = None,
         chunk_size: int = -1,
         moving_layer='cema',
         moving_act='rmsnorm',
@@ -56,6 +57,7 @@ class MegaSentenceEncoderLayer(nn.Module):
             attention_dropout=attention_dropout,
             hidden_dropout=hidden_dropout,
             efficient_attn=efficient_attn,
+            attention_block_size=attention_block_size,
             chunk_size=chunk_size,
             moving_layer=moving_layer,
             moving_act=moving_act,
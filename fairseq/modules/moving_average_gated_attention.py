@@ -21,6 +21,8 @@ from fairseq.modules.exponential_moving_average import MultiHeadEMA
 from fairseq.modules.complex_exponential_moving_average import MultiHeadComplexEMA
 from fairseq.modules.efficient_attention import EfficientAttention
 from fairseq.modules.attention_softmax import AttentionSoftmax
+from fairseq.modules.blockwise_attention import blockwise_attention
+from fairseq.modules.fused_ops.mega_gate import mega_gate_inference, mega_output_inference
 
 
 @with_incremental_state
@@ -51,6 +53,8 @@ class MovingAverageGatedAttention(nn.Module):
         rel_pos_bias='simple',
         max_positions=1024,
         init_mode='bert',
+        ema_scan_chunk_size=None,
+        attention_block_size=None,
     ):
         super().__init__()
 
@@ -79,6 +83,9 @@ class MovingAverageGatedAttention(nn.Module):
             self.attention_dropout = FairseqDropout(attention_dropout, module_name=self.__class__.__name__)
         self.chunk_size = chunk_size
         self.bidirectional = bidirectional
+        # compute the attention over tiles of attention_block_size queries and keys
+        assert attention_block_size is None or not efficient_attn
+        self.attention_block_size = attention_block_size
 
         if bidirectional:
             self.norm = SequenceNorm(embed_dim, num_groups=norm_num_groups, eps=norm_eps)
@@ -86,9 +93,11 @@ class MovingAverageGatedAttention(nn.Module):
             self.norm = TimestepNorm(embed_dim, num_groups=norm_num_groups, eps=norm_eps)
 
         if moving_layer == 'ema':
-            self.move = MultiHeadEMA(embed_dim, ndim=ndim, bidirectional=bidirectional, truncation=truncation)
+            self.move = MultiHeadEMA(embed_dim, ndim=ndim, bidirectional=bidirectional, truncation=truncation,
+                                     scan_chunk_size=ema_scan_chunk_size)
         elif moving_layer == 'cema':
-            self.move = MultiHeadComplexEMA(embed_dim, ndim=ndim, bidirectional=bidirectional, truncation=truncation)
+            self.move = MultiHeadComplexEMA(embed_dim, ndim=ndim, bidirectional=bidirectional, truncation=truncation,
+                                            scan_chunk_size=ema_scan_chunk_size)
         else:
             raise ValueError("Unknown moving type: {}".format(moving_layer))
 
@@ -118,10 +127,15 @@ class MovingAverageGatedAttention(nn.Module):
 
         self.onnx_trace = False
         self.tpu = False
+        self.fused_inference = False
 
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
 
+    def make_generation_fast_(self, retain_dropout: bool = False, **kwargs):
+        # the fused gates skip the dropout layers and modify activations in place
+        self.fused_inference = not retain_dropout
+
     def prepare_for_tpu_(self, **kwargs):
         self.tpu = True
 
@@ -249,6 +263,44 @@ class MovingAverageGatedAttention(nn.Module):
             attn_weights = self.attn_softmax(qk)
         return attn_weights
 
+    def blockwise_attention(self, q, k, v, padding_mask, attn_mask):
+        slen = k.size(1)
+        # queries are the last positions of the keys
+        qidx = slen - q.size(1)
+        if isinstance(self.rel_pos_bias, SimpleRelativePositionalBias):
+            if slen > self.rel_pos_bias.max_positions:
+                raise ValueError('Sequence length {} going beyond max length {}'.format(slen, self.rel_pos_bias.max_positions))
+            rel_bias = self.rel_pos_bias.rel_pos_bias
+        elif isinstance(self.rel_pos_bias, RotaryEmbedding):
+            q, k = self.rel_pos_bias(q, k, qidx=qidx)
+            rel_bias = None
+        else:
+            raise ValueError('unknown relative position bias')
+
+        if self.attention_activation == 'softmax':
+            len_scale = None
+            if padding_mask is not None:
+                padding_mask_all = padding_mask.all(dim=-1, keepdim=True)
+                padding_mask = torch.logical_and(padding_mask, ~padding_mask_all)
+        elif attn_mask is not None:
+            # 1 x C x 1, number of visible keys of each query
+            lengths = torch.arange(qidx + 1, slen + 1, device=q.device)
+            len_scale = torch.rsqrt(lengths.float()).to(q).view(1, -1, 1)
+        elif padding_mask is not None:
+            # B*K x 1 x 1
+            lengths = slen - padding_mask.sum(dim=-1, keepdim=True)
+            len_scale = torch.rsqrt(lengths.clamp(min=1.0)).to(q).unsqueeze(-1)
+        else:
+            len_scale = q.new_full((1, 1, 1), 1.0 / math.sqrt(slen))
+
+        if padding_mask is not None:
+            padding_mask = padding_mask.to(torch.bool)
+        dropout = self.attention_dropout
+        dropout_p = dropout.p if self.training or dropout.apply_during_inference else 0.0
+        return blockwise_attention(q, k, v, rel_bias=rel_bias, scale=len_scale, key_padding_mask=padding_mask,
+                                   causal=attn_mask is not None, activation=self.attention_activation,
+                                   dropout=dropout_p, block_size=self.attention_block_size)
+
     def efficient_softmax_attention(self, q, k, v):
         assert isinstance(self.rel_pos_bias, RotaryEmbedding)
         slen = k.size(1)
@@ -315,22 +367,32 @@ class MovingAverageGatedAttention(nn.Module):
         mx = mx.transpose(1, 2)
         mx = self.hidden_dropout(self.move_act(mx))
 
-        # B x L x D -> B x L x (D+S+E+D)
-        base = self.mx_proj(mx)
-        u, z, r, hx = torch.split(base, [self.embed_dim, self.zdim, self.hdim, self.embed_dim], dim=-1)
-        # B x L x D
-        u = torch.sigmoid(u)
-        # B x L x S
-        z = F.normalize(z, p=2, dim=-1, eps=1e-5)
-        # B x L x S -> B x L x 1 x S -> B x L x 2 x S
-        z = z.unsqueeze(2) * (self.gamma + 1.0) + self.beta
-        # B x L x 2 x S -> B x L x S
-        q, k = torch.unbind(z, dim=2)
-        # B x L x E
-        r = F.silu(r)
-
-        if saved_state is not None:
-            # assert self.chunk_size < 0 or q.size(1) <= self.chunk_size
+        fused = self.fused_inference and not self.training and not torch.is_grad_enabled()
+        if fused:
+            u, q, k, r, hx = mega_gate_inference(mx, self.mx_proj.weight, self.mx_proj.bias, self.gamma, self.beta,
+                                                 self.embed_dim, self.zdim, self.hdim)
+        else:
+            # B x L x D -> B x L x (D+S+E+D)
+            base = self.mx_proj(mx)
+            u, z, r, hx = torch.split(base, [self.embed_dim, self.zdim, self.hdim, self.embed_dim], dim=-1)
+            # B x L x D
+            u = torch.sigmoid(u)
+            # B x L x S
+            z = F.normalize(z, p=2, dim=-1, eps=1e-5)
+            # B x L x S -> B x L x 1 x S -> B x L x 2 x S
+            z = z.unsqueeze(2) * (self.gamma + 1.0) + self.beta
+            # B x L x 2 x S -> B x L x S
+            q, k = torch.unbind(z, dim=2)
+            # B x L x E
+            r = F.silu(r)
+
+        if saved_state is not None and self.chunk_size > 0:
+            # keys and values of the current chunk are cached in chunk_size preallocated slots
+            k, v, padding_mask = self._update_slot_buffer(saved_state, k, v, padding_mask)
+            # In this branch incremental_state is never None
+            assert incremental_state is not None
+            self._set_input_buffer(incremental_state, saved_state)
+        elif saved_state is not None:
             # saved states are stored with shape (bsz, seq_len, dim)
             if "prev_key" in saved_state:
                 prev_key = saved_state["prev_key"]
@@ -343,8 +405,8 @@ class MovingAverageGatedAttention(nn.Module):
                 assert v is not None
                 v = torch.cat([prev_value, v], dim=1)
             prev_padding_mask: Optional[Tensor] = None
-            if "prev_padding_mask" in saved_state:
-                prev_padding_mask = saved_state["prev_padding_mask"]
+            if "prev_key_padding_mask" in saved_state:
+                prev_padding_mask = saved_state["prev_key_padding_mask"]
             padding_mask = MovingAverageGatedAttention._append_prev_padding_mask(
                 padding_mask=padding_mask,
                 prev_padding_mask=prev_padding_mask,
@@ -352,21 +414,9 @@ class MovingAverageGatedAttention(nn.Module):
                 seq_len=k.size(1),
             )
 
-            if self.chunk_size < 0:
-                saved_state["prev_key"] = k
-                saved_state["prev_value"] = v
-                saved_state["prev_key_padding_mask"] = padding_mask
-            else:
-                curr_len = k.size(1) % self.chunk_size
-                if curr_len == 0:
-                    if "prev_key" in saved_state:
-                        del saved_state["prev_key"]
-                        del saved_state["prev_value"]
-                        del saved_state["prev_key_padding_mask"]
-                else:
-                    saved_state["prev_key"] = k
-                    saved_state["prev_value"] = v
-                    saved_state["prev_key_padding_mask"] = padding_mask
+            saved_state["prev_key"] = k
+            saved_state["prev_value"] = v
+            saved_state["prev_key_padding_mask"] = padding_mask
             # In this branch incremental_state is never None
             assert incremental_state is not None
             self._set_input_buffer(incremental_state, saved_state)
@@ -395,6 +445,10 @@ class MovingAverageGatedAttention(nn.Module):
             # B*K x C x E -> B x L x E
             attn = self.efficient_softmax_attention(q, k, v).view(bsz, seq_len, self.hdim)
             attn_weights = None
+        elif self.attention_block_size is not None and not before_attn_fn:
+            # B*K x C x E -> B x L x E
+            attn = self.blockwise_attention(q, k, v, padding_mask, attn_mask).view(bsz, seq_len, self.hdim)
+            attn_weights = None
         else:
             if self.attention_activation == 'softmax':
                 attn_weights = self.softmax_attention(q, k, padding_mask, attn_mask, before_attn_fn)
@@ -403,19 +457,77 @@ class MovingAverageGatedAttention(nn.Module):
             # B*K x C x E -> B x L x E
             attn = torch.bmm(attn_weights, v).view(bsz, seq_len, self.hdim)
 
-        # B x L x E
-        attn = self.hidden_dropout(attn * r)
-        # B x L x E -> B x L x D
-        h = F.silu(hx + self.h_proj(attn))
-        h = self.dropout(h)
-        # B x L x D
-        out = torch.addcmul(residual, u, h - residual)
+        if fused:
+            # B x L x D
+            out = mega_output_inference(attn.mul_(r), self.h_proj.weight, hx, u, residual)
+        else:
+            # B x L x E
+            attn = self.hidden_dropout(attn * r)
+            # B x L x E -> B x L x D
+            h = F.silu(hx + self.h_proj(attn))
+            h = self.dropout(h)
+            # B x L x D
+            out = torch.addcmul(residual, u, h - residual)
 
         if need_weights:
             return out, attn_weights
         else:
             return out, None
 
+    def _update_slot_buffer(
+        self,
+        saved_state: Dict[str, Optional[Tensor]],
+        k: Tensor,
+        v: Tensor,
+        padding_mask: Optional[Tensor],
+    ) -> Tuple[Tensor, Tensor, Optional[Tensor]]:
+        """Write the keys and values of the current step in place into the
+        slots of the chunk cache and return the keys, values and key padding
+        mask of the current chunk so far.
+
+        The slot buffers are allocated once with chunk_size slots per batch
+        element and reused across chunks; "prev_len" (a CPU scalar) holds the
+        number of filled slots.
+        """
+        bsz, seq_len = k.size(0), k.size(1)
+        prev_len = saved_state.get("prev_len", None)
+        start = int(prev_len) if prev_len is not None else 0
+        if start == 0 and seq_len % self.chunk_size == 0:
+            # whole chunks only attend within themselves, nothing to cache
+            return k, v, padding_mask
+        end = start + seq_len
+        assert end <= self.chunk_size
+
+        key_buffer = saved_state.get("prev_key", None)
+        value_buffer = saved_state.get("prev_value", None)
+        mask_buffer = saved_state.get("prev_key_padding_mask", None)
+        if key_buffer is None or value_buffer is None or key_buffer.size(0) != bsz:
+            assert start == 0
+            # B x C x S, B x C x E
+            key_buffer = k.new_empty(bsz, self.chunk_size, self.zdim)
+            value_buffer = v.new_empty(bsz, self.chunk_size, self.hdim)
+            mask_buffer = None
+            if "prev_key_padding_mask" in saved_state:
+                del saved_state["prev_key_padding_mask"]
+            saved_state["prev_key"] = key_buffer
+            saved_state["prev_value"] = value_buffer
+        key_buffer[:, start:end] = k
+        value_buffer[:, start:end] = v
+
+        if mask_buffer is None and padding_mask is not None:
+            # B x C
+            mask_buffer = torch.zeros(bsz, self.chunk_size, dtype=torch.bool, device=padding_mask.device)
+            saved_state["prev_key_padding_mask"] = mask_buffer
+        if mask_buffer is not None:
+            if padding_mask is None:
+                mask_buffer[:, start:end] = False
+            else:
+                mask_buffer[:, start:end] = padding_mask
+            padding_mask = mask_buffer[:, :end]
+
+        saved_state["prev_len"] = torch.tensor(end % self.chunk_size)
+        return key_buffer[:, :end], value_buffer[:, :end], padding_mask
+
     def _get_input_buffer(self, incremental_state: Optional[Dict[str, Dict[str, Optional[Tensor]]]]) -> Dict[str, Optional[Tensor]]:
         result = self.get_incremental_state(incremental_state, "attn_state")
         if result is not None:
@@ -433,7 +545,21 @@ class MovingAverageGatedAttention(nn.Module):
     ):
         """Reorder buffered internal state (for incremental generation)."""
         input_buffer = self._get_input_buffer(incremental_state)
-        if input_buffer is not None:
+        prev_len = input_buffer.get("prev_len", None)
+        if prev_len is not None:
+            # gather the filled slots within the same storage when the batch size is unchanged
+            filled = int(prev_len)
+            for k in ["prev_key", "prev_value", "prev_key_padding_mask"]:
+                input_buffer_k = input_buffer.get(k, None)
+                if input_buffer_k is None:
+                    continue
+                if input_buffer_k.size(0) == new_order.size(0):
+                    if filled > 0:
+                        input_buffer_k[:, :filled] = input_buffer_k[:, :filled].index_select(0, new_order)
+                else:
+                    input_buffer[k] = input_buffer_k.index_select(0, new_order)
+            incremental_state = self._set_input_buffer(incremental_state, input_buffer)
+        elif input_buffer is not None:
             for k in input_buffer.keys():
                 input_buffer_k = input_buffer[k]
                 if input_buffer_k is not None:
@@ -441,6 +567,37 @@ class MovingAverageGatedAttention(nn.Module):
             incremental_state = self._set_input_buffer(incremental_state, input_buffer)
         return incremental_state
 
+    @torch.jit.export
+    def reset_incremental_state(
+            self, incremental_state: Dict[str, Dict[str, Optional[Tensor]]], reset_mask: Tensor
+    ):
+        """Mask out the cached keys of the batch elements in reset_mask.
+
+        With chunked attention, all the batch elements share the position
+        within the current chunk, so the state can only be reset exactly at
+        chunk boundaries: resetting some elements in the middle of a chunk
+        raises a RuntimeError.
+        """
+        input_buffer = self._get_input_buffer(incremental_state)
+        prev_len = input_buffer.get("prev_len", None)
+        prev_key = input_buffer.get("prev_key", None)
+        if prev_len is not None:
+            # at a chunk boundary the next step starts a new chunk, nothing to mask
+            if int(prev_len) > 0 and bool(reset_mask.any()):
+                raise RuntimeError(
+                    "the incremental state of a chunked attention can only be reset at chunk boundaries"
+                )
+        elif prev_key is not None:
+            bsz, ctx_len = prev_key.size(0), prev_key.size(1)
+            # B x L
+            mask = reset_mask.unsqueeze(1).expand(bsz, ctx_len)
+            prev_padding_mask = input_buffer.get("prev_key_padding_mask", None)
+            if prev_padding_mask is not None:
+                mask = torch.logical_or(prev_padding_mask, mask)
+            input_buffer["prev_key_padding_mask"] = mask
+            incremental_state = self._set_input_buffer(incremental_state, input_buffer)
+        return incremental_state
+
     @staticmethod
     def _append_prev_padding_mask(
         padding_mask: Optional[Tensor],
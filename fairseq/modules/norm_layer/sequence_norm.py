@@ -6,7 +6,7 @@ import torch.nn as nn
 from torch.autograd.function import FunctionCtx
 from torch.nn.parameter import Parameter
 
-import fairseq.mega2_extension.ops as mega2_ops
+from fairseq.modules.fused_ops.backend import mega2_ops, register_reference_op, use_extension
 
 
 class SequenceNormFunc(torch.autograd.Function):
@@ -49,7 +49,59 @@ class SequenceNormFunc(torch.autograd.Function):
         return x_grad, gamma_grad, beta_grad, None, None, None, None
 
 
-sequence_norm = SequenceNormFunc.apply
+@register_reference_op('sequence_norm')
+def sequence_norm_reference(
+    x: torch.Tensor,
+    gamma: torch.Tensor,
+    beta: torch.Tensor,
+    padding_mask: Optional[torch.Tensor] = None,
+    num_groups: Optional[int] = None,
+    eps: float = 1e-5,
+    length_last: bool = False
+) -> torch.Tensor:
+    dtype = x.dtype
+    # B x D x L
+    if not length_last:
+        x = x.transpose(1, 2)
+    bsz, num_features, seq_len = x.size()
+    num_groups = num_features if num_groups is None else num_groups
+    # B x G x D/G x L
+    xg = x.float().reshape(bsz, num_groups, -1, seq_len)
+    if padding_mask is not None:
+        # B x 1 x 1 x L
+        w = 1.0 - padding_mask.to(xg).view(bsz, 1, 1, seq_len)
+        count = w.sum(dim=-1, keepdim=True) * xg.size(2)
+        count = count.clamp(min=1.0)
+        mean = (xg * w).sum(dim=(2, 3), keepdim=True) / count
+        var = (torch.square(xg - mean) * w).sum(dim=(2, 3), keepdim=True) / count
+    else:
+        w = None
+        var, mean = torch.var_mean(xg, dim=(2, 3), unbiased=False, keepdim=True)
+    y = (xg - mean) * torch.rsqrt(var + eps)
+    if w is not None:
+        y = y * w
+    y = y.view(bsz, num_features, seq_len)
+    y = y * gamma.float().unsqueeze(-1) + beta.float().unsqueeze(-1)
+    if padding_mask is not None:
+        y = y.masked_fill(padding_mask.unsqueeze(1).to(torch.bool), 0.0)
+    y = y.to(dtype)
+    if not length_last:
+        y = y.transpose(1, 2)
+    return y
+
+
+def sequence_norm(
+    x: torch.Tensor,
+    gamma: torch.Tensor,
+    beta: torch.Tensor,
+    padding_mask: Optional[torch.Tensor] = None,
+    num_groups: Optional[int] = None,
+    eps: float = 1e-5,
+    length_last: bool = False
+) -> torch.Tensor:
+    if use_extension(x):
+        return SequenceNormFunc.apply(x, gamma, beta, padding_mask, num_groups, eps, length_last)
+    return sequence_norm_reference(x, gamma, beta, padding_mask, num_groups, eps, length_last)
 
 
 class SequenceNorm(nn.Module):
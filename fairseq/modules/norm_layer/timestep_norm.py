@@ -2,12 +2,13 @@ from typing import Optional, Tuple, Dict
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from torch.autograd.function import FunctionCtx
 from torch import Tensor
 from torch.nn.parameter import Parameter
 
-import fairseq.mega2_extension.ops as mega2_ops
+from fairseq.modules.fused_ops.backend import mega2_ops, register_reference_op, require_extension, use_extension
 from fairseq.incremental_decoding_utils import with_incremental_state
 
 
@@ -26,6 +27,7 @@ class TimestepNormFunc(torch.autograd.Function):
         num_groups: Optional[int] = None,
         eps: float = 1e-5
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        require_extension('timestep_norm')
         if num_groups is None:
             y, count, mean, var, cummean, cumrstd = mega2_ops.timestep_norm_fwd(
                 x, prev_count, prev_mean, prev_var, gamma, beta,padding_mask, eps
@@ -62,7 +64,177 @@ class TimestepNormFunc(torch.autograd.Function):
         return x_grad, None, prev_mean_grad, prev_var_grad, gamma_grad, beta_grad, None, None, None
 
 
-timestep_norm = TimestepNormFunc.apply
+def _welford_combine(
+    count: torch.Tensor, mean: torch.Tensor, m2: torch.Tensor,
+    other_count: torch.Tensor, other_mean: torch.Tensor, other_m2: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # merges two sets of (count, mean, sum of squared deviations) statistics
+    total = count + other_count
+    scale = other_count / total.clamp(min=1.0)
+    delta = other_mean - mean
+    mean = mean + delta * scale
+    m2 = m2 + other_m2 + delta * delta * count * scale
+    return total, mean, m2
+
+
+def _timestep_norm_step(
+    x: torch.Tensor,
+    prev_count: torch.Tensor,
+    prev_mean: torch.Tensor,
+    prev_var: torch.Tensor,
+    gamma: torch.Tensor,
+    beta: torch.Tensor,
+    padding_mask: Optional[torch.Tensor] = None,
+    num_groups: Optional[int] = None,
+    eps: float = 1e-5
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    # O(1) update of the running statistics with a single timestep, used for
+    # incremental decoding. Follows the Welford updates of the extension.
+    bsz, _, num_features = x.size()
+    num_groups = num_features if num_groups is None else num_groups
+    dtype = torch.promote_types(x.dtype, torch.float32)
+    # B x G x D/G
+    xg = x.to(dtype).view(bsz, num_groups, -1)
+    # B x G
+    group_var, group_mean = torch.var_mean(xg, dim=-1, unbiased=False)
+    mean = prev_mean.to(dtype)
+    var = prev_var.to(dtype)
+    # B x 1
+    count = prev_count.unsqueeze(1).to(dtype)
+    c1 = count / (count + 1.0)
+    c2 = 1.0 / (count + 1.0)
+    delta = group_mean - mean
+    cur_mean = c1 * mean + c2 * group_mean
+    cur_var = c1 * var + c2 * group_var + (c1 * delta) * (c2 * delta)
+
+    y = (xg - cur_mean.unsqueeze(-1)) * torch.rsqrt(cur_var + eps).unsqueeze(-1)
+    y = y.view(bsz, 1, num_features) * gamma.to(dtype) + beta.to(dtype)
+    if padding_mask is not None:
+        # B x 1
+        mask = padding_mask.view(bsz, 1).to(torch.bool)
+        y = y.masked_fill(mask.unsqueeze(-1), 0.0)
+        cur_mean = torch.where(mask, mean, cur_mean)
+        cur_var = torch.where(mask, var, cur_var)
+        prev_count = prev_count + (~mask).squeeze(1).to(prev_count)
+    else:
+        prev_count = prev_count + 1
+    return y.to(x), prev_count, cur_mean.to(prev_mean), cur_var.to(prev_var)
+
+
+@register_reference_op('timestep_norm')
+def timestep_norm_reference(
+    x: torch.Tensor,
+    prev_count: torch.Tensor,
+    prev_mean: torch.Tensor,
+    prev_var: torch.Tensor,
+    gamma: torch.Tensor,
+    beta: torch.Tensor,
+    padding_mask: Optional[torch.Tensor] = None,
+    num_groups: Optional[int] = None,
+    eps: float = 1e-5,
+    chunk_size: int = 64
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Normalizes every timestep of *x* (B x L x D) with the cumulative
+    statistics of the previous timesteps, starting from the running
+    statistics *prev_count*, *prev_mean* and *prev_var*.
+
+    The cumulative statistics are computed in fp32 (fp64 for double inputs)
+    with cumulative sums within chunks of *chunk_size* timesteps, centered on
+    the running mean at the start of the chunk, and the chunks are merged
+    sequentially with Welford's parallel update, which keeps the variance
+    numerically stable on long sequences.
+    """
+    bsz, seq_len, num_features = x.size()
+    if seq_len == 1:
+        return _timestep_norm_step(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask, num_groups, eps)
+
+    num_groups = num_features if num_groups is None else num_groups
+    dtype = torch.promote_types(x.dtype, torch.float32)
+    # B x L x G x D/G
+    xg = x.to(dtype).view(bsz, seq_len, num_groups, -1)
+    # B x L x G
+    if xg.size(-1) > 1:
+        group_var, group_mean = torch.var_mean(xg, dim=-1, unbiased=False)
+    else:
+        group_var, group_mean = None, xg.squeeze(-1)
+    # B x L x 1
+    if padding_mask is not None:
+        w = 1.0 - padding_mask.to(xg).unsqueeze(-1)
+        count = prev_count + (~padding_mask.to(torch.bool)).sum(dim=1).to(prev_count)
+    else:
+        w = xg.new_ones(bsz, seq_len, 1)
+        count = prev_count + seq_len
+
+    num_chunks = (seq_len + chunk_size - 1) // chunk_size
+    pad = num_chunks * chunk_size - seq_len
+    # B x K x C x G, padded timesteps have zero weight
+    w = F.pad(w, (0, 0, 0, pad)).view(bsz, num_chunks, chunk_size, 1)
+    group_mean = F.pad(group_mean, (0, 0, 0, pad)).view(bsz, num_chunks, chunk_size, num_groups)
+    if group_var is not None:
+        group_var = F.pad(group_var, (0, 0, 0, pad)).view(bsz, num_chunks, chunk_size, num_groups)
+
+    # statistics of every chunk: B x K x G
+    chunk_count = w.sum(dim=2)
+    chunk_mean = (group_mean * w).sum(dim=2) / chunk_count.clamp(min=1.0)
+    chunk_m2 = torch.square(group_mean - chunk_mean.unsqueeze(2))
+    if group_var is not None:
+        chunk_m2 = chunk_m2 + group_var
+    chunk_m2 = (chunk_m2 * w).sum(dim=2)
+
+    # running statistics at the start of every chunk
+    total = prev_count.to(dtype).unsqueeze(1)
+    mean = prev_mean.to(dtype)
+    m2 = prev_var.to(dtype) * total
+    start_count, start_mean, start_m2 = [], [], []
+    for k in range(num_chunks):
+        start_count.append(total)
+        start_mean.append(mean)
+        start_m2.append(m2)
+        total, mean, m2 = _welford_combine(total, mean, m2, chunk_count[:, k], chunk_mean[:, k], chunk_m2[:, k])
+    # B x K x 1 x G
+    start_count = torch.stack(start_count, dim=1).unsqueeze(2)
+    start_mean = torch.stack(start_mean, dim=1).unsqueeze(2)
+    start_m2 = torch.stack(start_m2, dim=1).unsqueeze(2)
+
+    # cumulative sums within the chunks, centered on the running mean
+    delta = group_mean - start_mean
+    sum1 = torch.cumsum(delta * w, dim=2)
+    sum2 = torch.square(delta)
+    if group_var is not None:
+        sum2 = sum2 + group_var
+    sum2 = torch.cumsum(sum2 * w, dim=2)
+    cum_count = (start_count + torch.cumsum(w, dim=2)).clamp(min=1.0)
+    offset = sum1 / cum_count
+    cum_mean = start_mean + offset
+    cum_var = ((start_m2 + sum2) / cum_count - torch.square(offset)).clamp(min=0.0)
+
+    # B x L x G x 1
+    cum_mean = cum_mean.view(bsz, -1, num_groups)[:, :seq_len].unsqueeze(-1)
+    cum_rstd = torch.rsqrt(cum_var.view(bsz, -1, num_groups)[:, :seq_len] + eps).unsqueeze(-1)
+    y = ((xg - cum_mean) * cum_rstd).view(bsz, seq_len, num_features)
+    y = y * gamma.to(dtype) + beta.to(dtype)
+    if padding_mask is not None:
+        y = y.masked_fill(padding_mask.unsqueeze(-1).to(torch.bool), 0.0)
+
+    # the statistics are left unchanged when all the timesteps are padded
+    var = torch.where(total > 0, m2 / total.clamp(min=1.0), prev_var.to(dtype))
+    return y.to(x), count, mean.to(prev_mean), var.to(prev_var)
+
+
+def timestep_norm(
+    x: torch.Tensor,
+    prev_count: torch.Tensor,
+    prev_mean: torch.Tensor,
+    prev_var: torch.Tensor,
+    gamma: torch.Tensor,
+    beta: torch.Tensor,
+    padding_mask: Optional[torch.Tensor] = None,
+    num_groups: Optional[int] = None,
+    eps: float = 1e-5
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    if use_extension(x):
+        return TimestepNormFunc.apply(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask, num_groups, eps)
+    return timestep_norm_reference(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask, num_groups, eps)
 
 
 @with_incremental_state
@@ -163,5 +335,24 @@ class TimestepNorm(nn.Module):
             incremental_state = self._set_input_buffer(incremental_state, input_buffer)
         return incremental_state
 
+    @torch.jit.export
+    def reset_incremental_state(
+            self, incremental_state: Dict[str, Dict[str, Optional[Tensor]]], reset_mask: Tensor
+    ):
+        """Reset the running statistics of the batch elements in reset_mask to the priors."""
+        input_buffer = self._get_input_buffer(incremental_state)
+        if 'prev_mean' in input_buffer:
+            prev_count = input_buffer['prev_count']
+            prev_mean = input_buffer['prev_mean']
+            prev_var = input_buffer['prev_var']
+            assert prev_count is not None and prev_mean is not None and prev_var is not None
+            # B x 1
+            mask = reset_mask.unsqueeze(1)
+            input_buffer['prev_count'] = torch.where(reset_mask, self.prior_count.to(prev_count), prev_count)
+            input_buffer['prev_mean'] = torch.where(mask, self.prior_mean.to(prev_mean), prev_mean)
+            input_buffer['prev_var'] = torch.where(mask, torch.exp(self.prior_logv).to(prev_var), prev_var)
+            incremental_state = self._set_input_buffer(incremental_state, input_buffer)
+        return incremental_state
+
     def extra_repr(self) -> str:
         return 'num_features={num_features}, num_groups={num_groups}, prior_count={_prior_count}, eps={eps}'.format(**self.__dict__)
@@ -2,7 +2,7 @@
 #
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
-from typing import Optional
+from typing import Dict, Tuple
 import warnings
 
 import torch
@@ -44,6 +44,39 @@ class SimpleRelativePositionalBias(nn.Module):
         return 'max positions={}'.format(self.max_positions)
 
 
+# process-wide tables of the rotary embeddings, shared by all the layers (and
+# models) with the same dim and base, keyed by (dim, base, dtype, device)
+_ROTARY_TABLES: Dict[Tuple[int, float, torch.dtype, torch.device], Tuple[torch.Tensor, torch.Tensor]] = {}
+
+
+def get_rotary_table(embed_dim: int, base: float, length: int, dtype: torch.dtype,
+                     device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Return the cos and sin tables of the rotary embeddings, of shape
+    (at least) length x embed_dim/2.
+
+    The tables grow geometrically; only the angles of the new positions are
+    computed when they grow.
+    """
+    key = (embed_dim, base, dtype, device)
+    table = _ROTARY_TABLES.get(key, None)
+    size = table[0].size(0) if table is not None else 0
+    if length > size:
+        new_size = max(length, 2 * size)
+        freqs = [base ** (j / embed_dim) for j in range(0, embed_dim, 2)]
+        freqs = 1.0 / torch.tensor(freqs, dtype=torch.float32, device=device)
+        # C x D/2
+        t = torch.arange(size, new_size, dtype=torch.float, device=device)
+        angles = torch.outer(t, freqs)
+        cos = torch.cos(angles).to(dtype)
+        sin = torch.sin(angles).to(dtype)
+        if table is not None:
+            cos = torch.cat([table[0], cos], dim=0)
+            sin = torch.cat([table[1], sin], dim=0)
+        table = (cos, sin)
+        _ROTARY_TABLES[key] = table
+    return table
+
+
 class RotaryEmbedding(nn.Module):
     def __init__(self, embed_dim, max_positions, base=None):
         super().__init__()
@@ -52,7 +85,6 @@ class RotaryEmbedding(nn.Module):
         self.max_positions = max_positions
         self.base = 10000 if base is None else base
         self.register_buffer("freqs", self._precompute_freqs())
-        self.freqs_cis: Optional[torch.Tensor] = None
 
     def _precompute_freqs(self):
         freqs = [self.base ** (j / self.embed_dim) for j in range(0, self.embed_dim, 2)]
@@ -60,32 +92,36 @@ class RotaryEmbedding(nn.Module):
         freqs = 1.0 / freqs
         return freqs
 
-    @torch.no_grad()
-    def _precompute_until(self, max_positions: int):
-        assert self.max_positions <= max_positions
-        self.max_positions = max_positions
-        # C
-        t = torch.arange(max_positions, dtype=torch.float, device=self.freqs.device)
-        # C x D/2
-        freqs = torch.outer(t, self.freqs.float())
-        freqs_cis = torch.polar(torch.ones_like(freqs), freqs)  # complex64
-        return freqs_cis
-
-    def get_freqs_cis(self, start: int, end: int) -> torch.Tensor:
-        if self.freqs_cis is None:
-            self.freqs_cis = self._precompute_until(self.max_positions)
-        if end > self.freqs_cis.shape[0]:
+    def get_cos_sin(self, start: int, end: int, dtype: torch.dtype,
+                    device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+        if end > self.max_positions:
             warnings.warn('Extending rotary range from {} to {}'.format(self.max_positions, end))
-            self.freqs_cis = self._precompute_until(end)
-        return self.freqs_cis[start:end]  # type: ignore
+        cos, sin = get_rotary_table(self.embed_dim, self.base, max(end, self.max_positions), dtype, device)
+        # the shared table may have grown past the requested length
+        self.max_positions = max(self.max_positions, cos.size(0))
+        return cos[start:end], sin[start:end]
 
     def rotary(self, x, sidx):
         seq_len = x.shape[1]
-        freqs_cis = self.get_freqs_cis(sidx, sidx + seq_len)
-        # B x N x C x D/2
-        x_ = torch.view_as_complex(x.float().reshape(*x.shape[:-1], -1, 2))
-        # B x N x C x D
-        x_out = torch.view_as_real(x_ * freqs_cis).flatten(2)
+        dtype = torch.float64 if x.dtype == torch.float64 else torch.float32
+        # C x D/2
+        cos, sin = self.get_cos_sin(sidx, sidx + seq_len, dtype, x.device)
+        x = x.to(dtype)
+        # pairs of consecutive features are rotated together
+        x1 = x[..., 0::2]
+        x2 = x[..., 1::2]
+        if torch.is_grad_enabled() and x.requires_grad:
+            x_out = torch.stack([x1 * cos - x2 * sin, x1 * sin + x2 * cos], dim=-1)
+            return x_out.flatten(-2)
+
+        # write the rotation into the output buffer in place
+        x_out = torch.empty_like(x)
+        out1 = x_out[..., 0::2]
+        out2 = x_out[..., 1::2]
+        torch.mul(x1, cos, out=out1)
+        out1.addcmul_(x2, sin, value=-1.0)
+        torch.mul(x1, sin, out=out2)
+        out2.addcmul_(x2, cos)
         return x_out
 
     def forward(self, xq, xk, qidx=0):
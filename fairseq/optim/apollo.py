@@ -25,6 +25,8 @@ class FairseqApollo(FairseqOptimizer):
                             help='weight decay')
         parser.add_argument('--weight-decay-type', choices=['L2', 'decoupled', 'stable'], default=None,
                             help='type of weight decay')
+        parser.add_argument('--apollo-multi-tensor', action='store_true', default=False,
+                            help='update all the parameters of a group at once on flat buffers')
 
     @property
     def optimizer_config(self):
@@ -41,8 +43,13 @@ class FairseqApollo(FairseqOptimizer):
             'rebound': self.args.apollo_rebound,
             'weight_decay': self.args.weight_decay,
             'weight_decay_type': self.args.weight_decay_type,
+            'multi_tensor': getattr(self.args, 'apollo_multi_tensor', False),
         }
 
+    @property
+    def supports_flat_params(self):
+        return True
+
 
 class Apollo(Optimizer):
     r"""Implements Atom algorithm.
@@ -59,9 +66,18 @@ class Apollo(Optimizer):
             weight_decay (float, optional): weight decay coefficient (default: 0)
             weight_decay_type (str, optional): type of weight decay:
                 ``'L2'`` | ``'decoupled'`` | ``'stable'`` (default: None)
+            multi_tensor (bool, optional): update all the parameters of a
+                group at once, on flat buffers holding the optimizer states of
+                the whole group, instead of one parameter at a time
+                (default: False)
+
+        A flat parameter with a ``param_sizes`` attribute, see
+        :func:`~fairseq.optim.fp16_optimizer._FP16OptimizerMixin.build_fp32_params`,
+        is updated as the concatenation of parameters of these sizes.
         """
 
-    def __init__(self, params, lr, beta=0.9, eps=1e-4, rebound='constant', weight_decay=0, weight_decay_type=None):
+    def __init__(self, params, lr, beta=0.9, eps=1e-4, rebound='constant', weight_decay=0, weight_decay_type=None,
+                 multi_tensor=False):
         if not 0.0 < lr:
             raise ValueError("Invalid learning rate value: {}".format(lr))
         if not 0.0 <= eps:
@@ -78,11 +94,21 @@ class Apollo(Optimizer):
             raise ValueError("Invalid weight decay type: {}".format(weight_decay_type))
 
         defaults = dict(lr=lr, beta=beta, eps=eps, rebound=rebound,
-                        weight_decay=weight_decay, weight_decay_type=weight_decay_type)
+                        weight_decay=weight_decay, weight_decay_type=weight_decay_type,
+                        multi_tensor=multi_tensor)
         super(Apollo, self).__init__(params, defaults)
+        self._flat_states = {}
 
     def __setstate__(self, state):
         super(Apollo, self).__setstate__(state)
+        for group in self.param_groups:
+            group.setdefault('multi_tensor', False)
+        self._flat_states = {}
+
+    def load_state_dict(self, state_dict):
+        super(Apollo, self).load_state_dict(state_dict)
+        # the loaded states are no longer views of the flat buffers
+        self._flat_states = {}
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -97,10 +123,20 @@ class Apollo(Optimizer):
                 loss = closure()
 
         for group in self.param_groups:
+            if group['multi_tensor']:
+                params = [p for p in group['params'] if p.grad is not None]
+                if len(params) > 0 and all(p.dtype == params[0].dtype and p.device == params[0].device for p in params):
+                    self._multi_tensor_step(group, params)
+                    continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
 
+                if hasattr(p, 'param_sizes'):
+                    self._multi_tensor_step(group, [p])
+                    continue
+
                 state = self.state[p]
 
                 # State initialization
@@ -173,3 +209,138 @@ class Apollo(Optimizer):
                 p.add_(d_p, alpha=-curr_lr)
 
         return loss
+
+    def _get_flat_state(self, params):
+        """Return the states of *params* in flat buffers. The per-parameter
+        states are views of these buffers, which are rebuilt from them when
+        the parameters change or after loading a state dict."""
+        key = tuple(id(p) for p in params)
+        flat_state = self._flat_states.get(key[0], None)
+        if flat_state is not None and flat_state['key'] == key:
+            return flat_state
+        for k in [k for k, v in self._flat_states.items() if not set(key).isdisjoint(v['key'])]:
+            del self._flat_states[k]
+
+        if len(params) == 1 and hasattr(params[0], 'param_sizes'):
+            sizes = list(params[0].param_sizes)
+        else:
+            sizes = [p.numel() for p in params]
+        flat_state = {
+            'key': key,
+            'sizes': sizes,
+            'lengths': torch.tensor(sizes, dtype=torch.long, device=params[0].device),
+            'numel': sum(sizes),
+        }
+        for p in params:
+            state = self.state[p]
+            if len(state) == 0:
+                state['step'] = 0
+                state['exp_avg_grad'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                state['approx_hessian'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                state['update'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+        for name in ['exp_avg_grad', 'approx_hessian', 'update']:
+            flat = torch.cat([self.state[p][name].reshape(-1) for p in params])
+            for p, view in zip(params, flat.split([p.numel() for p in params])):
+                self.state[p][name] = view.view_as(p)
+            flat_state[name] = flat
+        self._flat_states[key[0]] = flat_state
+        return flat_state
+
+    def _multi_tensor_step(self, group, params):
+        """Same update as :func:`step` for all the *params* of *group* at
+        once. The per-parameter norms and sums are segment reductions over
+        the flat buffers."""
+        flat_state = self._get_flat_state(params)
+        sizes, lengths, numel = flat_state['sizes'], flat_state['lengths'], flat_state['numel']
+
+        def segment_sum(x):
+            if hasattr(torch, 'segment_reduce'):
+                return torch.segment_reduce(x, 'sum', lengths=lengths)
+            return torch.stack([t.sum() for t in x.split(sizes)])
+
+        def segment_max(x):
+            if hasattr(torch, 'segment_reduce'):
+                return torch.segment_reduce(x, 'max', lengths=lengths)
+            return torch.stack([t.max() for t in x.split(sizes)])
+
+        def expand(x):
+            # one value per parameter to one value per element
+            if hasattr(torch, 'segment_reduce'):
+                return torch.repeat_interleave(x, lengths, dim=0, output_size=numel)
+            return torch.cat([v.expand(n) for v, n in zip(x, sizes)])
+
+        if params[0].grad.is_sparse:
+            raise RuntimeError('Atom does not support sparse gradients.')
+        if len(params) == 1:
+            p = params[0].data.view(-1)
+            grad = params[0].grad.view(-1)
+        else:
+            p = torch.cat([q.data.view(-1) for q in params]) if group['weight_decay'] != 0 else None
+            grad = torch.cat([q.grad.view(-1) for q in params])
+
+        # Perform step weight decay
+        if group['weight_decay'] != 0 and group['weight_decay_type'] == 'L2':
+            grad = grad.add(p, alpha=group['weight_decay'])
+
+        beta = group['beta']
+        eps = group['eps']
+        exp_avg_grad = flat_state['exp_avg_grad']
+        B = flat_state['approx_hessian']
+        d_p = flat_state['update']
+
+        # one alpha per parameter
+        alpha = []
+        for q in params:
+            self.state[q]['step'] += 1
+            bias_correction = 1 - beta ** self.state[q]['step']
+            alpha.append((1 - beta) / bias_correction)
+        if len(params) == 1:
+            alpha = alpha * len(sizes)
+        alpha = torch.tensor(alpha, dtype=exp_avg_grad.dtype, device=exp_avg_grad.device)
+
+        # calc the diff grad
+        delta_grad = grad - exp_avg_grad
+        if group['rebound'] == 'belief':
+            rebound = segment_max(delta_grad.abs())
+        else:
+            rebound = 0.01
+            eps = eps / rebound
+
+        # Update the running average grad
+        alpha_e = expand(alpha)
+        exp_avg_grad.addcmul_(delta_grad, alpha_e)
+
+        denom = expand(segment_sum(d_p.pow(4)).pow_(0.25).add_(eps))
+        d_p.div_(denom)
+        v_sq = d_p.mul(d_p)
+        delta = segment_sum(delta_grad.div_(denom).mul_(d_p)).mul_(-alpha) - segment_sum(B.mul(v_sq))
+
+        # Update B
+        B.addcmul_(v_sq, expand(delta))
+
+        # calc direction of parameter updates
+        if group['rebound'] == 'belief':
+            denom = torch.max(B.abs(), expand(rebound)).add_(eps / alpha_e)
+        else:
+            denom = B.abs().clamp_(min=rebound)
+
+        torch.div(exp_avg_grad, denom, out=d_p)
+
+        # Perform step weight decay
+        if group['weight_decay'] != 0 and group['weight_decay_type'] != 'L2':
+            if group['weight_decay_type'] == 'stable':
+                numels = lengths.to(denom.dtype)
+                weight_decay = expand(numels.div_(segment_sum(denom)).mul_(group['weight_decay']))
+                d_p.addcmul_(p, weight_decay)
+            else:
+                d_p.add_(p, alpha=group['weight_decay'])
+
+        if len(params) == 1:
+            p.add_(d_p, alpha=-group['lr'])
+        else:
+            updates = [u.view_as(q) for q, u in zip(params, d_p.split(sizes))]
+            if hasattr(torch, '_foreach_add_'):
+                torch._foreach_add_([q.data for q in params], updates, alpha=-group['lr'])
+            else:
+                for q, u in zip(params, updates):
+                    q.data.add_(u, alpha=-group['lr'])
@@ -35,6 +35,8 @@ class _FP16OptimizerMixin(object):
                 offset += numel
             fp32_params = torch.nn.Parameter(fp32_params)
             fp32_params.grad = fp32_params.data.new(total_param_size)
+            # for optimizers with per-parameter statistics, e.g. Apollo
+            fp32_params.param_sizes = [p.data.numel() for p in params]
             return fp32_params
         else:
             fp32_params = []
@@ -43,6 +43,12 @@ def get_interactive_generation_parser(default_task="translation"):
     return get_generation_parser(interactive=True, default_task=default_task)
 
 
+def get_serving_parser(default_task="language_modeling"):
+    parser = get_generation_parser(default_task=default_task)
+    add_serving_args(parser)
+    return parser
+
+
 def get_eval_lm_parser(default_task="language_modeling"):
     parser = get_parser("Evaluate Language Model", default_task)
     add_dataset_args(parser, gen=True)
@@ -270,6 +276,13 @@ def get_parser(desc, default_task="translation"):
     parser.add_argument('--quantization-config-path', default=None,
                         help='path to quantization config file')
     parser.add_argument('--profile', action='store_true', help='enable autograd profiler emit_nvtx')
+    parser.add_argument('--profile-modules', default=None, metavar='TYPES',
+                        help='comma separated class names of the modules to profile (forward/backward time, '
+                             'memory and FLOPs), e.g. MovingAverageGatedAttention,MultiHeadEMA')
+    parser.add_argument('--profile-modules-interval', default=100, type=int, metavar='N',
+                        help='profile the modules every N updates')
+    parser.add_argument('--profile-modules-report', default=None, metavar='FILE',
+                        help='write the tab separated module profile to FILE')
 
     # wandb
     parser.add_argument('--wandb-project', default=None, help='wandb project name')
@@ -335,6 +348,14 @@ def add_preprocess_args(parser):
                        help="Pad dictionary size to be multiple of N")
     group.add_argument("--workers", metavar="N", default=1, type=int,
                        help="number of parallel workers")
+    group.add_argument("--pipelined-binarization", action="store_true",
+                       help="binarize with --workers processes streaming encoded chunks to a single "
+                            "writer, in one pass and bounded memory (requires --dataset-impl mmap)")
+    group.add_argument("--binarize-chunk-size", metavar="BYTES", default=1 << 22, type=int,
+                       help="size of the chunks of input encoded by the workers with --pipelined-binarization")
+    group.add_argument("--binarize-queue-size", metavar="N", default=None, type=int,
+                       help="maximum number of chunks in flight with --pipelined-binarization "
+                            "(default: 2 * --workers)")
     # fmt: on
     return parser
 
@@ -530,6 +551,13 @@ def add_checkpoint_args(parser):
                        help='don\'t store last checkpoints')
     group.add_argument('--no-save-optimizer-state', action='store_true',
                        help='don\'t save optimizer-state as part of checkpoint')
+    group.add_argument('--async-checkpoint', action='store_true',
+                       help='write checkpoints in a background thread')
+    group.add_argument('--max-pending-checkpoints', type=int, default=1, metavar='N',
+                       help='maximum number of checkpoints being written in the background')
+    group.add_argument('--ema-decay', type=float, default=0., metavar='D',
+                       help='keep an exponential moving average of the weights with this decay '
+                            'and save it in the checkpoints (0 to disable)')
     group.add_argument('--best-checkpoint-metric', type=str, default='loss',
                        help='metric to use for saving "best" checkpoints')
     group.add_argument('--maximize-best-checkpoint-metric', action='store_true',
@@ -572,12 +600,20 @@ def add_eval_lm_args(parser):
     group.add_argument('--softmax-batch', default=sys.maxsize, type=int, metavar='N',
                        help='if BxT is more than this, will batch the softmax over vocab to this amount of tokens'
                             ' in order to fit into GPU memory')
+    group.add_argument('--target-only-scoring', action='store_true',
+                       help='only compute the log probs of the targets, streaming the output projection '
+                            'over the vocabulary instead of normalizing the full distribution')
+    group.add_argument('--vocab-block-size', default=8192, type=int, metavar='N',
+                       help='number of words per block of the output projection with --target-only-scoring')
 
     # arguments for mega lm
     group.add_argument('--test-chunk-size', type=int, default=1024, metavar='N',
                        help='attention chunk size at test time')
     group.add_argument('--chunk-nums', type=int, default=1, metavar='N',
                        help='process this number of chunks each time')
+    group.add_argument('--streaming-lanes', type=int, default=0, metavar='N',
+                       help='if > 0, pack documents into this many lanes and score them as a '
+                            'stream of --test-chunk-size * --chunk-nums token steps')
     # fmt: on
 
 
@@ -672,6 +708,18 @@ def add_interactive_args(parser):
     # fmt: on
 
 
+def add_serving_args(parser):
+    group = parser.add_argument_group("Serving")
+    # fmt: off
+    group.add_argument('--num-slots', default=8, type=int, metavar='N',
+                       help='maximum number of requests decoded together')
+    group.add_argument('--max-queue-size', default=64, type=int, metavar='N',
+                       help='maximum number of requests waiting for a slot, further ones are rejected')
+    group.add_argument('--request-timeout', default=None, type=float, metavar='SEC',
+                       help='drop the requests which are not complete after this many seconds')
+    # fmt: on
+
+
 def add_model_args(parser):
     group = parser.add_argument_group("Model configuration")
     # fmt: off
@@ -81,6 +81,13 @@ class SequenceGenerator(nn.Module):
         self.temperature = temperature
         self.match_source_len = match_source_len
         self.no_repeat_ngram_size = no_repeat_ngram_size
+        # the keys of the (n-1)-token ngram prefixes are the prefixes written
+        # in base vocab_size, which is exact as long as they fit in int64 and
+        # a rolling hash (mod 2^64) otherwise
+        ngram_prefix_size = max(no_repeat_ngram_size - 1, 1)
+        self.ngram_keys_exact = self.vocab_size ** ngram_prefix_size < 2 ** 63
+        ngram_key_shift = pow(self.vocab_size, ngram_prefix_size - 1, 2 ** 64)
+        self.ngram_key_shift = ngram_key_shift - 2 ** 64 if ngram_key_shift >= 2 ** 63 else ngram_key_shift
         assert temperature > 0, "--temperature must be greater than 0"
 
         self.search = (
@@ -226,6 +233,9 @@ class SequenceGenerator(nn.Module):
         )  # +2 for eos and pad
         tokens[:, 0] = self.eos if bos_token is None else bos_token
         attn: Optional[Tensor] = None
+        # rolling keys of the ngram prefixes ending at each position of tokens,
+        # reordered along with tokens
+        ngram_keys = torch.zeros_like(tokens)
 
         # A list that indicates candidates that should be ignored.
         # For example, suppose we're sampling and have already finalized 2/5
@@ -321,7 +331,7 @@ class SequenceGenerator(nn.Module):
                 self.search.set_src_lengths(src_lengths)
 
             if self.no_repeat_ngram_size > 0:
-                lprobs = self._no_repeat_ngram(tokens, lprobs, bsz, beam_size, step)
+                lprobs = self._no_repeat_ngram(tokens, ngram_keys, lprobs, step)
 
             cand_scores, cand_indices, cand_beams = self.search.step(
                 step,
@@ -392,6 +402,8 @@ class SequenceGenerator(nn.Module):
 
                 scores = scores.view(bsz, -1)[batch_idxs].view(new_bsz * beam_size, -1)
                 tokens = tokens.view(bsz, -1)[batch_idxs].view(new_bsz * beam_size, -1)
+                if self.no_repeat_ngram_size > 0:
+                    ngram_keys = ngram_keys.view(bsz, -1)[batch_idxs].view(new_bsz * beam_size, -1)
                 if attn is not None:
                     attn = attn.view(bsz, -1)[batch_idxs].view(
                         new_bsz * beam_size, attn.size(1), -1
@@ -434,6 +446,10 @@ class SequenceGenerator(nn.Module):
             tokens.view(bsz, beam_size, -1)[:, :, step + 1] = torch.gather(
                 cand_indices, dim=1, index=active_hypos
             )
+            if self.no_repeat_ngram_size > 0:
+                ngram_keys[:, : step + 1] = torch.index_select(
+                    ngram_keys[:, : step + 1], dim=0, index=active_bbsz_idx
+                )
             if step > 0:
                 scores[:, :step] = torch.index_select(
                     scores[:, :step], dim=0, index=active_bbsz_idx
@@ -612,61 +628,42 @@ class SequenceGenerator(nn.Module):
             return True
         return False
 
-    def calculate_banned_tokens(
-        self,
-        tokens,
-        step: int,
-        gen_ngrams: List[Dict[str, List[int]]],
-        no_repeat_ngram_size: int,
-        bbsz_idx: int,
-    ):
-        tokens_list: List[int] = tokens[
-            bbsz_idx, step + 2 - no_repeat_ngram_size : step + 1
-        ].tolist()
-        # before decoding the next token, prevent decoding of ngrams that have already appeared
-        ngram_index = ",".join([str(x) for x in tokens_list])
-        return gen_ngrams[bbsz_idx].get(ngram_index, torch.jit.annotate(List[int], []))
-
-    def transpose_list(self, l: List[List[int]]):
-        # GeneratorExp aren't supported in TS so ignoring the lint
-        min_len = min([len(x) for x in l])  # noqa
-        l2 = [[row[i] for row in l] for i in range(min_len)]
-        return l2
-
-    def _no_repeat_ngram(self, tokens, lprobs, bsz: int, beam_size: int, step: int):
-        # for each beam and batch sentence, generate a list of previous ngrams
-        gen_ngrams: List[Dict[str, List[int]]] = [
-            torch.jit.annotate(Dict[str, List[int]], {})
-            for bbsz_idx in range(bsz * beam_size)
-        ]
-        cpu_tokens = tokens.cpu()
-        for bbsz_idx in range(bsz * beam_size):
-            gen_tokens: List[int] = cpu_tokens[bbsz_idx].tolist()
-            for ngram in self.transpose_list(
-                [gen_tokens[i:] for i in range(self.no_repeat_ngram_size)]
-            ):
-                key = ",".join([str(x) for x in ngram[:-1]])
-                gen_ngrams[bbsz_idx][key] = gen_ngrams[bbsz_idx].get(
-                    key, torch.jit.annotate(List[int], [])
-                ) + [ngram[-1]]
+    def _no_repeat_ngram(self, tokens, ngram_keys, lprobs, step: int):
+        """Ban the tokens which would repeat an ngram of the hypotheses.
+
+        ngram_keys[:, t] holds the key of the n-1 tokens ending at position t;
+        only the key of the current position is computed at each step, and
+        the banned tokens are the ones following an earlier occurrence of it.
 
-        if step + 2 - self.no_repeat_ngram_size >= 0:
+        Updating the key is O(1) per step, but finding its earlier occurrences
+        still compares it with the step previous keys, i.e. each step is
+        O(step) vectorized tensor work instead of the per-hypothesis Python
+        dictionaries rebuilt from scratch before.
+        """
+        n = self.no_repeat_ngram_size
+        if n == 1:
+            return lprobs.scatter_(1, tokens[:, : step + 1], -math.inf)
+
+        key = tokens[:, step]
+        if step > 0:
+            prev_key = ngram_keys[:, step - 1]
+            if step >= n - 1:
+                # drop the token leaving the window
+                prev_key = prev_key - tokens[:, step - n + 1] * self.ngram_key_shift
+            key = prev_key * self.vocab_size + key
+        ngram_keys[:, step] = key
+        if step < n - 1:
             # no banned tokens if we haven't generated no_repeat_ngram_size tokens yet
-            banned_tokens = [
-                self.calculate_banned_tokens(
-                    tokens, step, gen_ngrams, self.no_repeat_ngram_size, bbsz_idx
-                )
-                for bbsz_idx in range(bsz * beam_size)
-            ]
-        else:
-            banned_tokens = [
-                torch.jit.annotate(List[int], []) for bbsz_idx in range(bsz * beam_size)
-            ]
-        for bbsz_idx in range(bsz * beam_size):
-            lprobs[bbsz_idx][
-                torch.tensor(banned_tokens[bbsz_idx]).long()
-            ] = torch.tensor(-math.inf, dtype=torch.float)
-        return lprobs
+            return lprobs
+
+        # prefixes ending at positions n-2 .. step-1, followed by tokens n-1 .. step
+        match = ngram_keys[:, n - 2 : step].eq(key.unsqueeze(1))
+        if not self.ngram_keys_exact:
+            prefixes = tokens[:, :step].unfold(1, n - 1, 1)
+            match = match & prefixes.eq(tokens[:, step - n + 2 : step + 1].unsqueeze(1)).all(dim=-1)
+        # pad is never selected anyway, so it stands for the tokens that are not banned
+        banned = torch.where(match, tokens[:, n - 1 : step + 1], torch.full_like(key.unsqueeze(1), self.pad))
+        return lprobs.scatter_(1, banned, -math.inf)
 
 
 class EnsembleModel(nn.Module):
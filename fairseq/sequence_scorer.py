@@ -10,16 +10,25 @@ from fairseq import utils
 
 
 class SequenceScorer(object):
-    """Scores the target for a given source sentence."""
+    """Scores the target for a given source sentence.
+
+    With *target_only*, the decoders only return their features and the
+    target log probs are computed with
+    :func:`~fairseq.models.FairseqDecoder.get_target_log_probs`, without
+    normalizing over the full vocabulary for every position.
+    """
 
     def __init__(
         self, tgt_dict, softmax_batch=None, compute_alignment=False, eos=None,
-        symbols_to_strip_from_output=None,
+        symbols_to_strip_from_output=None, target_only=False, vocab_block_size=8192,
     ):
         self.pad = tgt_dict.pad()
         self.eos = tgt_dict.eos() if eos is None else eos
         self.softmax_batch = softmax_batch or sys.maxsize
         assert self.softmax_batch > 0
+        self.target_only = target_only
+        self.vocab_block_size = vocab_block_size
+        assert self.vocab_block_size > 0
         self.compute_alignment = compute_alignment
         self.symbols_to_strip_from_output = (
             symbols_to_strip_from_output.union({self.eos})
@@ -52,37 +61,57 @@ class SequenceScorer(object):
             )
             return probs
 
+        def target_log_probs(model, features, target):
+            # softmax_batch positions at a time, B x T
+            flat = features.contiguous().view(1, -1, features.size(-1))
+            flat_tgt = target.contiguous().view(1, -1)
+            lprobs = [
+                model.decoder.get_target_log_probs(
+                    flat[:, s:s + self.softmax_batch], flat_tgt[:, s:s + self.softmax_batch], self.vocab_block_size,
+                ).view(-1)
+                for s in range(0, flat.size(1), self.softmax_batch)
+            ]
+            return torch.cat(lprobs).view(target.shape)
+
         orig_target = sample['target']
 
         # compute scores for each model in the ensemble
         avg_probs = None
         avg_attn = None
+        decoder_kwargs = {'features_only': True} if self.target_only else {}
         for model in models:
             model.eval()
             if incremental_states is not None:
-                decoder_out = model.decoder.forward(sample['net_input']['src_tokens'], incremental_states)
+                decoder_out = model.decoder.forward(
+                    sample['net_input']['src_tokens'], incremental_states, **decoder_kwargs
+                )
             else:
-                decoder_out = model(**net_input)
+                decoder_out = model(**net_input, **decoder_kwargs)
             attn = decoder_out[1] if len(decoder_out) > 1 else None
             if type(attn) is dict:
                 attn = attn.get('attn', None)
 
-            batched = batch_for_softmax(decoder_out, orig_target)
-            probs, idx = None, 0
-            for bd, tgt, is_single in batched:
-                sample['target'] = tgt
-                curr_prob = model.get_normalized_probs(bd, log_probs=len(models) == 1, sample=sample).data
-                if is_single:
-                    probs = gather_target_probs(curr_prob, orig_target)
-                else:
-                    if probs is None:
-                        probs = curr_prob.new(orig_target.numel())
-                    step = curr_prob.size(0) * curr_prob.size(1)
-                    end = step + idx
-                    tgt_probs = gather_target_probs(curr_prob.view(tgt.shape + (curr_prob.size(-1),)), tgt)
-                    probs[idx:end] = tgt_probs.view(-1)
-                    idx = end
-                sample['target'] = orig_target
+            if self.target_only:
+                probs = target_log_probs(model, decoder_out[0], orig_target)
+                if len(models) > 1:
+                    probs.exp_()
+            else:
+                batched = batch_for_softmax(decoder_out, orig_target)
+                probs, idx = None, 0
+                for bd, tgt, is_single in batched:
+                    sample['target'] = tgt
+                    curr_prob = model.get_normalized_probs(bd, log_probs=len(models) == 1, sample=sample).data
+                    if is_single:
+                        probs = gather_target_probs(curr_prob, orig_target)
+                    else:
+                        if probs is None:
+                            probs = curr_prob.new(orig_target.numel())
+                        step = curr_prob.size(0) * curr_prob.size(1)
+                        end = step + idx
+                        tgt_probs = gather_target_probs(curr_prob.view(tgt.shape + (curr_prob.size(-1),)), tgt)
+                        probs[idx:end] = tgt_probs.view(-1)
+                        idx = end
+                    sample['target'] = orig_target
 
             probs = probs.view(sample['target'].shape)
 
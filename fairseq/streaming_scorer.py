@@ -0,0 +1,194 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import sys
+from typing import Dict, List, Optional
+
+import torch
+from torch import Tensor
+
+
+class StreamingScorer(object):
+    """Scores a stream of documents with stateful language models.
+
+    Documents of different lengths are packed into ``num_lanes`` lanes of a
+    fixed-width batch which is fed to the decoders ``step_size`` tokens at a
+    time, carrying the incremental state across steps. When a document ends,
+    its lane is refilled with the next document at the following step and the
+    incremental state of the lane is reset in place (see
+    :func:`~fairseq.models.FairseqIncrementalDecoder.reset_incremental_state`),
+    so every step runs on a batch of the same shape.
+
+    Scores are accumulated on the device and only copied back to the host
+    once, after the last document has been scored. *target_only* has the
+    same meaning as in :class:`~fairseq.sequence_scorer.SequenceScorer`.
+    """
+
+    def __init__(self, tgt_dict, num_lanes, step_size, softmax_batch=None, target_only=False,
+                 vocab_block_size=8192):
+        self.pad = tgt_dict.pad()
+        self.num_lanes = num_lanes
+        self.step_size = step_size
+        self.softmax_batch = softmax_batch or sys.maxsize
+        self.target_only = target_only
+        self.vocab_block_size = vocab_block_size
+        assert self.num_lanes > 0 and self.step_size > 0
+        assert self.softmax_batch > 0 and self.vocab_block_size > 0
+
+    def _target_probs(self, model, decoder_out, target, log_probs):
+        if self.target_only:
+            lprobs = self._target_log_probs(model, decoder_out[0], target)
+            return lprobs if log_probs else lprobs.exp_()
+
+        # B x T x C -> B x T, optionally batching the softmax over the vocabulary
+        features, rest = decoder_out[0], decoder_out[1:]
+        bsz, tsz, dim = features.size()
+        if bsz * tsz < self.softmax_batch:
+            probs = model.get_normalized_probs(decoder_out, log_probs=log_probs, sample={'target': target})
+            return probs.gather(dim=2, index=target.unsqueeze(-1)).squeeze(-1)
+
+        flat = features.contiguous().view(1, -1, dim)
+        flat_tgt = target.contiguous().view(1, -1)
+        probs = []
+        for s in range(0, flat.size(1), self.softmax_batch):
+            tgt = flat_tgt[:, s:s + self.softmax_batch]
+            curr_probs = model.get_normalized_probs(
+                (flat[:, s:s + self.softmax_batch],) + rest, log_probs=log_probs, sample={'target': tgt}
+            )
+            probs.append(curr_probs.gather(dim=2, index=tgt.unsqueeze(-1)).view(-1))
+        return torch.cat(probs).view(bsz, tsz)
+
+    def _target_log_probs(self, model, features, target):
+        flat = features.contiguous().view(1, -1, features.size(-1))
+        flat_tgt = target.contiguous().view(1, -1)
+        lprobs = [
+            model.decoder.get_target_log_probs(
+                flat[:, s:s + self.softmax_batch], flat_tgt[:, s:s + self.softmax_batch], self.vocab_block_size,
+            ).view(-1)
+            for s in range(0, flat.size(1), self.softmax_batch)
+        ]
+        return torch.cat(lprobs).view(target.shape)
+
+    def _step(self, models, incremental_states, src_tokens, target):
+        avg_probs = None
+        for model, incremental_state in zip(models, incremental_states):
+            if self.target_only:
+                decoder_out = model.decoder.forward(src_tokens, incremental_state, features_only=True)
+            else:
+                decoder_out = model.decoder.forward(src_tokens, incremental_state)
+            probs = self._target_probs(model, decoder_out, target, log_probs=len(models) == 1)
+            if avg_probs is None:
+                avg_probs = probs
+            else:
+                avg_probs.add_(probs)
+        if len(models) > 1:
+            avg_probs.div_(len(models))
+            avg_probs.log_()
+        return avg_probs
+
+    @torch.no_grad()
+    def score(self, models, documents, device=None) -> Dict[str, object]:
+        """Score an iterable of documents.
+
+        Args:
+            models (List[~fairseq.models.FairseqLanguageModel]): ensemble of
+                models with incremental decoders.
+            documents (iterable): dicts with an ``id`` and 1-D ``source`` and
+                ``target`` LongTensors of the same length, as returned by
+                :class:`~fairseq.data.MonolingualDataset`. Target tokens equal
+                to the padding index are not scored.
+            device (torch.device, optional): device of the models (default:
+                the device of the first model's parameters).
+
+        Returns:
+            dict with the document ``id`` list in the order in which the
+            documents were completed, and the matching per-document sum of
+            finite target log-probabilities (``score``) and number of tokens
+            contributing to it (``ntokens``), as CPU tensors.
+        """
+        if device is None:
+            device = next(models[0].parameters()).device
+        non_blocking = device.type == 'cuda'
+        for model in models:
+            model.eval()
+
+        num_lanes, step_size = self.num_lanes, self.step_size
+        incremental_states: List[Dict[str, Dict[str, Optional[Tensor]]]] = [
+            torch.jit.annotate(Dict[str, Dict[str, Optional[Tensor]]], {}) for _ in models
+        ]
+        lane_docs = [None] * num_lanes
+        lane_pos = [0] * num_lanes
+        lane_score = torch.zeros(num_lanes, dtype=torch.double, device=device)
+        lane_count = torch.zeros(num_lanes, dtype=torch.long, device=device)
+
+        doc_ids = []
+        done_scores = []
+        done_counts = []
+
+        documents = iter(documents)
+        exhausted = False
+        while True:
+            # pinned host buffers, filled lane by lane and copied to the device in one go
+            src_tokens = torch.full((num_lanes, step_size), self.pad, dtype=torch.long)
+            target = torch.full((num_lanes, step_size), self.pad, dtype=torch.long)
+            reset_mask = torch.zeros(num_lanes, dtype=torch.bool)
+            finished = []
+            for i in range(num_lanes):
+                if lane_docs[i] is None and not exhausted:
+                    # refill the lane, skipping empty documents
+                    for doc in documents:
+                        if doc['target'].numel() > 0:
+                            lane_docs[i] = doc
+                            lane_pos[i] = 0
+                            reset_mask[i] = True
+                            break
+                    else:
+                        exhausted = True
+                doc = lane_docs[i]
+                if doc is None:
+                    continue
+                start = lane_pos[i]
+                end = min(start + step_size, doc['target'].numel())
+                src_tokens[i, :end - start] = doc['source'][start:end]
+                target[i, :end - start] = doc['target'][start:end]
+                lane_pos[i] = end
+                if end == doc['target'].numel():
+                    finished.append(i)
+                    doc_ids.append(doc['id'])
+                    lane_docs[i] = None
+
+            if len(finished) == 0 and all(doc is None for doc in lane_docs):
+                break
+
+            if non_blocking:
+                src_tokens = src_tokens.pin_memory()
+                target = target.pin_memory()
+                reset_mask = reset_mask.pin_memory()
+            src_tokens = src_tokens.to(device, non_blocking=non_blocking)
+            target = target.to(device, non_blocking=non_blocking)
+            reset_mask = reset_mask.to(device, non_blocking=non_blocking)
+
+            # new documents start from the initial state and a zero score
+            for model, incremental_state in zip(models, incremental_states):
+                if len(incremental_state) > 0:
+                    model.decoder.reset_incremental_state_scripting(incremental_state, reset_mask)
+            lane_score.masked_fill_(reset_mask, 0.)
+            lane_count.masked_fill_(reset_mask, 0)
+
+            lprobs = self._step(models, incremental_states, src_tokens, target)
+            valid = target.ne(self.pad) & torch.isfinite(lprobs)
+            lane_score.add_(torch.where(valid, lprobs, torch.zeros_like(lprobs)).sum(dim=1, dtype=torch.double))
+            lane_count.add_(valid.sum(dim=1))
+
+            if len(finished) > 0:
+                index = torch.tensor(finished, dtype=torch.long).to(device, non_blocking=non_blocking)
+                done_scores.append(lane_score.index_select(0, index))
+                done_counts.append(lane_count.index_select(0, index))
+
+        if len(doc_ids) == 0:
+            return {'id': [], 'score': torch.zeros(0, dtype=torch.double), 'ntokens': torch.zeros(0, dtype=torch.long)}
+        return {
+            'id': doc_ids,
+            'score': torch.cat(done_scores).cpu(),
+            'ntokens': torch.cat(done_counts).cpu(),
+        }
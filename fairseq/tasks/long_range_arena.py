@@ -14,6 +14,7 @@ from fairseq.data import (
     data_utils,
     Dictionary,
     IdDataset,
+    MMapPixelSequenceDataset,
     NestedDictionaryDataset,
     NumSamplesDataset,
     NumelDataset,
@@ -271,7 +272,11 @@ class LRAImageTask(FairseqTask):
 
         def make_dataset(type):
             split_path = get_path(type, split)
-            dataset = PixelSequenceDataset(split_path + '.src', self.normalization)
+            if MMapPixelSequenceDataset.exists(split_path + '.src'):
+                # binarized with scripts/binarize_lra_pixels.py
+                dataset = MMapPixelSequenceDataset(split_path + '.src', self.normalization)
+            else:
+                dataset = PixelSequenceDataset(split_path + '.src', self.normalization)
             return dataset
 
         src_ds = make_dataset('input')
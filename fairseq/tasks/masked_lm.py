@@ -63,6 +63,9 @@ class MaskedLMTask(FairseqTask):
                             help='sample random replacement words based on word frequencies')
         parser.add_argument('--mask-whole-words', default=False, action='store_true',
                             help='mask whole words; you may also want to set --bpe')
+        parser.add_argument('--collate-masking', default=False, action='store_true',
+                            help='mask whole batches at collate time with vectorized ops '
+                                 '(the masks differ from the per-sample masking)')
         parser.add_argument('--shorten-method', default='none',
                             choices=['none', 'truncate', 'random_crop'],
                             help='if not none, shorten sequences that exceed --tokens-per-sample')
@@ -159,7 +162,26 @@ class MaskedLMTask(FairseqTask):
             random_token_prob=self.args.random_token_prob,
             freq_weighted_replacement=self.args.freq_weighted_replacement,
             mask_whole_words=mask_whole_words,
+            collate_masking=getattr(self.args, 'collate_masking', False),
         )
+        if getattr(self.args, 'collate_masking', False):
+            # the masked datasets pad the batches and return unmasked items
+            src_tokens, target = src_dataset, tgt_dataset
+            src_lengths = NumelDataset(dataset, reduce=False)
+            ntokens = NumelDataset(dataset, reduce=True)
+        else:
+            src_tokens = PadDataset(
+                src_dataset,
+                pad_idx=self.source_dictionary.pad(),
+                left_pad=False,
+            )
+            target = PadDataset(
+                tgt_dataset,
+                pad_idx=self.source_dictionary.pad(),
+                left_pad=False,
+            )
+            src_lengths = NumelDataset(src_dataset, reduce=False)
+            ntokens = NumelDataset(src_dataset, reduce=True)
 
         with data_utils.numpy_seed(self.args.seed + epoch):
             shuffle = np.random.permutation(len(src_dataset))
@@ -169,20 +191,12 @@ class MaskedLMTask(FairseqTask):
                 {
                     'id': IdDataset(),
                     'net_input': {
-                        'src_tokens': PadDataset(
-                            src_dataset,
-                            pad_idx=self.source_dictionary.pad(),
-                            left_pad=False,
-                        ),
-                        'src_lengths': NumelDataset(src_dataset, reduce=False),
+                        'src_tokens': src_tokens,
+                        'src_lengths': src_lengths,
                     },
-                    'target': PadDataset(
-                        tgt_dataset,
-                        pad_idx=self.source_dictionary.pad(),
-                        left_pad=False,
-                    ),
+                    'target': target,
                     'nsentences': NumSamplesDataset(),
-                    'ntokens': NumelDataset(src_dataset, reduce=True),
+                    'ntokens': ntokens,
                 },
                 sizes=[src_dataset.sizes],
             ),
@@ -36,6 +36,11 @@ class SpeechCommandsTask(FairseqTask):
         parser.add_argument('--sc-all-classes', action='store_true', default=False)
         parser.add_argument('--sc-dropped-rate', type=float, default=0.0)
         parser.add_argument('--mfcc', action='store_true', default=False)
+        parser.add_argument('--sc-mmap', action='store_true', default=False,
+                            help='memory-map a contiguous copy of the processed data, '
+                                 'which is shared by all the data loader workers')
+        parser.add_argument('--sc-mmap-dtype', default='float32', choices=['float32', 'float16'],
+                            help='dtype of the memory-mapped features')
 
     def __init__(self, args):
         super().__init__(args)
@@ -73,6 +78,8 @@ class SpeechCommandsTask(FairseqTask):
             dropped_rate=self.args.sc_dropped_rate,
             path=self.args.data,
             all_classes=self.args.sc_all_classes,
+            mmap=getattr(self.args, 'sc_mmap', False),
+            mmap_dtype=getattr(self.args, 'sc_mmap_dtype', 'float32'),
         )
 
         logger.info("Loaded {0} with #samples: {1}".format(split, len(dataset)))
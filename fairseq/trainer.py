@@ -19,6 +19,8 @@ import torch
 from fairseq import checkpoint_utils, distributed_utils, models, optim, utils
 from fairseq.file_io import PathManager
 from fairseq.logging import meters, metrics
+from fairseq.model_ema import ModelEMA
+from fairseq.module_profiler import ModuleProfiler
 from fairseq.nan_detector import NanDetector
 from fairseq.optim import lr_scheduler
 
@@ -86,6 +88,7 @@ class Trainer(object):
         self._warn_once = set()
         self._wrapped_criterion = None
         self._wrapped_model = None
+        self._logging_outputs_gathers = {}
 
         # TODO(myleott): support tpu
         if self.cuda and self.data_parallel_world_size > 1:
@@ -110,6 +113,20 @@ class Trainer(object):
             self.cuda_env = None
             self.cuda_env_arr = None
 
+        # moving average of the weights, saved in the checkpoints
+        if getattr(args, 'ema_decay', 0) > 0:
+            self._ema = ModelEMA(self._model, args.ema_decay)
+        else:
+            self._ema = None
+
+        # opt-in per-module profiling of the training steps
+        if getattr(args, 'profile_modules', None):
+            self._module_profiler = ModuleProfiler(
+                self._model, args.profile_modules.split(','), device=self.device,
+            )
+        else:
+            self._module_profiler = None
+
         metrics.log_start_time("wall", priority=790, round=0)
 
         self._start_time = time.time()
@@ -240,12 +257,21 @@ class Trainer(object):
         self._lr_scheduler = lr_scheduler.build_lr_scheduler(self.args, self.optimizer)
         self._lr_scheduler.step_update(0)
 
-    def save_checkpoint(self, filename, extra_state):
-        """Save all training state in a checkpoint file."""
+    def save_checkpoint(self, filename, extra_state, aliases=(), writer=None):
+        """Save all training state in a checkpoint file.
+
+        The other names in *aliases* are linked to the checkpoint. With a
+        *writer* (see :class:`fairseq.checkpoint_utils.AsyncCheckpointWriter`)
+        the checkpoint is written in the background.
+
+        Returns the number of bytes written, if known.
+        """
         if self.is_data_parallel_master:  # only save one checkpoint
             extra_state["metrics"] = metrics.state_dict()
+            if self._ema is not None:
+                extra_state["ema"] = self._ema.state_dict()
             extra_state["previous_training_time"] = self.cumulative_training_time()
-            checkpoint_utils.save_state(
+            return checkpoint_utils.save_state(
                 filename,
                 self.args,
                 self.get_model().state_dict(),
@@ -255,6 +281,8 @@ class Trainer(object):
                 self.get_num_updates(),
                 self._optim_history,
                 extra_state,
+                aliases=aliases,
+                writer=writer,
             )
 
     def load_checkpoint(
@@ -322,6 +350,13 @@ class Trainer(object):
                 self._previous_training_time = extra_state["previous_training_time"]
                 self._start_time = time.time()
 
+            if self._ema is not None:
+                if "ema" in extra_state:
+                    self._ema.load_state_dict(extra_state["ema"])
+                else:
+                    # start the average from the loaded weights
+                    self._ema = ModelEMA(self._model, self.args.ema_decay)
+
             self.lr_step(epoch)
 
             if "metrics" in extra_state and not reset_meters:
@@ -439,6 +474,13 @@ class Trainer(object):
 
         metrics.log_start_time("train_wall", priority=800, round=0)
 
+        profile_step = (
+            self._module_profiler is not None
+            and self.get_num_updates() % self.args.profile_modules_interval == 0
+        )
+        if profile_step:
+            self._module_profiler.start_step()
+
         # forward and backward pass
         logging_outputs, sample_size, ooms = [], 0, 0
         for i, sample in enumerate(samples):
@@ -499,6 +541,8 @@ class Trainer(object):
                     if self.cuda:
                         torch.cuda.empty_cache()
                     if self.args.distributed_world_size == 1:
+                        if profile_step:
+                            self._module_profiler.cancel_step()
                         return None
                 else:
                     raise e
@@ -565,7 +609,11 @@ class Trainer(object):
 
             with torch.autograd.profiler.record_function("optimizer"):
                 # take an optimization step
-                self.optimizer.step()
+                if profile_step:
+                    with self._module_profiler.record("optimizer"):
+                        self.optimizer.step()
+                else:
+                    self.optimizer.step()
         except FloatingPointError:
             # re-run the forward and backward pass with hooks attached to print
             # out where it fails
@@ -596,6 +644,9 @@ class Trainer(object):
         if not overflow or self.args.distributed_wrapper == 'SlowMo':
             self.set_num_updates(self.get_num_updates() + 1)
 
+            if self._ema is not None:
+                self._ema.update(self._model)
+
             if self.tpu:
                 # mark step on TPUs
                 import torch_xla.core.xla_model as xm
@@ -633,6 +684,9 @@ class Trainer(object):
         if self.args.fp16:
             metrics.log_scalar("loss_scale", self.optimizer.scaler.loss_scale, priority=700, round=0)
 
+        if profile_step:
+            self._end_module_profiling()
+
         metrics.log_stop_time("train_wall")
 
         return logging_output
@@ -956,23 +1010,23 @@ class Trainer(object):
     ):
         """
         Sync logging outputs across workers. all_gather_list_sync is
-        suitable when logging outputs are complex types.
+        suitable when logging outputs are complex types. Flat dicts of
+        numbers are gathered with a single all_reduce of a float64 tensor,
+        other types are pickled.
         """
         if self.tpu:
             raise NotImplementedError
         if ignore:
             logging_outputs = []
-        results = list(zip(
-            *distributed_utils.all_gather_list(
-                [logging_outputs] + list(extra_stats_to_sum),
-                max_size=getattr(self.args, 'all_gather_list_size', 16384),
+        # the train and valid steps log different stats, and keep their schemas
+        key = len(extra_stats_to_sum)
+        if key not in self._logging_outputs_gathers:
+            self._logging_outputs_gathers[key] = distributed_utils.LoggingOutputsGather(
+                self.device,
                 group=self.data_parallel_process_group,
+                max_size=getattr(self.args, 'all_gather_list_size', 16384),
             )
-        ))
-        logging_outputs, extra_stats_to_sum = results[0], results[1:]
-        logging_outputs = list(chain.from_iterable(logging_outputs))
-        extra_stats_to_sum = [sum(s) for s in extra_stats_to_sum]
-        return logging_outputs, extra_stats_to_sum
+        return self._logging_outputs_gathers[key](logging_outputs, *extra_stats_to_sum)
 
     def _fast_stat_sync_sum(
         self,
@@ -1091,6 +1145,11 @@ class Trainer(object):
                         del logging_output[key_to_delete]
             return logging_output
 
+    def _end_module_profiling(self):
+        self._module_profiler.end_step()
+        if self.args.profile_modules_report is not None and self.is_data_parallel_master:
+            self._module_profiler.dump_report(self.args.profile_modules_report)
+
     def _check_xla_compilation(self, message=None):
         import torch_xla.debug.metrics as met
         compile_stats = met.metric_data("CompileTime")
@@ -474,6 +474,37 @@ def log_softmax(x, dim: int, onnx_trace: bool = False):
         return F.log_softmax(x, dim=dim, dtype=torch.float32)
 
 
+def blockwise_target_log_softmax(
+    features: Tensor, weight: Tensor, target: Tensor, bias: Optional[Tensor] = None, block_size: int = 8192,
+) -> Tensor:
+    """Log probabilities of *target* under ``log_softmax(F.linear(features, weight, bias))``.
+
+    The logits are computed in blocks of *block_size* rows of *weight* with a
+    running logsumexp, so at most ``N x block_size`` logits are alive at once
+    instead of the ``N x V`` normalized distribution.
+
+    Args:
+        features: ``(..., D)`` inputs of the output projection.
+        weight: ``(V, D)`` output projection.
+        target: ``(...)`` target indices.
+    """
+    shape = target.shape
+    features = features.reshape(-1, features.size(-1))
+    target = target.reshape(-1)
+    vocab_size = weight.size(0)
+
+    lse = features.new_full((features.size(0),), float('-inf'), dtype=torch.float32)
+    target_logits = features.new_zeros(features.size(0), dtype=torch.float32)
+    for start in range(0, vocab_size, block_size):
+        end = min(start + block_size, vocab_size)
+        logits = F.linear(features, weight[start:end], bias[start:end] if bias is not None else None).float()
+        lse = torch.logaddexp(lse, torch.logsumexp(logits, dim=-1))
+        in_block = (target >= start) & (target < end)
+        index = (target - start).clamp(0, end - start - 1)
+        target_logits = torch.where(in_block, logits.gather(1, index.unsqueeze(1)).squeeze(1), target_logits)
+    return (target_logits - lse).view(shape)
+
+
 def get_perplexity(loss, round=2, base=2):
     if loss is None:
         return 0.
@@ -142,7 +142,10 @@ def main(parsed_args, **unused_kwargs):
     )
 
     gen_timer = StopwatchMeter()
-    scorer = SequenceScorer(task.target_dictionary, args.softmax_batch)
+    scorer = SequenceScorer(
+        task.target_dictionary, args.softmax_batch,
+        target_only=args.target_only_scoring, vocab_block_size=args.vocab_block_size,
+    )
 
     score_sum = 0.
     count = 0
@@ -21,6 +21,7 @@ from fairseq.data import LMContextWindowDataset
 from fairseq.logging import progress_bar
 from fairseq.logging.meters import StopwatchMeter, TimeMeter
 from fairseq.sequence_scorer import SequenceScorer
+from fairseq.streaming_scorer import StreamingScorer
 from fairseq import distributed_utils
 import sys
 
@@ -129,6 +130,28 @@ def main(parsed_args, **unused_kwargs):
 
     task = tasks.setup_task(args)
 
+    if args.remove_bpe is not None:
+        if args.remove_bpe == 'sentencepiece':
+            raise NotImplementedError
+        else:
+            bpe_cont = args.remove_bpe.rstrip()
+            bpe_toks = {
+                i
+                for i in range(len(task.source_dictionary))
+                if task.source_dictionary[i].endswith(bpe_cont)
+            }
+        bpe_len = len(bpe_cont)
+    else:
+        bpe_toks = None
+        bpe_len = 0
+
+    if args.streaming_lanes > 0:
+        score_sum, count, gen_timer = eval_streaming(args, task, models, dataset, bpe_toks)
+        print_results(score_sum, count, gen_timer, output_file)
+        if args.results_path is not None:
+            output_file.close()
+        return
+
     itr = task.get_batch_iterator(
         dataset=dataset,
         max_tokens=max(250000, task.chunk_size),
@@ -148,26 +171,14 @@ def main(parsed_args, **unused_kwargs):
     )
 
     gen_timer = StopwatchMeter()
-    scorer = SequenceScorer(task.target_dictionary, args.softmax_batch)
+    scorer = SequenceScorer(
+        task.target_dictionary, args.softmax_batch,
+        target_only=args.target_only_scoring, vocab_block_size=args.vocab_block_size,
+    )
 
     score_sum = 0.
     count = 0
 
-    if args.remove_bpe is not None:
-        if args.remove_bpe == 'sentencepiece':
-            raise NotImplementedError
-        else:
-            bpe_cont = args.remove_bpe.rstrip()
-            bpe_toks = {
-                i
-                for i in range(len(task.source_dictionary))
-                if task.source_dictionary[i].endswith(bpe_cont)
-            }
-        bpe_len = len(bpe_cont)
-    else:
-        bpe_toks = None
-        bpe_len = 0
-
     word_stats = dict()
 
     wps_meter = TimeMeter()
@@ -264,6 +275,72 @@ def main(parsed_args, **unused_kwargs):
             wps_meter.update(sample['ntokens'])
             progress.log({'wps': round(wps_meter.avg)})
 
+    print_results(score_sum, count, gen_timer, output_file)
+
+    if args.output_word_stats:
+        for ws in sorted(word_stats.values(), key=lambda x: x.count, reverse=True):
+            logger.info(ws)
+
+    if args.results_path is not None:
+        output_file.close()
+
+def eval_streaming(args, task, models, dataset, bpe_toks):
+    """Score the documents of *dataset* with a :class:`StreamingScorer`."""
+    assert args.context_window == 0, '--streaming-lanes carries the context across steps, unset --context-window'
+    assert not (args.output_word_probs or args.output_word_stats), \
+        '--output-word-probs and --output-word-stats are not supported with --streaming-lanes'
+
+    pad = task.target_dictionary.pad()
+    if bpe_toks is not None:
+        is_bpe = torch.zeros(len(task.source_dictionary), dtype=torch.bool)
+        is_bpe[list(bpe_toks)] = True
+    else:
+        is_bpe = None
+
+    num_skipped = 0
+    if args.shard_id < 0 or args.shard_id >= args.num_shards:
+        raise ValueError('shard_id must be between 0 and num_shards')
+
+    def documents():
+        nonlocal num_skipped
+        # every num_shards-th document, like iterators.ShardedIterator
+        for i in range(args.shard_id, len(dataset), args.num_shards):
+            doc = dataset[i]
+            target = doc['target']
+            if args.add_bos_token:
+                assert target[0].item() == task.target_dictionary.bos()
+                target = target.clone()
+                target[0] = pad
+                doc = {'id': doc['id'], 'source': doc['source'], 'target': target}
+            if is_bpe is not None:
+                # subword units merged with the next token are not counted
+                tokens = utils.strip_pad(target, pad)
+                num_skipped += int(is_bpe[tokens[:-1]].sum())
+            yield doc
+
+    progress = progress_bar.progress_bar(
+        documents(),
+        log_format=args.log_format,
+        log_interval=args.log_interval,
+        default_log_format=('tqdm' if not args.no_progress_bar else 'none'),
+    )
+
+    step_size = args.decoder_chunk_size * args.chunk_nums
+    scorer = StreamingScorer(
+        task.target_dictionary, args.streaming_lanes, step_size, args.softmax_batch,
+        target_only=args.target_only_scoring, vocab_block_size=args.vocab_block_size,
+    )
+
+    gen_timer = StopwatchMeter()
+    gen_timer.start()
+    results = scorer.score(models, progress)
+    count = int(results['ntokens'].sum()) - num_skipped
+    gen_timer.stop(count)
+
+    return results['score'].sum().item(), count, gen_timer
+
+
+def print_results(score_sum, count, gen_timer, output_file):
     avg_nll_loss = -score_sum / count / math.log(2)  # convert to base 2
     print('Evaluated {} tokens in {:.1f}s ({:.2f} tokens/s)'.format(
         count, gen_timer.sum, 1. / gen_timer.avg, file=output_file
@@ -272,12 +349,6 @@ def main(parsed_args, **unused_kwargs):
         avg_nll_loss, 2**avg_nll_loss, file=output_file
     ))
 
-    if args.output_word_stats:
-        for ws in sorted(word_stats.values(), key=lambda x: x.count, reverse=True):
-            logger.info(ws)
-
-    if args.results_path is not None:
-        output_file.close()
 
 def cli_main():
     parser = options.get_eval_lm_parser()
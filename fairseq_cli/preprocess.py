@@ -40,6 +40,8 @@ def main(args):
     logger.info(args)
 
     task = tasks.get_task(args.task)
+    assert not args.pipelined_binarization or args.dataset_impl == "mmap", \
+        "--pipelined-binarization requires --dataset-impl mmap"
 
     def train_path(lang):
         return "{}{}".format(args.trainpref, ("." + lang) if lang else "")
@@ -117,9 +119,34 @@ def main(args):
             n_seq_tok[0] += worker_result["nseq"]
             n_seq_tok[1] += worker_result["ntok"]
 
+        def log_result(input_file):
+            logger.info(
+                "[{}] {}: {} sents, {} tokens, {:.3}% replaced by {}".format(
+                    lang,
+                    input_file,
+                    n_seq_tok[0],
+                    n_seq_tok[1],
+                    100 * sum(replaced.values()) / n_seq_tok[1],
+                    vocab.unk_word,
+                )
+            )
+
         input_file = "{}{}".format(
             input_prefix, ("." + lang) if lang is not None else ""
         )
+        if args.pipelined_binarization:
+            ds = indexed_dataset.make_builder(dataset_dest_file(args, output_prefix, lang, "bin"),
+                                              impl=args.dataset_impl, vocab_size=len(vocab))
+            merge_result(
+                Binarizer.binarize_pipelined(
+                    input_file, vocab, ds, num_workers=num_workers,
+                    chunk_size=args.binarize_chunk_size, queue_size=args.binarize_queue_size,
+                )
+            )
+            ds.finalize(dataset_dest_file(args, output_prefix, lang, "idx"))
+            log_result(input_file)
+            return
+
         offsets = Binarizer.find_offsets(input_file, num_workers)
         pool = None
         if num_workers > 1:
@@ -159,17 +186,7 @@ def main(args):
                 os.remove(indexed_dataset.index_file_path(temp_file_path))
 
         ds.finalize(dataset_dest_file(args, output_prefix, lang, "idx"))
-
-        logger.info(
-            "[{}] {}: {} sents, {} tokens, {:.3}% replaced by {}".format(
-                lang,
-                input_file,
-                n_seq_tok[0],
-                n_seq_tok[1],
-                100 * sum(replaced.values()) / n_seq_tok[1],
-                vocab.unk_word,
-            )
-        )
+        log_result(input_file)
 
     def make_binary_alignment_dataset(input_prefix, output_prefix, num_workers):
         nseq = [0]
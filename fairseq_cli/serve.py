@@ -0,0 +1,103 @@
+#!/usr/bin/env python3 -u
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Serve a trained language model with continuous batching. Reads one prompt per
+line from stdin, submits it as soon as it is read and prints the
+continuations in the order in which they complete.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+
+import numpy as np
+import torch
+
+from fairseq import checkpoint_utils, hub_utils, options, tasks, utils
+
+
+logging.basicConfig(
+    format='%(asctime)s | %(levelname)s | %(name)s | %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.INFO,
+    stream=sys.stdout,
+)
+logger = logging.getLogger('fairseq_cli.serve')
+
+
+async def serve_stdin(args, hub):
+    loop = asyncio.get_event_loop()
+    server = hub.serve(
+        num_slots=args.num_slots,
+        max_queue_size=args.max_queue_size,
+        timeout=args.request_timeout,
+        max_len=args.max_len_b,
+        sampling=args.sampling,
+        temperature=args.temperature,
+    )
+
+    async def handle(id, line):
+        try:
+            hypo = await server.generate(line)
+        except asyncio.QueueFull:
+            print('E-{}\tqueue full'.format(id))
+        except asyncio.TimeoutError:
+            print('E-{}\ttimed out'.format(id))
+        else:
+            print('S-{}\t{}'.format(id, line))
+            print('H-{}\t{}\t{}'.format(id, hypo['score'], hypo['output']))
+
+    async with server:
+        requests = []
+        for id in range(sys.maxsize):
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            requests.append(asyncio.ensure_future(handle(id, line.strip())))
+        await asyncio.gather(*requests)
+        logger.info(' | '.join('{} {}'.format(k, v) for k, v in server.metrics().items()))
+
+
+def main(args):
+    utils.import_user_module(args)
+    logger.info(args)
+
+    # Fix seed for stochastic decoding
+    if args.seed is not None and not args.no_seed_provided:
+        np.random.seed(args.seed)
+        utils.set_torch_seed(args.seed)
+
+    use_cuda = torch.cuda.is_available() and not args.cpu
+
+    # Setup task, e.g., language_modeling
+    task = tasks.setup_task(args)
+
+    # Load ensemble
+    logger.info('loading model(s) from {}'.format(args.path))
+    models, _model_args = checkpoint_utils.load_model_ensemble(
+        args.path.split(os.pathsep),
+        arg_overrides=eval(args.model_overrides),
+        task=task,
+        suffix=getattr(args, "checkpoint_suffix", ""),
+    )
+
+    hub = hub_utils.GeneratorHubInterface(args, task, models)
+    if args.fp16:
+        hub.half()
+    if use_cuda:
+        hub.cuda()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(serve_stdin(args, hub))
+
+
+def cli_main():
+    parser = options.get_serving_parser()
+    args = options.parse_args_and_arch(parser)
+    main(args)
+
+
+if __name__ == '__main__':
+    cli_main()
@@ -148,6 +148,7 @@ def main(args):
             load_dataset=task.has_sharded_data("train"),
         )
     train_meter.stop()
+    checkpoint_utils.wait_for_checkpoints()
     logger.info("done training in {:.1f} seconds".format(train_meter.sum))
 
 
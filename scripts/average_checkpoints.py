@@ -6,18 +6,30 @@
 
 import argparse
 import collections
-import torch
+import inspect
 import os
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
 
 from fairseq.file_io import PathManager
 
 
-def average_checkpoints(inputs):
+def _model_params(state, use_ema):
+    if use_ema:
+        return state['extra_state']['ema']['model']
+    return state['model']
+
+
+def average_checkpoints(inputs, use_ema=False):
     """Loads checkpoints from inputs and returns a model with averaged weights.
 
     Args:
       inputs: An iterable of string paths of checkpoints to load from.
+      use_ema: Average the moving averages of the weights saved with
+        --ema-decay instead of the weights.
 
     Returns:
       A dict of string keys mapping to various values. The 'model' key
@@ -41,7 +53,7 @@ def average_checkpoints(inputs):
         if new_state is None:
             new_state = state
 
-        model_params = state['model']
+        model_params = _model_params(state, use_ema)
 
         model_params_keys = list(model_params.keys())
         if params_keys is None:
@@ -70,6 +82,101 @@ def average_checkpoints(inputs):
         else:
             averaged_params[k] //= num_models
     new_state['model'] = averaged_params
+    if use_ema:
+        del new_state['extra_state']['ema']
+    return new_state
+
+
+def _lazy_load(fpath):
+    # memory-map the tensors when torch supports it, they are then read from
+    # the disk when they are accessed
+    local_path = PathManager.get_local_path(fpath)
+    if 'mmap' in inspect.signature(torch.load).parameters:
+        try:
+            return torch.load(local_path, map_location='cpu', mmap=True)
+        except RuntimeError:
+            # legacy (non zipfile) serialization format
+            pass
+    return torch.load(local_path, map_location='cpu')
+
+
+def _new_file_tensor(dirname, size, dtype):
+    # tensor backed by a file in dirname, so that the kernel can write its
+    # pages back to the disk instead of keeping them in memory
+    numel = 1
+    for s in size:
+        numel *= s
+    with tempfile.NamedTemporaryFile(dir=dirname) as f:
+        tensor = torch.from_file(f.name, shared=True, size=max(numel, 1), dtype=dtype)
+    # the mapping outlives the (removed) file
+    return tensor[:numel].view(size)
+
+
+def average_checkpoints_streaming(inputs, use_ema=False, num_workers=1, scratch_dir=None):
+    """Averages the weights of the checkpoints in inputs one tensor at a time.
+
+    Unlike :func:`average_checkpoints`, the checkpoints are memory-mapped
+    (or, with older versions of torch, loaded one at a time) and the averaged
+    weights are accumulated in tensors backed by files in *scratch_dir*, so
+    the memory usage does not grow with the number or the size of the
+    checkpoints.
+
+    Args:
+      inputs: An iterable of string paths of checkpoints to load from.
+      use_ema: Average the moving averages of the weights saved with
+        --ema-decay instead of the weights.
+      num_workers: Number of threads reading and accumulating the tensors.
+      scratch_dir: Directory of the files backing the averaged weights
+        (default: the directory of the first input).
+
+    Returns:
+      The same dict as :func:`average_checkpoints`.
+    """
+    num_models = len(inputs)
+    if scratch_dir is None:
+        scratch_dir = os.path.dirname(os.path.abspath(PathManager.get_local_path(inputs[0])))
+
+    new_state = None
+    params_keys = None
+    averaged_params = collections.OrderedDict()
+
+    def accumulate(k, p, first):
+        if p.dtype in {torch.float16, torch.bfloat16}:
+            p = p.float()
+        if first:
+            averaged_params[k].copy_(p)
+        else:
+            averaged_params[k] += p
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for i, fpath in enumerate(inputs):
+            state = _lazy_load(fpath)
+            model_params = _model_params(state, use_ema)
+            model_params_keys = list(model_params.keys())
+            if new_state is None:
+                # Copies over the settings from the first checkpoint
+                new_state = state
+                params_keys = model_params_keys
+                for k in params_keys:
+                    p = model_params[k]
+                    dtype = torch.float32 if p.dtype in {torch.float16, torch.bfloat16} else p.dtype
+                    averaged_params[k] = _new_file_tensor(scratch_dir, p.size(), dtype)
+            elif params_keys != model_params_keys:
+                raise KeyError(
+                    'For checkpoint {}, expected list of params: {}, '
+                    'but found: {}'.format(fpath, params_keys, model_params_keys)
+                )
+            list(pool.map(lambda k: accumulate(k, model_params[k], i == 0), params_keys))
+            del model_params, state
+
+    for v in averaged_params.values():
+        if v.is_floating_point():
+            v.div_(num_models)
+        else:
+            v //= num_models
+    new_state['model'] = averaged_params
+    if use_ema:
+        del new_state['extra_state']['ema']
     return new_state
 
 
@@ -117,6 +224,14 @@ def main():
                         'e.g., with --num-epoch-checkpoints=10 --checkpoint-upper-bound=50, checkpoints 41-50 would be averaged.'
                         'e.g., with --num-update-checkpoints=10 --checkpoint-upper-bound=50000, checkpoints 40500-50000 would be averaged assuming --save-interval-updates 500'
                         )
+    parser.add_argument('--use-ema', action='store_true',
+                        help='average the moving averages of the weights saved with --ema-decay')
+    parser.add_argument('--streaming', action='store_true',
+                        help='average one tensor at a time, with memory-mapped inputs and file backed outputs')
+    parser.add_argument('--num-workers', type=int, default=1,
+                        help='number of threads reading the checkpoints with --streaming')
+    parser.add_argument('--scratch-dir', metavar='DIR',
+                        help='directory of the temporary files used by --streaming')
     # fmt: on
     args = parser.parse_args()
     print(args)
@@ -140,7 +255,12 @@ def main():
         )
         print('averaging checkpoints: ', args.inputs)
 
-    new_state = average_checkpoints(args.inputs)
+    if args.streaming:
+        new_state = average_checkpoints_streaming(
+            args.inputs, use_ema=args.use_ema, num_workers=args.num_workers, scratch_dir=args.scratch_dir,
+        )
+    else:
+        new_state = average_checkpoints(args.inputs, use_ema=args.use_ema)
     with PathManager.open(args.output, 'wb') as f:
         torch.save(new_state, f)
     print('Finished writing averaged checkpoint to {}'.format(args.output))
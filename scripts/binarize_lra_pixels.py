@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Binarize the pixel inputs of the LRA image tasks (CIFAR-10, Pathfinder, Path-X)
+into memory-mapped uint8 files, which are picked up by the ``lra-image`` task
+in place of the text files:
+
+    python scripts/binarize_lra_pixels.py /path/to/pathfinder128/input
+"""
+
+import argparse
+import os
+
+from fairseq.data.pixel_sequence_dataset import binarize_pixels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_dir', help='directory with the {split}.src text files')
+    parser.add_argument('--splits', nargs='+', default=['train', 'valid', 'test'])
+    parser.add_argument('--dest-dir', default=None, help='output directory (default: input_dir)')
+    args = parser.parse_args()
+
+    dest_dir = args.dest_dir or args.input_dir
+    os.makedirs(dest_dir, exist_ok=True)
+    for split in args.splits:
+        input_file = os.path.join(args.input_dir, split + '.src')
+        if not os.path.exists(input_file):
+            continue
+        num_images = binarize_pixels(input_file, os.path.join(dest_dir, split + '.src'))
+        print('| {}: {} images'.format(input_file, num_images))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import copy
+import unittest
+
+import torch
+
+from fairseq.optim.apollo import Apollo
+
+
+def make_params(shapes):
+    return [torch.nn.Parameter(torch.randn(*shape)) for shape in shapes]
+
+
+def set_grads(params, step):
+    generator = torch.Generator().manual_seed(step)
+    for p in params:
+        p.grad = torch.randn(p.size(), generator=generator)
+
+
+class TestApolloMultiTensor(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+        self.shapes = [(7, 5), (5,), (3, 2, 4), (1,), (16,)]
+
+    def _run(self, params, optimizer, num_steps=6):
+        for step in range(num_steps):
+            set_grads(params, step)
+            optimizer.step()
+
+    def _assert_close(self, params, expected):
+        for p, ref in zip(params, expected):
+            self.assertTrue(torch.allclose(p, ref, rtol=1e-5, atol=1e-6), (p - ref).abs().max())
+
+    def test_matches_single_tensor(self):
+        for rebound, weight_decay_type in [
+            ('constant', 'L2'), ('constant', 'decoupled'), ('belief', 'decoupled'), ('belief', 'stable'),
+        ]:
+            kwargs = dict(lr=0.1, rebound=rebound, weight_decay=0.01, weight_decay_type=weight_decay_type)
+            ref_params = make_params(self.shapes)
+            params = copy.deepcopy(ref_params)
+            self._run(ref_params, Apollo(ref_params, **kwargs))
+            optimizer = Apollo(params, multi_tensor=True, **kwargs)
+            self._run(params, optimizer)
+            self._assert_close(params, ref_params)
+
+            # the states are laid out like the single tensor ones
+            ref_optimizer = Apollo(ref_params, **kwargs)
+            ref_optimizer.load_state_dict(copy.deepcopy(optimizer.state_dict()))
+            ref_optimizer.param_groups[0]['multi_tensor'] = False
+            optimizer.load_state_dict(optimizer.state_dict())
+            self._run(ref_params, ref_optimizer, num_steps=2)
+            self._run(params, optimizer, num_steps=2)
+            self._assert_close(params, ref_params)
+
+    def test_flat_params(self):
+        ref_params = make_params(self.shapes)
+        flat = torch.nn.Parameter(torch.cat([p.data.view(-1) for p in ref_params]))
+        flat.param_sizes = [p.numel() for p in ref_params]
+        self._run(ref_params, Apollo(ref_params, lr=0.1, rebound='belief'))
+        optimizer = Apollo([flat], lr=0.1, rebound='belief')
+        for step in range(6):
+            # same gradients as set_grads
+            generator = torch.Generator().manual_seed(step)
+            flat.grad = torch.cat([torch.randn(shape, generator=generator).view(-1) for shape in self.shapes])
+            optimizer.step()
+        self._assert_close(flat.data.split(flat.param_sizes), [p.data.view(-1) for p in ref_params])
+
+    def test_params_without_grads(self):
+        ref_params = make_params(self.shapes)
+        params = copy.deepcopy(ref_params)
+        ref_optimizer = Apollo(ref_params, lr=0.1)
+        optimizer = Apollo(params, lr=0.1, multi_tensor=True)
+        for step in range(6):
+            set_grads(ref_params, step)
+            set_grads(params, step)
+            if step % 2 == 1:
+                ref_params[1].grad = params[1].grad = None
+            ref_optimizer.step()
+            optimizer.step()
+        self._assert_close(params, ref_params)
+
+
+if __name__ == '__main__':
+    unittest.main()
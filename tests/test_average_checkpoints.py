@@ -14,7 +14,8 @@ import torch
 from torch import nn
 
 
-from scripts.average_checkpoints import average_checkpoints
+from fairseq.model_ema import ModelEMA
+from scripts.average_checkpoints import average_checkpoints, average_checkpoints_streaming
 
 
 class ModelWithSharedParameter(nn.Module):
@@ -138,6 +139,51 @@ class TestAverageCheckpoints(unittest.TestCase):
         )
         shutil.rmtree(tmpdir)
 
+    def test_average_checkpoints_streaming(self):
+        tmpdir = tempfile.mkdtemp()
+        paths = []
+        for i in range(3):
+            m = ModelWithSharedParameter()
+            state = m.state_dict()
+            state['counter'] = torch.tensor([i, 2 * i])
+            state['half'] = torch.randn(4).half()
+            ema = {'model': {'x': torch.full((2,), float(i))}}
+            paths.append(os.path.join(tmpdir, 'm{}.pt'.format(i)))
+            torch.save({'model': state, 'extra_state': {'ema': ema}}, paths[-1])
+
+        expected = average_checkpoints(paths)['model']
+        for num_workers in [1, 3]:
+            output = average_checkpoints_streaming(paths, num_workers=num_workers, scratch_dir=tmpdir)['model']
+            self.assertEqual(list(output.keys()), list(expected.keys()))
+            for k, v in expected.items():
+                self.assertEqual(output[k].dtype, v.dtype)
+                self.assertTrue(torch.allclose(output[k], v), k)
+
+        new_state = average_checkpoints_streaming(paths, use_ema=True)
+        self.assertTrue(torch.equal(new_state['model']['x'], torch.full((2,), 1.0)))
+        self.assertNotIn('ema', new_state['extra_state'])
+        shutil.rmtree(tmpdir)
+
+    def test_model_ema(self):
+        model = nn.Linear(3, 2)
+        ema = ModelEMA(model, decay=0.5)
+        expected = {k: v.clone() for k, v in model.state_dict().items()}
+        for _ in range(3):
+            with torch.no_grad():
+                for p in model.parameters():
+                    p.add_(1.0)
+            ema.update(model)
+            for k, v in model.state_dict().items():
+                expected[k] = 0.5 * expected[k] + 0.5 * v
+        for k, v in expected.items():
+            self.assertTrue(torch.allclose(ema.params[k], v))
+
+        other = ModelEMA(nn.Linear(3, 2), decay=0.5)
+        other.load_state_dict(ema.state_dict())
+        self.assertEqual(other.num_updates, 3)
+        other.copy_to(model)
+        self.assertTrue(torch.allclose(model.weight, expected['weight']))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fairseq.binarizer import Binarizer
+from fairseq.data import Dictionary, indexed_dataset
+
+
+class TestBinarizer(unittest.TestCase):
+
+    def test_binarize_pipelined(self):
+        rng = np.random.RandomState(1)
+        words = ['w{}'.format(i) for i in range(20)]
+        lines = [' '.join(rng.choice(words, size=rng.randint(0, 12))) for _ in range(200)]
+        d = Dictionary()
+        for word in words[:15]:
+            d.add_symbol(word)
+
+        with tempfile.TemporaryDirectory('test_binarizer') as dirname:
+            input_file = os.path.join(dirname, 'train.txt')
+            with open(input_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines))
+
+            chunks = list(Binarizer.iter_chunks(input_file, 64))
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], os.path.getsize(input_file))
+            for (_, end), (start, _) in zip(chunks[:-1], chunks[1:]):
+                self.assertEqual(end, start)
+
+            expected_prefix = os.path.join(dirname, 'expected')
+            builder = indexed_dataset.make_builder(
+                indexed_dataset.data_file_path(expected_prefix), impl='mmap', vocab_size=len(d),
+            )
+            expected_res = Binarizer.binarize(input_file, d, builder.add_item)
+            builder.finalize(indexed_dataset.index_file_path(expected_prefix))
+
+            prefix = os.path.join(dirname, 'pipelined')
+            builder = indexed_dataset.make_builder(
+                indexed_dataset.data_file_path(prefix), impl='mmap', vocab_size=len(d),
+            )
+            res = Binarizer.binarize_pipelined(input_file, d, builder, num_workers=2, chunk_size=64, queue_size=3)
+            builder.finalize(indexed_dataset.index_file_path(prefix))
+
+            for key in ['nseq', 'ntok', 'nunk', 'replaced']:
+                self.assertEqual(res[key], expected_res[key])
+
+            expected = indexed_dataset.MMapIndexedDataset(expected_prefix)
+            dataset = indexed_dataset.MMapIndexedDataset(prefix)
+            self.assertEqual(len(dataset), len(lines))
+            self.assertTrue(np.array_equal(dataset.sizes, expected.sizes))
+            for i in range(len(lines)):
+                self.assertEqual(dataset[i].tolist(), expected[i].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+
+from fairseq import checkpoint_utils
+
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory('test_checkpoint_utils')
+        self.paths = [os.path.join(self.tmpdir.name, fn) for fn in ['checkpoint1.pt', 'checkpoint_last.pt']]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _load(self, path):
+        return torch.load(path)
+
+    def test_write_checkpoint(self):
+        num_bytes = checkpoint_utils.write_checkpoint({'x': torch.zeros(4)}, self.paths)
+        self.assertEqual(num_bytes, os.path.getsize(self.paths[0]))
+        # the alias is a link, not a copy
+        self.assertTrue(os.path.samefile(self.paths[0], self.paths[1]))
+
+        # replacing the alias leaves the previous checkpoint untouched
+        last = os.path.join(self.tmpdir.name, 'checkpoint2.pt')
+        checkpoint_utils.write_checkpoint({'x': torch.ones(4)}, [last, self.paths[1]])
+        self.assertTrue(torch.equal(self._load(self.paths[0])['x'], torch.zeros(4)))
+        self.assertTrue(torch.equal(self._load(self.paths[1])['x'], torch.ones(4)))
+        self.assertFalse(any(fn.endswith('.tmp') for fn in os.listdir(self.tmpdir.name)))
+
+    def test_write_checkpoint_not_local(self):
+        with mock.patch.object(checkpoint_utils, '_is_local_path', return_value=False):
+            num_bytes = checkpoint_utils.write_checkpoint({'x': torch.zeros(4)}, self.paths)
+        self.assertIsNone(num_bytes)
+        # the alias is a copy made through the PathManager
+        self.assertFalse(os.path.samefile(self.paths[0], self.paths[1]))
+        for path in self.paths:
+            self.assertTrue(torch.equal(self._load(path)['x'], torch.zeros(4)))
+        self.assertFalse(any(fn.endswith('.tmp') for fn in os.listdir(self.tmpdir.name)))
+
+    def test_async_writer(self):
+        writer = checkpoint_utils.AsyncCheckpointWriter(max_pending=1)
+        try:
+            x = torch.zeros(4)
+            state = {'model': {'x': x, 'h': torch.ones(2).half()}, 'num_updates': 3}
+            writer.save(state, self.paths)
+            # the state is snapshotted, training can update it in place
+            x.add_(1)
+            other = os.path.join(self.tmpdir.name, 'checkpoint2.pt')
+            writer.save({'model': {'x': x}}, [other])
+            writer.wait()
+
+            saved = self._load(self.paths[1])
+            self.assertTrue(torch.equal(saved['model']['x'], torch.zeros(4)))
+            self.assertEqual(saved['model']['h'].dtype, torch.float32)
+            self.assertEqual(saved['num_updates'], 3)
+            completed = writer.pop_completed()
+            self.assertEqual([c[0] for c in completed], [self.paths[0], other])
+            self.assertEqual(completed[0][2], os.path.getsize(self.paths[0]))
+            self.assertEqual(writer.pop_completed(), [])
+
+            # errors of the worker are raised by the next call
+            writer.save({'x': x}, [os.path.join(self.tmpdir.name, 'missing', 'checkpoint.pt')])
+            with self.assertRaises(RuntimeError):
+                writer.wait()
+        finally:
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
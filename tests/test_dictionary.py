@@ -5,7 +5,9 @@
 
 import io
 import tempfile
+import tracemalloc
 import unittest
+from collections import Counter
 
 import torch
 
@@ -111,6 +113,65 @@ class TestDictionary(unittest.TestCase):
         self.assertEqual(d.index('a'), 5)
         self.assertEqual(d.index('b'), 6)
 
+    def test_encode_lines(self):
+        txt = [
+            'A B C D',
+            '',
+            'B E C <unk> F',
+            'D D',
+        ]
+        d = Dictionary()
+        for line in txt[:1]:
+            d.encode_line(line, add_if_not_exist=True)
+
+        for append_eos in [True, False]:
+            for reverse_order in [True, False]:
+                replaced = Counter()
+                ids, offsets = d.encode_lines(
+                    txt, append_eos=append_eos, reverse_order=reverse_order, replaced=replaced,
+                )
+                self.assertEqual(len(offsets), len(txt) + 1)
+                for i, line in enumerate(txt):
+                    expected = d.encode_line(
+                        line, add_if_not_exist=False, append_eos=append_eos, reverse_order=reverse_order,
+                    )
+                    self.assertEqual(ids[offsets[i]:offsets[i + 1]].tolist(), expected.tolist())
+                self.assertEqual(replaced, Counter({'E': 1, 'F': 1}))
+
+        # adding symbols updates the lookup table and the counts like encode_line
+        d2 = Dictionary()
+        for line in txt:
+            d.encode_line(line, add_if_not_exist=True)
+        ids, offsets = d2.encode_lines(txt[:1], add_if_not_exist=True)
+        ids, offsets = d2.encode_lines(txt, add_if_not_exist=True)
+        self.assertEqual(d2.symbols, d.symbols)
+        self.assertEqual(d2.count, d.count)
+        expected = torch.cat([d.encode_line(line, add_if_not_exist=False) for line in txt])
+        self.assertEqual(ids.tolist(), expected.tolist())
+        d2.finalize()
+        ids, offsets = d2.encode_lines(txt)
+        expected = torch.cat([d2.encode_line(line, add_if_not_exist=False) for line in txt])
+        self.assertEqual(ids.tolist(), expected.tolist())
+
+    def test_encode_lines_long_token(self):
+        # a single very long token (e.g. a URL or a base64 blob) in a batch of short lines
+        long_token = 'x' * 20000
+        txt = ['a b c'] * 1024 + ['a ' + long_token + ' b']
+        d = Dictionary()
+        d.encode_line('a b', add_if_not_exist=True)
+        replaced = Counter()
+        tracemalloc.start()
+        try:
+            ids, offsets = d.encode_lines(txt, replaced=replaced)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # a fixed-width string array would take 4 bytes per character of the
+        # longest word for every word of the batch (> 200 MB)
+        self.assertLess(peak, 10 * 2 ** 20)
+        self.assertEqual(replaced, Counter({'c': 1024, long_token: 1}))
+        self.assertEqual(ids[offsets[-2]:offsets[-1]].tolist(), d.encode_line(txt[-1]).tolist())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+from multiprocessing import Manager
+
+import torch
+import torch.distributed as dist
+
+from fairseq import distributed_utils
+
+
+WORLD_SIZE = 2
+
+
+def logging_outputs_for_step(rank, step):
+    if step == 2 and rank == 1:
+        # a dummy batch on one worker
+        return [], 0
+    logs = [
+        {'loss': torch.tensor(rank + i + 0.5), 'ntokens': 10 * rank + i, 'nsentences': 2.0}
+        for i in range(2)
+    ]
+    if step >= 4:
+        # a new key
+        for log in logs:
+            log['nll_loss'] = 1.5
+    if step == 6:
+        # not a number
+        logs[0]['hyps'] = ['a b c']
+        logs[1]['hyps'] = []
+    return logs, rank + 1
+
+
+def gather_process(init_file, rank, num_steps, results):
+    dist.init_process_group('gloo', init_method='file://' + init_file, rank=rank, world_size=WORLD_SIZE)
+    gather = distributed_utils.LoggingOutputsGather(torch.device('cpu'))
+    for step in range(num_steps):
+        logs, sample_size = logging_outputs_for_step(rank, step)
+        logs, extra_stats = gather(logs, sample_size)
+        results[(rank, step)] = (logs, extra_stats, gather.num_fallbacks)
+    dist.destroy_process_group()
+
+
+class TestLoggingOutputsGather(unittest.TestCase):
+
+    def test_gather(self):
+        num_steps = 8
+        results = Manager().dict()
+        ctx = torch.multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory('test_distributed_utils') as dirname:
+            init_file = os.path.join(dirname, 'init')
+            processes = [
+                ctx.Process(target=gather_process, args=(init_file, rank, num_steps, results))
+                for rank in range(WORLD_SIZE)
+            ]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+
+        fallbacks = []
+        for step in range(num_steps):
+            expected_logs, expected_sample_size = [], 0
+            for rank in range(WORLD_SIZE):
+                logs, sample_size = logging_outputs_for_step(rank, step)
+                expected_logs.extend(logs)
+                expected_sample_size += sample_size
+            for rank in range(WORLD_SIZE):
+                logs, extra_stats, num_fallbacks = results[(rank, step)]
+                self.assertEqual(logs, expected_logs)
+                for log, expected in zip(logs, expected_logs):
+                    self.assertEqual(
+                        {k: type(v) for k, v in log.items()},
+                        {k: type(v) for k, v in expected.items()},
+                    )
+                self.assertEqual(extra_stats, [expected_sample_size])
+            fallbacks.append(results[(0, step)][2])
+        # pickled on the first step, when the keys change and once the
+        # logging outputs cannot be flattened
+        self.assertEqual(fallbacks, [1, 1, 1, 1, 2, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
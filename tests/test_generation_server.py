@@ -0,0 +1,170 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import asyncio
+import math
+import unittest
+
+import torch
+import torch.nn as nn
+
+from fairseq.generation_server import ContinuousBatchGenerator, GenerationRequest, GenerationServer
+from fairseq.models import FairseqLanguageModel
+
+import tests.utils as test_utils
+
+
+class DummyHub(object):
+    """Stands in for a GeneratorHubInterface."""
+
+    def __init__(self, model, dictionary):
+        self.models = nn.ModuleList([model])
+        self.tgt_dict = dictionary
+
+    def encode(self, sentence):
+        return self.tgt_dict.encode_line(sentence, add_if_not_exist=False).long()
+
+    def decode(self, tokens):
+        return self.tgt_dict.string(tokens)
+
+
+def greedy_reference(model, d, prompt, max_len):
+    tokens = [d.eos()] + prompt
+    output = []
+    with torch.no_grad():
+        while True:
+            decoder_out = model.decoder(torch.tensor([tokens]))
+            lprobs = model.get_normalized_probs(decoder_out, log_probs=True)[0, -1]
+            lprobs[d.pad()] = -math.inf
+            if len(output) + 1 >= max_len:
+                next_token = d.eos()
+            else:
+                next_token = lprobs.argmax().item()
+            output.append(next_token)
+            if next_token == d.eos():
+                return output
+            tokens.append(next_token)
+
+
+class TestContinuousBatchGenerator(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+        self.d = test_utils.dummy_dictionary(vocab_size=8)
+        self.model = FairseqLanguageModel(test_utils.TestEMADecoder(self.d)).eval()
+        self.prompts = [
+            torch.randint(self.d.nspecial, len(self.d), (length,)).tolist() for length in [3, 1, 6, 2, 4, 5, 1]
+        ]
+        self.max_lens = [4, 7, 2, 9, 5, 3, 6]
+
+    def test_matches_greedy_decoding(self):
+        expected = [greedy_reference(self.model, self.d, p, m) for p, m in zip(self.prompts, self.max_lens)]
+        generator = ContinuousBatchGenerator([self.model], self.d, num_slots=3)
+        pending = [
+            GenerationRequest(i, [self.d.eos()] + prompt, max_len)
+            for i, (prompt, max_len) in enumerate(zip(self.prompts, self.max_lens))
+        ]
+        results = {}
+        step = 0
+        while len(results) < len(pending):
+            while generator.num_free_slots > 0 and len(results) + generator.num_active < len(pending):
+                generator.add(pending[len(results) + generator.num_active])
+            # evict free slots every other step to exercise both paths
+            for request in generator.step(compact=step % 2 == 0):
+                results[request.id] = request.tokens
+            self.assertLessEqual(len(generator.slots), 3)
+            step += 1
+        for i in range(len(pending)):
+            self.assertEqual(results[i], expected[i])
+
+    def test_chunked_decoder_matches_standalone(self):
+        model = FairseqLanguageModel(test_utils.TestChunkedMegaDecoder(self.d, chunk_size=4)).eval()
+
+        def new_requests():
+            return [
+                GenerationRequest(i, [self.d.eos()] + prompt, max_len)
+                for i, (prompt, max_len) in enumerate(zip(self.prompts[:4], self.max_lens[:4]))
+            ]
+
+        def decode(generator, requests, admit_steps):
+            pending = list(zip(admit_steps, requests))
+            results = {}
+            step = 0
+            while len(results) < len(requests):
+                while len(pending) > 0 and pending[0][0] <= step and generator.num_free_slots > 0:
+                    generator.add(pending.pop(0)[1])
+                for request in generator.step():
+                    results[request.id] = request
+                step += 1
+            return results
+
+        expected = {}
+        for request in new_requests():
+            expected.update(decode(ContinuousBatchGenerator([model], self.d, num_slots=1), [request], [0]))
+        # requests admitted within a chunk wait for the next chunk boundary
+        results = decode(ContinuousBatchGenerator([model], self.d, num_slots=3), new_requests(), [0, 2, 3, 5])
+        self.assertEqual(sorted(results.keys()), sorted(expected.keys()))
+        for i, request in results.items():
+            self.assertEqual(request.tokens, expected[i].tokens)
+            for score, expected_score in zip(request.positional_scores, expected[i].positional_scores):
+                self.assertAlmostEqual(score, expected_score, places=5)
+
+    def test_server(self):
+        hub = DummyHub(self.model, self.d)
+        sentences = [self.d.string(torch.tensor(p)) for p in self.prompts]
+        expected = [greedy_reference(self.model, self.d, p, 6) for p in self.prompts]
+
+        async def run():
+            async with GenerationServer(hub, num_slots=2, max_queue_size=len(sentences), max_len=6) as server:
+                hypos = await asyncio.gather(*[server.generate(s) for s in sentences])
+                for hypo, tokens in zip(hypos, expected):
+                    self.assertEqual(hypo['tokens'].tolist(), tokens)
+                    self.assertEqual(hypo['output'], self.d.string(torch.tensor(tokens)))
+                with self.assertRaises(asyncio.TimeoutError):
+                    await server.generate(sentences[0], timeout=0.)
+                metrics = server.metrics()
+                self.assertEqual(metrics['completed'], len(sentences))
+                self.assertEqual(metrics['timed_out'], 1)
+                self.assertEqual(metrics['active'], 0)
+
+            async with GenerationServer(hub, num_slots=1, max_queue_size=1) as server:
+                results = await asyncio.gather(*[server.generate(s) for s in sentences], return_exceptions=True)
+                rejected = [r for r in results if isinstance(r, asyncio.QueueFull)]
+                self.assertGreater(len(rejected), 0)
+                self.assertEqual(server.metrics()['rejected'], len(rejected))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_server_step_failure(self):
+        hub = DummyHub(self.model, self.d)
+        sentences = [self.d.string(torch.tensor(p)) for p in self.prompts[:3]]
+
+        def failing_step(compact=False):
+            raise NotImplementedError('reset_incremental_state is not supported')
+
+        async def run():
+            async with GenerationServer(hub, num_slots=2, max_len=6) as server:
+                step = server.generator.step
+                server.generator.step = failing_step
+                results = await asyncio.gather(*[server.generate(s) for s in sentences], return_exceptions=True)
+                self.assertTrue(all(isinstance(r, NotImplementedError) for r in results))
+                self.assertEqual(server.metrics()['active'], 0)
+
+                # the server keeps serving
+                server.generator.step = step
+                hypo = await server.generate(sentences[0])
+                self.assertEqual(hypo['tokens'].tolist(), greedy_reference(self.model, self.d, self.prompts[0], 6))
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
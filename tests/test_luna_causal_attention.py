@@ -0,0 +1,61 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import copy
+import unittest
+
+import torch
+
+from fairseq.modules.luna_attention import (
+    LunarCausalAttention,
+    efficient_causal_attention_chunked,
+    efficient_causal_attention_parallel,
+    efficient_causal_attention_seq,
+)
+
+
+class TestChunkedCausalAttention(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+
+    def test_matches_parallel(self):
+        x, y = torch.randn(2, 3, 11, 4, dtype=torch.float64)
+        z = torch.randn(3, 11, 5, dtype=torch.float64)
+        expected = efficient_causal_attention_parallel(x, y, z)
+        self.assertTrue(torch.allclose(efficient_causal_attention_seq(x, y, z), expected))
+        for chunk_size in [1, 4, 11, 16]:
+            out = efficient_causal_attention_chunked(x, y, z, chunk_size)
+            self.assertTrue(torch.allclose(out, expected))
+
+    def test_grad(self):
+        inputs = [
+            torch.randn(2, 7, 3, dtype=torch.float64, requires_grad=True),
+            torch.randn(2, 7, 3, dtype=torch.float64, requires_grad=True),
+            torch.randn(2, 7, 4, dtype=torch.float64, requires_grad=True),
+        ]
+        for chunk_size in [1, 3, 8]:
+            self.assertTrue(torch.autograd.gradcheck(
+                lambda x, y, z: efficient_causal_attention_chunked(x, y, z, chunk_size), inputs,
+            ))
+
+    def test_module(self):
+        attn = LunarCausalAttention(16, 2, parallel=True)
+        chunked_attn = copy.deepcopy(attn)
+        chunked_attn.parallel = 'chunked'
+        chunked_attn.chunk_size = 4
+        query = torch.randn(10, 3, 16, requires_grad=True)
+        pquery = torch.randn(6, 3, 16)
+
+        out, _ = attn(query, pquery)
+        out.sum().backward()
+        expected_grad = query.grad
+        query.grad = None
+        chunked_out, _ = chunked_attn(query, pquery)
+        chunked_out.sum().backward()
+        self.assertTrue(torch.allclose(chunked_out, out, atol=1e-5))
+        self.assertTrue(torch.allclose(query.grad, expected_grad, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
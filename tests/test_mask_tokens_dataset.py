@@ -0,0 +1,80 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+
+from fairseq.data import Dictionary, MaskTokensDataset
+
+
+class TestCollateMasking(unittest.TestCase):
+
+    def setUp(self):
+        self.vocab = Dictionary()
+        for i in range(20):
+            self.vocab.add_symbol('w{}'.format(i))
+        self.mask_idx = self.vocab.add_symbol('<mask>')
+        torch.manual_seed(1)
+        self.items = [
+            torch.randint(self.vocab.nspecial, self.mask_idx, (n,)) for n in [40, 7, 23, 64, 1, 31]
+        ]
+
+    def _datasets(self, **kwargs):
+        return MaskTokensDataset.apply_mask(
+            self.items, self.vocab, pad_idx=self.vocab.pad(), mask_idx=self.mask_idx,
+            seed=3, collate_masking=True, **kwargs,
+        )
+
+    def _collate(self, dataset, indices):
+        return dataset.collater([dataset[i] for i in indices])
+
+    def test_collate_masking(self):
+        src, tgt = self._datasets()
+        indices = list(range(len(self.items)))
+        source = self._collate(src, indices)
+        target = self._collate(tgt, indices)
+        pad = self.vocab.pad()
+        num_masked = num_tokens = 0
+        for i, item in enumerate(self.items):
+            n = len(item)
+            self.assertTrue(source[i, n:].eq(pad).all())
+            self.assertTrue(target[i, n:].eq(pad).all())
+            masked = target[i, :n].ne(pad)
+            # the targets are the original tokens and the source is only
+            # modified at the masked positions
+            self.assertTrue(torch.equal(target[i, :n][masked], item[masked]))
+            self.assertTrue(torch.equal(source[i, :n][~masked], item[~masked]))
+            self.assertIn(int(masked.sum()), [int(0.15 * n), int(0.15 * n) + 1])
+            self.assertTrue(source[i, :n][masked].ge(self.vocab.nspecial).all())
+            num_masked += int(source[i, :n].eq(self.mask_idx).sum())
+            num_tokens += int(masked.sum())
+        self.assertGreater(num_masked, 0.5 * num_tokens)
+
+        # the masks do not depend on the other items of the batch
+        for indices in [[3], [5, 3, 1]]:
+            for i, j in enumerate(indices):
+                n = len(self.items[j])
+                self.assertTrue(torch.equal(self._collate(src, indices)[i, :n], source[j, :n]))
+
+        # but they depend on the epoch
+        src.set_epoch(2)
+        self.assertFalse(torch.equal(self._collate(src, [3]), source[3:4]))
+
+    def test_mask_whole_words(self):
+        # the even words begin a word
+        mask_whole_words = torch.ByteTensor([1 if i % 2 == 0 else 0 for i in range(len(self.vocab))])
+        mask_whole_words[:self.vocab.nspecial] = 1
+        self.items = [torch.cat([torch.LongTensor([self.vocab.bos()]), item]) for item in self.items]
+        _, tgt = self._datasets(mask_whole_words=mask_whole_words)
+        target = self._collate(tgt, range(len(self.items)))
+        for i, item in enumerate(self.items):
+            masked = target[i, :len(item)].ne(self.vocab.pad()).tolist()
+            begins = mask_whole_words[item].tolist()
+            for j in range(1, len(item)):
+                if not begins[j]:
+                    self.assertEqual(masked[j], masked[j - 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,346 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from fairseq.modules.attention_softmax import attention_softmax_reference
+from fairseq.modules.blockwise_attention import blockwise_attention
+from fairseq.modules.complex_exponential_moving_average import MultiHeadComplexEMA
+from fairseq.modules.efficient_attention import attention_reference
+from fairseq.modules.exponential_moving_average import MultiHeadEMA
+from fairseq.modules.fused_ops import backend
+from fairseq.modules.fused_ops.ema_hidden import ema_hidden_reference
+from fairseq.modules.fused_ops.ema_parameters import ema_parameters_reference
+from fairseq.modules.fused_ops.ema_scan import ema_chunked_scan
+from fairseq.modules.fused_ops.fftconv import fftconv, fftconv_reference
+from fairseq.modules.fused_ops.mega_gate import (
+    mega_gate_inference,
+    mega_gate_reference,
+    mega_output_inference,
+    mega_output_reference,
+)
+from fairseq.modules.moving_average_gated_attention import MovingAverageGatedAttention
+from fairseq.modules.norm_layer.sequence_norm import sequence_norm_reference
+
+
+def _ema_recurrence(x, p, q, gamma, h):
+    # x: B x D x L, p/q: D x N, gamma: D x N, h: B x D x N
+    out = []
+    for t in range(x.size(-1)):
+        h = p * x[:, :, t:t + 1] + q * h
+        y = (h * gamma).sum(dim=-1)
+        out.append(y.real if y.is_complex() else y)
+    return torch.stack(out, dim=-1), h
+
+
+class TestMegaFusedOpsReference(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+
+    def _ema_inputs(self, complex_q):
+        B, D, N, L = 2, 3, 4, 7
+        x = torch.randn(B, D, L, dtype=torch.float64)
+        p = torch.rand(D, N, 1, dtype=torch.float64)
+        q = torch.rand(D, N, 1, dtype=torch.float64) * 0.9 + 0.05
+        gamma = torch.randn(D, N, dtype=torch.float64)
+        h = torch.randn(B, D, N, dtype=torch.float64)
+        if complex_q:
+            q = torch.polar(q, torch.rand_like(q))
+            gamma = torch.complex(gamma, torch.randn_like(gamma))
+            h = torch.complex(h, torch.randn_like(h))
+        return x, p, q, gamma, h
+
+    def test_ema_parameters_and_hidden(self):
+        for complex_q in [False, True]:
+            x, p, q, gamma, h = self._ema_inputs(complex_q)
+            L = x.size(-1)
+            expected, expected_h = _ema_recurrence(x, p.squeeze(-1), q.squeeze(-1), gamma, h)
+
+            weight, bias = ema_parameters_reference(p, q, gamma, h, L)
+            y = fftconv_reference(x, weight) + bias
+            self.assertTrue(torch.allclose(y, expected, atol=1e-8))
+
+            hidden = ema_hidden_reference(x, p, q, h)
+            self.assertTrue(torch.allclose(hidden, expected_h, atol=1e-8))
+
+            weight, bias = ema_parameters_reference(p, q, gamma, None, L)
+            self.assertIsNone(bias)
+
+    def test_ema_chunked_scan(self):
+        for complex_q in [False, True]:
+            x, p, q, gamma, h = self._ema_inputs(complex_q)
+            x = torch.cat([x, x.flip(-1), x], dim=-1)
+            expected, expected_h = _ema_recurrence(x, p.squeeze(-1), q.squeeze(-1), gamma, h)
+            # aligned, with remainder and with a single chunk
+            for chunk_size in [3, 7, 4, 21]:
+                y, hidden = ema_chunked_scan(x, p, q, gamma, h, chunk_size)
+                self.assertTrue(torch.allclose(y, expected, atol=1e-8))
+                self.assertTrue(torch.allclose(hidden, expected_h, atol=1e-8))
+
+            zeros = torch.zeros_like(h)
+            expected, expected_h = _ema_recurrence(x, p.squeeze(-1), q.squeeze(-1), gamma, zeros)
+            y, hidden = ema_chunked_scan(x, p, q, gamma, None, 5)
+            self.assertTrue(torch.allclose(y, expected, atol=1e-8))
+            self.assertTrue(torch.allclose(hidden, expected_h, atol=1e-8))
+
+    def test_fftconv_grad(self):
+        x = torch.randn(2, 3, 9, dtype=torch.float64, requires_grad=True)
+        k = torch.randn(3, 9, dtype=torch.float64, requires_grad=True)
+        # causal convolution through conv1d: flip the kernel and left-pad the input
+        expected = F.conv1d(F.pad(x, (8, 0)), k.flip(-1).unsqueeze(1), groups=3)
+        y = fftconv(x, k)
+        self.assertTrue(torch.allclose(y, expected, atol=1e-8))
+        self.assertTrue(torch.autograd.gradcheck(fftconv, (x, k)))
+
+    def test_attention_softmax(self):
+        x = torch.randn(2, 5, 5)
+        y = attention_softmax_reference(x, 0.0, True, False)
+        mask = torch.ones(5, 5, dtype=torch.bool).triu(1)
+        expected = F.softmax(x.masked_fill(mask, float('-inf')), dim=-1)
+        self.assertTrue(torch.allclose(y, expected, atol=1e-6))
+
+        # rows without any visible key are all zeros
+        y = attention_softmax_reference(torch.full((2, 3), float('-inf')), 0.0, False, False)
+        self.assertEqual(y.abs().sum().item(), 0.0)
+
+        # drop-key dropout does not rescale
+        s = attention_softmax_reference(torch.randn(2, 5, 16), 0.5, False, True).sum(dim=-1)
+        self.assertTrue(torch.logical_or((s - 1.0).abs() < 1e-5, s == 0.0).all())
+
+    def test_chunked_attention(self):
+        B, L, H = 2, 10, 4
+        q = torch.randn(B, L, 1, H)
+        k = torch.randn(B, L, 1, H)
+        v = torch.randn(B, L, 1, 6)
+        y = attention_reference(q, k, v, 0.5, 0.0, True, False, chunk_size=3)
+        w = torch.bmm(q.squeeze(2), k.squeeze(2).transpose(1, 2)) * 0.5
+        w = w.masked_fill(torch.ones(L, L, dtype=torch.bool).triu(1), float('-inf'))
+        expected = torch.bmm(F.softmax(w, dim=-1), v.squeeze(2))
+        self.assertTrue(torch.allclose(y.squeeze(2), expected, atol=1e-5))
+
+    def test_sequence_norm(self):
+        x = torch.randn(2, 4, 6)
+        gamma = torch.rand(4)
+        beta = torch.randn(4)
+        y = sequence_norm_reference(x, gamma, beta, None, None, 1e-5, True)
+        expected = F.instance_norm(x, eps=1e-5) * gamma.unsqueeze(-1) + beta.unsqueeze(-1)
+        self.assertTrue(torch.allclose(y, expected, atol=1e-5))
+
+        # padded positions do not contribute to the statistics
+        padding_mask = torch.zeros(2, 8, dtype=torch.bool)
+        padding_mask[:, 6:] = True
+        y_pad = sequence_norm_reference(F.pad(x, (0, 2), value=5.0), gamma, beta, padding_mask, None, 1e-5, True)
+        self.assertTrue(torch.allclose(y_pad[:, :, :6], y, atol=1e-5))
+        self.assertEqual(y_pad[:, :, 6:].abs().sum().item(), 0.0)
+
+    def test_ema_incremental_matches_full(self):
+        for ema_cls in [MultiHeadEMA, MultiHeadComplexEMA]:
+            ema = ema_cls(8, ndim=4).eval()
+            x = torch.randn(2, 8, 12)
+            with torch.no_grad():
+                full = ema(x)
+                incremental_state = {}
+                chunks = [ema(c, incremental_state=incremental_state) for c in torch.split(x, [5, 1, 6], dim=-1)]
+            self.assertTrue(torch.allclose(torch.cat(chunks, dim=-1), full, atol=1e-4))
+
+
+class TestMegaGateInference(unittest.TestCase):
+
+    def test_mega_gate(self):
+        torch.manual_seed(1)
+        B, L, D, S, E = 2, 5, 8, 4, 6
+        mx = torch.randn(B, L, D)
+        weight = torch.randn(2 * D + S + E, D)
+        bias = torch.randn(2 * D + S + E)
+        gamma = torch.randn(2, S)
+        beta = torch.randn(2, S)
+        outputs = mega_gate_reference(mx, weight, bias, gamma, beta, D, S, E)
+        for y, expected in zip(mega_gate_inference(mx, weight, bias, gamma, beta, D, S, E), outputs):
+            self.assertTrue(torch.allclose(y, expected, atol=1e-5))
+
+        u, _, _, r, hx = outputs
+        residual = torch.randn(B, L, D)
+        h_weight = torch.randn(D, E)
+        expected = mega_output_reference(r, h_weight, hx, u, residual)
+        y = mega_output_inference(r.clone(), h_weight, hx.clone(), u, residual)
+        self.assertTrue(torch.allclose(y, expected, atol=1e-5))
+
+    def test_fused_forward(self):
+        torch.manual_seed(1)
+        x = torch.randn(2, 7, 8)
+        causal_mask = torch.triu(torch.full((7, 7), float('-inf')), 1)
+        for bidirectional in [True, False]:
+            # RMSNorm needs apex and CUDA, the fused gates do not depend on the activation
+            maga = MovingAverageGatedAttention(
+                8, zdim=4, hdim=12, ndim=2, bidirectional=bidirectional, moving_act='silu',
+            ).eval()
+            attn_mask = None if bidirectional else causal_mask
+            with torch.no_grad():
+                expected, _ = maga(x, None, attn_mask=attn_mask)
+                maga.make_generation_fast_()
+                y, _ = maga(x, None, attn_mask=attn_mask)
+            self.assertTrue(maga.fused_inference)
+            self.assertTrue(torch.allclose(y, expected, atol=1e-5))
+
+
+class TestEMAKernelCache(unittest.TestCase):
+
+    def test_kernel_cache(self):
+        torch.manual_seed(1)
+        ema = MultiHeadEMA(8, ndim=4).eval()
+        with torch.no_grad():
+            expected, _ = ema._compute_kernel(20, None)
+            k, b = ema.kernel(20, None)
+            self.assertIsNone(b)
+            self.assertTrue(torch.allclose(k, expected, atol=1e-6))
+            # bucketed to the next power of two
+            self.assertEqual([key[:2] for key in ema._kernel_cache], [('kernel', 32)])
+            # shorter kernels are prefixes of the cached one
+            k, _ = ema.kernel(7, None)
+            self.assertTrue(torch.allclose(k, expected[:, :7], atol=1e-6))
+            self.assertEqual(len(ema._kernel_cache), 1)
+
+        # parameter updates invalidate the cache
+        ema.load_state_dict({name: torch.randn_like(t) for name, t in ema.state_dict().items()})
+        self.assertEqual(len(ema._kernel_cache), 0)
+        with torch.no_grad():
+            ema.kernel(7, None)
+        ema.train()
+        self.assertEqual(len(ema._kernel_cache), 0)
+        k, _ = ema.kernel(7, None)
+        self.assertEqual(len(ema._kernel_cache), 0)
+
+    def test_cached_forward(self):
+        torch.manual_seed(1)
+        for ema_cls in [MultiHeadEMA, MultiHeadComplexEMA]:
+            ema = ema_cls(8, ndim=4).eval()
+            x = torch.randn(2, 8, 12)
+            # grad mode bypasses the caches
+            expected = ema(x).detach()
+            incremental_state = {}
+            expected_chunks = [ema(c, incremental_state=incremental_state).detach() for c in torch.split(x, [5, 7], dim=-1)]
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(ema(x), expected, atol=1e-5))
+                self.assertIn(('kernel_f', 32, ema.gamma.dtype, ema.gamma.device), ema._kernel_cache)
+                incremental_state = {}
+                chunks = [ema(c, incremental_state=incremental_state) for c in torch.split(x, [5, 7], dim=-1)]
+            for chunk, expected_chunk in zip(chunks, expected_chunks):
+                self.assertTrue(torch.allclose(chunk, expected_chunk, atol=1e-5))
+
+
+class TestBlockwiseAttention(unittest.TestCase):
+
+    def _dense(self, q, k, v, rel_bias, scale, key_padding_mask, causal, activation):
+        Lq, Lk = q.size(1), k.size(1)
+        s = torch.bmm(q, k.transpose(1, 2))
+        if scale is not None:
+            s = s * scale
+        rows = torch.arange(Lk - Lq, Lk).unsqueeze(1)
+        cols = torch.arange(Lk).unsqueeze(0)
+        if rel_bias is not None:
+            s = s + rel_bias[cols - rows + (rel_bias.size(0) - 1) // 2]
+        mask = torch.zeros(1, Lq, Lk, dtype=torch.bool)
+        if causal:
+            mask = mask | (cols > rows).unsqueeze(0)
+        if key_padding_mask is not None:
+            mask = mask | key_padding_mask.unsqueeze(1)
+        if activation == 'softmax':
+            w = F.softmax(s.masked_fill(mask, float('-inf')), dim=-1)
+        elif activation == 'relu2':
+            w = torch.square(F.relu(s)).masked_fill(mask, 0.0)
+        else:
+            w = torch.sigmoid((s - 0.707107) * 1.702 / 0.282095).masked_fill(mask, 0.0)
+        return torch.bmm(w, v)
+
+    def test_blockwise_attention(self):
+        torch.manual_seed(1)
+        B, L, S, E, M = 2, 11, 4, 3, 16
+        key_padding_mask = torch.zeros(B, L, dtype=torch.bool)
+        key_padding_mask[1, 8:] = True
+        for activation in ['softmax', 'relu2', 'laplace']:
+            for causal in [False, True]:
+                for Lq in [L, 1]:
+                    q = torch.randn(B, Lq, S, dtype=torch.float64, requires_grad=True)
+                    k = torch.randn(B, L, S, dtype=torch.float64, requires_grad=True)
+                    v = torch.randn(B, L, E, dtype=torch.float64, requires_grad=True)
+                    rel_bias = torch.randn(2 * M - 1, dtype=torch.float64, requires_grad=True)
+                    scale = None if activation == 'softmax' else torch.rand(B, 1, 1, dtype=torch.float64)
+                    inputs = (q, k, v, rel_bias, scale, key_padding_mask, causal, activation)
+
+                    expected = self._dense(*inputs)
+                    grads = torch.autograd.grad(expected.sum(), (q, k, v, rel_bias))
+                    y = blockwise_attention(*inputs, dropout=0.0, block_size=4)
+                    self.assertTrue(torch.allclose(y, expected, atol=1e-8))
+                    for g, expected_g in zip(torch.autograd.grad(y.sum(), (q, k, v, rel_bias)), grads):
+                        self.assertTrue(torch.allclose(g, expected_g, atol=1e-8))
+
+    def test_blockwise_attention_dropout(self):
+        torch.manual_seed(1)
+        q = torch.randn(2, 9, 4, dtype=torch.float64, requires_grad=True)
+        k = torch.randn(2, 9, 4, dtype=torch.float64, requires_grad=True)
+        v = torch.randn(2, 9, 3, dtype=torch.float64, requires_grad=True)
+
+        def attention_with_dropout(q, k, v):
+            # same dropout masks at every call
+            torch.manual_seed(2)
+            return blockwise_attention(q, k, v, causal=True, dropout=0.3, block_size=4)
+
+        # the backward pass replays the dropout masks of the forward pass
+        self.assertTrue(torch.autograd.gradcheck(attention_with_dropout, (q, k, v)))
+
+
+@unittest.skipIf(not backend.has_mega2_extension, 'fairseq.mega2_extension is not built')
+class TestMegaFusedOpsParity(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def tearDown(self):
+        backend.set_backend('auto')
+
+    def _run_both(self, fn, *args):
+        backend.set_backend('extension')
+        y1 = fn(*args)
+        backend.set_backend('reference')
+        y2 = fn(*args)
+        return y1, y2
+
+    def test_ema_parity(self):
+        from fairseq.modules.fused_ops.ema_hidden import ema_hidden
+        from fairseq.modules.fused_ops.ema_parameters import ema_parameters
+        D, N, L, B = 4, 2, 16, 3
+        p = torch.rand(D, N, 1, device=self.device)
+        q = torch.polar(torch.rand(D, N, 1, device=self.device) * 0.9, torch.rand(D, N, 1, device=self.device))
+        gamma = torch.randn(D, N, dtype=torch.cfloat, device=self.device)
+        h = torch.randn(B, D, N, dtype=torch.cfloat, device=self.device)
+        x = torch.randn(B, D, L, device=self.device)
+
+        (w1, b1), (w2, b2) = self._run_both(ema_parameters, p, q, gamma, h, L)
+        self.assertTrue(torch.allclose(w1, w2, atol=1e-4))
+        self.assertTrue(torch.allclose(b1, b2, atol=1e-4))
+
+        h1, h2 = self._run_both(ema_hidden, x, p, q, h)
+        self.assertTrue(torch.allclose(h1, h2, atol=1e-4))
+
+    @unittest.skipIf(not torch.cuda.is_available(), 'attention kernels require CUDA')
+    def test_attention_parity(self):
+        from fairseq.modules.attention_softmax import attention_softmax
+        from fairseq.modules.efficient_attention import attention
+        x = torch.randn(2, 64, 64, device='cuda')
+        y1, y2 = self._run_both(attention_softmax, x, 0.0, True, False)
+        self.assertTrue(torch.allclose(y1, y2, atol=1e-5))
+
+        q = torch.randn(2, 64, 1, 16, device='cuda')
+        k = torch.randn(2, 64, 1, 16, device='cuda')
+        v = torch.randn(2, 64, 1, 32, device='cuda')
+        y1, y2 = self._run_both(attention, q, k, v, 0.25, 0.0, True, False)
+        self.assertTrue(torch.allclose(y1, y2, atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
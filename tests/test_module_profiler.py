@@ -0,0 +1,102 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from fairseq.logging import metrics
+from fairseq.module_profiler import REPORT_COLUMNS, ModuleProfiler
+
+
+class Block(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.fc1 = nn.Linear(4, 8)
+        self.fc2 = nn.Linear(8, 4)
+
+    def forward(self, x):
+        return self.fc2(torch.relu(self.fc1(x)))
+
+
+class Outer(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.block = Block()
+
+    def forward(self, x):
+        return x + self.block(x), None
+
+
+class TestModuleProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.model = nn.Sequential(Outer())
+        self.profiler = ModuleProfiler(self.model, ['Outer', 'Block'])
+
+    def tearDown(self):
+        self.profiler.close()
+
+    def _step(self):
+        x = torch.randn(3, 4, requires_grad=True)
+        y, _ = self.model(x)
+        y.sum().backward()
+
+    def test_profile_step(self):
+        self.assertEqual(list(self.profiler.stats.keys()), ['0', '0.block'])
+        with metrics.aggregate(new_root=True) as agg:
+            self.profiler.start_step()
+            self._step()
+            with self.profiler.record('optimizer'):
+                pass
+            self.profiler.end_step()
+        for key in ['prof_Block_fwd_ms', 'prof_Block_bwd_ms', 'prof_Outer_gflops', 'prof_optimizer_fwd_ms']:
+            self.assertIn(key, agg)
+
+        block = self.profiler.stats['0.block']
+        outer = self.profiler.stats['0']
+        self.assertEqual(block.calls, 1)
+        self.assertGreater(block.fwd_time, 0)
+        self.assertGreater(block.bwd_time, 0)
+        # the FLOPs of the nested modules are included
+        self.assertEqual(block.flops, 2 * 3 * 8 * 4 + 2 * 3 * 4 * 8)
+        self.assertEqual(outer.flops, block.flops)
+        self.assertGreaterEqual(outer.fwd_time, block.fwd_time)
+
+        # the hooks do nothing outside of the profiled steps
+        self._step()
+        self.assertEqual(block.calls, 1)
+
+        report = self.profiler.report()
+        self.assertEqual([row['module'] for row in report][:2], ['0', '0.block'])
+        self.assertEqual(self.profiler.report('module')[-1]['module'], 'optimizer')
+        with tempfile.TemporaryDirectory('test_module_profiler') as dirname:
+            path = os.path.join(dirname, 'profile.tsv')
+            self.profiler.dump_report(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[0].split('\t'), list(REPORT_COLUMNS))
+        self.assertEqual(len(lines), 4)
+
+    def test_cancel_step(self):
+        self.profiler.start_step()
+        self._step()
+        self.profiler.cancel_step()
+        self.assertEqual(self.profiler.num_steps, 0)
+        self.assertEqual(self.profiler.stats['0.block'].calls, 0)
+
+    def test_close(self):
+        self.profiler.close()
+        self.profiler.start_step()
+        self._step()
+        self.profiler.end_step(log_metrics=False)
+        self.assertEqual(self.profiler.stats['0.block'].calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
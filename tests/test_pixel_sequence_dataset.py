@@ -0,0 +1,45 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import tempfile
+import unittest
+
+import torch
+
+from fairseq.data import MMapPixelSequenceDataset, PixelSequenceDataset, TruncateDataset
+from fairseq.data.pixel_sequence_dataset import binarize_pixels
+
+
+class TestMMapPixelSequenceDataset(unittest.TestCase):
+
+    def test_matches_text_dataset(self):
+        torch.manual_seed(1)
+        images = torch.randint(0, 256, (5, 12))
+        normalization = (0.48, 0.24)
+        with tempfile.TemporaryDirectory('test_pixel_sequence_dataset') as dirname:
+            text_path = os.path.join(dirname, 'train.src')
+            with open(text_path, 'w') as f:
+                for image in images:
+                    print(' '.join(str(p) for p in image.tolist()), file=f)
+
+            self.assertEqual(binarize_pixels(text_path, text_path), len(images))
+            self.assertTrue(MMapPixelSequenceDataset.exists(text_path))
+
+            text_ds = TruncateDataset(PixelSequenceDataset(text_path, normalization), 10)
+            mmap_ds = TruncateDataset(MMapPixelSequenceDataset(text_path, normalization), 10)
+            self.assertEqual(len(mmap_ds), len(images))
+            self.assertEqual(list(mmap_ds.sizes), [10] * len(images))
+
+            self.assertEqual(mmap_ds[2].dtype, torch.uint8)
+            self.assertTrue(torch.equal(mmap_ds[2].long(), images[2, :10]))
+
+            indices = [3, 0, 4]
+            expected = torch.stack([text_ds[i] for i in indices])
+            batch = mmap_ds.collater([mmap_ds[i] for i in indices])
+            self.assertEqual(batch.dtype, expected.dtype)
+            self.assertTrue(torch.allclose(batch, expected, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
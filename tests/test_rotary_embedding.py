@@ -0,0 +1,44 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+
+from fairseq.modules.relative_positional_bias import RotaryEmbedding, get_rotary_table
+
+
+class TestRotaryEmbedding(unittest.TestCase):
+
+    def _complex_rotary(self, x, freqs, sidx):
+        t = torch.arange(sidx, sidx + x.size(1), dtype=torch.float)
+        freqs_cis = torch.polar(torch.ones(x.size(1), freqs.size(0)), torch.outer(t, freqs))
+        x_ = torch.view_as_complex(x.float().reshape(*x.shape[:-1], -1, 2))
+        return torch.view_as_real(x_ * freqs_cis).flatten(2)
+
+    def test_rotary(self):
+        torch.manual_seed(1)
+        rotary = RotaryEmbedding(8, 4)
+        q = torch.randn(2, 1, 8)
+        k = torch.randn(2, 6, 8, requires_grad=True)
+        # the range is extended beyond max_positions
+        with self.assertWarns(UserWarning):
+            xq, xk = rotary(q, k, qidx=5)
+        self.assertTrue(torch.allclose(xq, self._complex_rotary(q, rotary.freqs, 5), atol=1e-6))
+        self.assertTrue(torch.allclose(xk, self._complex_rotary(k.detach(), rotary.freqs, 0), atol=1e-6))
+        self.assertTrue(xk.requires_grad)
+
+    def test_shared_table(self):
+        a = RotaryEmbedding(6, 16)
+        b = RotaryEmbedding(6, 16)
+        cos_a, _ = a.get_cos_sin(0, 16, torch.float, torch.device('cpu'))
+        cos_b, _ = b.get_cos_sin(0, 16, torch.float, torch.device('cpu'))
+        self.assertEqual(cos_a.data_ptr(), cos_b.data_ptr())
+        # geometric growth keeps the existing positions
+        cos, _ = get_rotary_table(6, 10000, 17, torch.float, torch.device('cpu'))
+        self.assertEqual(cos.size(0), 32)
+        self.assertTrue(torch.equal(cos[:16], cos_a))
+
+
+if __name__ == '__main__':
+    unittest.main()
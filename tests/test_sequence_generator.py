@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import argparse
+import math
 import tempfile
 import unittest
 
@@ -275,6 +276,27 @@ class TestSequeneceGenerator(TestSequenceGeneratorBase):
         self.assertHypoTokens(hypos[1][1], [w1, w2, eos])
         self.assertHypoScore(hypos[1][1], [0.7, 0.4, 0.6], lenpen=lenpen)
 
+    def test_no_repeat_ngram(self):
+        torch.manual_seed(1)
+        vocab_size = len(self.tgt_dict)
+        for n in [1, 2, 3, 40]:
+            generator = SequenceGenerator([self.model], self.tgt_dict, no_repeat_ngram_size=n)
+            self.assertEqual(generator.ngram_keys_exact, n < 40)
+            # few distinct tokens so that ngrams repeat
+            tokens = torch.randint(self.w1, self.w1 + 2, (4, 60))
+            ngram_keys = torch.zeros_like(tokens)
+            for step in range(tokens.size(1)):
+                lprobs = torch.zeros(tokens.size(0), vocab_size)
+                lprobs = generator._no_repeat_ngram(tokens, ngram_keys, lprobs, step)
+                for i in range(tokens.size(0)):
+                    row = tokens[i].tolist()
+                    banned = set()
+                    for j in range(step - n + 2):
+                        if row[j:j + n - 1] == row[step - n + 2:step + 1]:
+                            banned.add(row[j + n - 1])
+                    self.assertEqual(set(lprobs[i].eq(-math.inf).nonzero().view(-1).tolist()) - {self.tgt_dict.pad()},
+                                     banned - {self.tgt_dict.pad()})
+
     def test_maxlen(self):
         generator = SequenceGenerator([self.model], self.tgt_dict, beam_size=2, max_len_b=2)
         hypos = generator.forward(self.sample)
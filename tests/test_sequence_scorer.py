@@ -7,7 +7,10 @@ import argparse
 import unittest
 
 import torch
+import torch.nn.functional as F
 
+from fairseq import utils
+from fairseq.modules import AdaptiveSoftmax
 from fairseq.sequence_scorer import SequenceScorer
 
 import tests.utils as test_utils
@@ -111,5 +114,28 @@ class TestSequenceScorer(unittest.TestCase):
         self.assertEqual(t1.ne(t2).long().sum(), 0)
 
 
+class TestTargetLogProbs(unittest.TestCase):
+
+    def test_blockwise_target_log_softmax(self):
+        torch.manual_seed(1)
+        features = torch.randn(2, 5, 8)
+        weight = torch.randn(37, 8)
+        bias = torch.randn(37)
+        target = torch.randint(0, 37, (2, 5))
+        expected = F.log_softmax(F.linear(features, weight, bias), dim=-1).gather(2, target.unsqueeze(-1)).squeeze(-1)
+        for block_size in [1, 10, 37, 64]:
+            lprobs = utils.blockwise_target_log_softmax(features, weight, target, bias, block_size)
+            self.assertEqual(lprobs.shape, target.shape)
+            self.assertTrue(torch.allclose(lprobs, expected, atol=1e-5))
+
+    def test_adaptive_softmax_target_log_prob(self):
+        torch.manual_seed(1)
+        asm = AdaptiveSoftmax(30, 16, [10, 20], dropout=0.).eval()
+        features = torch.randn(2, 6, 16)
+        target = torch.tensor([[0, 9, 10, 19, 20, 29], [5, 15, 25, 1, 2, 3]])
+        expected = asm.get_log_prob(features, None).gather(2, target.unsqueeze(-1)).squeeze(-1)
+        self.assertTrue(torch.allclose(asm.get_target_log_prob(features, target), expected, atol=1e-5))
+
+
 if __name__ == '__main__':
     unittest.main()
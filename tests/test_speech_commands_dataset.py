@@ -0,0 +1,69 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import pathlib
+import pickle
+import tempfile
+import unittest
+
+import torch
+
+from fairseq.data import SpeechCommandsDataset
+from fairseq.data.audio.speech_commands_dataset import save_data
+
+
+class TestSpeechCommandsMMap(unittest.TestCase):
+
+    def _build_datasets(self, dirname, resolution, **kwargs):
+        args = dict(partition='train', length=16004, mfcc=False, sr=2, dropped_rate=0., path=dirname,
+                    resolution=resolution, **kwargs)
+        return SpeechCommandsDataset(**args), SpeechCommandsDataset(mmap=True, **args)
+
+    def _assert_batch_equal(self, batch, expected):
+        self.assertEqual(batch['id'].tolist(), expected['id'].tolist())
+        self.assertEqual(batch['ntokens'], expected['ntokens'])
+        self.assertTrue(torch.equal(batch['net_input']['src_lengths'], expected['net_input']['src_lengths']))
+        self.assertEqual(batch['net_input']['src_tokens'].dtype, expected['net_input']['src_tokens'].dtype)
+        self.assertTrue(torch.equal(batch['net_input']['src_tokens'], expected['net_input']['src_tokens']))
+        self.assertTrue(torch.equal(batch['target'], expected['target']))
+
+    def test_matches_in_memory_dataset(self):
+        torch.manual_seed(1)
+        with tempfile.TemporaryDirectory('test_speech_commands_dataset') as dirname:
+            data_loc = pathlib.Path(dirname) / 'processed_data' / 'raw'
+            os.makedirs(data_loc)
+            # (batch, channels, length) like the processed data, the clips are 16000 samples
+            tensors = {}
+            for split, n in [('train', 7), ('val', 3), ('test', 3)]:
+                tensors[split + '_X'] = torch.randn(n, 1, 16000)
+                tensors[split + '_y'] = torch.randint(0, 10, (n,))
+            save_data(data_loc, **tensors)
+
+            for resolution in [1, 3]:
+                ds, mmap_ds = self._build_datasets(dirname, resolution)
+                self.assertTrue(mmap_ds.supports_fetch_batch)
+                self.assertEqual(len(mmap_ds), len(ds))
+                self.assertEqual(mmap_ds.num_tokens(0), ds.num_tokens(0))
+
+                indices = [5, 0, 3, 6]
+                expected = ds.collater([ds[i] for i in indices])
+                self._assert_batch_equal(mmap_ds.collater([mmap_ds[i] for i in indices]), expected)
+                self._assert_batch_equal(mmap_ds.fetch_batch(indices), expected)
+
+                # workers map the cache rather than unpickling a copy of it
+                mmap_ds = pickle.loads(pickle.dumps(mmap_ds))
+                self._assert_batch_equal(mmap_ds.fetch_batch(indices), expected)
+
+            ds, half_ds = self._build_datasets(dirname, 1, mmap_dtype='float16')
+            self.assertEqual(half_ds.src.dtype.itemsize, 2)
+            expected = ds.collater([ds[i] for i in indices])
+            batch = half_ds.fetch_batch(indices)
+            self.assertEqual(batch['net_input']['src_tokens'].dtype, torch.float)
+            self.assertTrue(torch.allclose(
+                batch['net_input']['src_tokens'], expected['net_input']['src_tokens'], atol=1e-2,
+            ))
+
+
+if __name__ == '__main__':
+    unittest.main()
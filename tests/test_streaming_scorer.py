@@ -0,0 +1,59 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+
+from fairseq.models import FairseqLanguageModel
+from fairseq.streaming_scorer import StreamingScorer
+
+import tests.utils as test_utils
+
+
+class TestStreamingScorer(unittest.TestCase):
+
+    def test_streaming_scorer(self):
+        torch.manual_seed(1)
+        d = test_utils.dummy_dictionary(vocab_size=6)
+        model = FairseqLanguageModel(test_utils.TestEMADecoder(d)).eval()
+
+        documents = []
+        for i, length in enumerate([5, 1, 12, 3, 7, 4]):
+            tokens = torch.randint(d.nspecial, len(d), (length + 1,))
+            documents.append({'id': i, 'source': tokens[:-1], 'target': tokens[1:]})
+
+        expected = {}
+        with torch.no_grad():
+            for doc in documents:
+                lprobs = model.get_normalized_probs(model.decoder(doc['source'].unsqueeze(0)), log_probs=True)
+                expected[doc['id']] = lprobs[0].gather(1, doc['target'].unsqueeze(-1)).sum().item()
+
+        for num_lanes, step_size, softmax_batch in [(1, 4, None), (2, 3, None), (4, 2, 3)]:
+            scorer = StreamingScorer(d, num_lanes, step_size, softmax_batch)
+            results = scorer.score([model], documents)
+            self.assertEqual(sorted(results['id']), list(range(len(documents))))
+            for doc_id, score, ntokens in zip(results['id'], results['score'], results['ntokens']):
+                self.assertEqual(ntokens.item(), documents[doc_id]['target'].numel())
+                self.assertAlmostEqual(score.item(), expected[doc_id], places=4)
+
+    def test_reset_within_chunk(self):
+        torch.manual_seed(1)
+        d = test_utils.dummy_dictionary(vocab_size=6)
+        decoder = test_utils.TestChunkedMegaDecoder(d, chunk_size=4).eval()
+        tokens = torch.randint(d.nspecial, len(d), (2, 5))
+        reset_mask = torch.tensor([False, True])
+        incremental_state = {}
+        with torch.no_grad():
+            decoder(tokens[:, :4], incremental_state)
+            # at a chunk boundary
+            decoder.reset_incremental_state_scripting(incremental_state, reset_mask)
+            decoder(tokens[:, 4:], incremental_state)
+            with self.assertRaises(RuntimeError):
+                decoder.reset_incremental_state_scripting(incremental_state, reset_mask)
+            # nothing to reset
+            decoder.reset_incremental_state_scripting(incremental_state, torch.zeros(2, dtype=torch.bool))
+
+
+if __name__ == '__main__':
+    unittest.main()
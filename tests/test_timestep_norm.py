@@ -0,0 +1,133 @@
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import unittest
+
+import torch
+
+from fairseq.modules.fused_ops import backend
+from fairseq.modules.norm_layer.timestep_norm import TimestepNorm, timestep_norm, timestep_norm_reference
+
+
+def timestep_norm_loop(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask, num_groups, eps):
+    # sequential Welford updates, one timestep at a time
+    bsz, seq_len, num_features = x.size()
+    num_groups = num_features if num_groups is None else num_groups
+    count, mean, var = prev_count.clone(), prev_mean.double(), prev_var.double()
+    out = []
+    for t in range(seq_len):
+        xt = x[:, t].double().view(bsz, num_groups, -1)
+        group_var, group_mean = torch.var_mean(xt, dim=-1, unbiased=False)
+        n = count.double().unsqueeze(1)
+        delta = group_mean - mean
+        cur_mean = mean + delta / (n + 1)
+        cur_var = (n * var + group_var + delta * delta * n / (n + 1)) / (n + 1)
+        y = (xt - cur_mean.unsqueeze(-1)) / torch.sqrt(cur_var + eps).unsqueeze(-1)
+        y = y.view(bsz, num_features) * gamma.double() + beta.double()
+        valid = torch.ones(bsz, dtype=torch.bool) if padding_mask is None else ~padding_mask[:, t]
+        out.append(torch.where(valid.unsqueeze(1), y, torch.zeros_like(y)))
+        mean = torch.where(valid.unsqueeze(1), cur_mean, mean)
+        var = torch.where(valid.unsqueeze(1), cur_var, var)
+        count = count + valid.long()
+    return torch.stack(out, dim=1), count, mean, var
+
+
+class TestTimestepNorm(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(1)
+
+    def _inputs(self, bsz=3, seq_len=37, num_features=8, num_groups=None, prior_count=2):
+        num_stats = num_features if num_groups is None else num_groups
+        # a drifting signal with a large offset
+        x = torch.randn(bsz, seq_len, num_features) + 100.0 + torch.linspace(0, 5, seq_len).view(1, -1, 1)
+        prev_count = torch.tensor([prior_count, 0, 5])[:bsz]
+        prev_mean = torch.randn(bsz, num_stats) + 100.0
+        prev_var = torch.rand(bsz, num_stats) + 0.5
+        gamma = torch.rand(num_features) + 0.5
+        beta = torch.randn(num_features)
+        padding_mask = torch.zeros(bsz, seq_len, dtype=torch.bool)
+        padding_mask[0, :4] = True
+        if bsz > 1:
+            padding_mask[1, -6:] = True
+        if bsz > 2 and seq_len > 13:
+            padding_mask[2, 10:13] = True
+        return x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask
+
+    def _assert_close(self, outputs, expected, atol=1e-4):
+        for out, ref in zip(outputs, expected):
+            self.assertEqual(out.size(), ref.size())
+            self.assertTrue(torch.allclose(out.double(), ref.double(), rtol=1e-4, atol=atol),
+                            (out.double() - ref.double()).abs().max())
+
+    def test_matches_sequential_welford(self):
+        for num_groups in [None, 1, 2]:
+            x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask = self._inputs(num_groups=num_groups)
+            for mask in [None, padding_mask]:
+                expected = timestep_norm_loop(x, prev_count, prev_mean, prev_var, gamma, beta, mask, num_groups, 1e-5)
+                for chunk_size in [1, 5, 64]:
+                    outputs = timestep_norm_reference(
+                        x, prev_count, prev_mean, prev_var, gamma, beta, mask, num_groups, 1e-5, chunk_size,
+                    )
+                    self._assert_close(outputs, expected)
+
+    def test_all_padded(self):
+        x, prev_count, prev_mean, prev_var, gamma, beta, _ = self._inputs()
+        padding_mask = torch.ones(x.size()[:2], dtype=torch.bool)
+        y, count, mean, var = timestep_norm_reference(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask)
+        self.assertEqual(y.abs().sum().item(), 0.0)
+        self.assertTrue(torch.equal(count, prev_count))
+        self.assertTrue(torch.allclose(mean, prev_mean))
+        self.assertTrue(torch.allclose(var, prev_var))
+
+    def test_grad(self):
+        x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask = self._inputs(bsz=2, seq_len=9, num_groups=2)
+        inputs = [t.double().requires_grad_() for t in (x - 100.0, prev_mean - 100.0, prev_var, gamma, beta)]
+
+        def fn(x, prev_mean, prev_var, gamma, beta):
+            y, _, mean, var = timestep_norm_reference(
+                x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask, 2, 1e-5, 4,
+            )
+            return y, mean, var
+
+        self.assertTrue(torch.autograd.gradcheck(fn, inputs))
+
+    def test_incremental_matches_full(self):
+        for num_groups in [None, 2]:
+            norm = TimestepNorm(8, num_groups=num_groups, prior_count=2)
+            with torch.no_grad():
+                norm.prior_mean.normal_()
+                norm.weight.normal_()
+            x = torch.randn(3, 11, 8)
+            expected = norm(x)
+            incremental_state = {}
+            outputs = [norm(x[:, :4], incremental_state=incremental_state)]
+            for t in range(4, 11):
+                outputs.append(norm(x[:, t:t + 1], incremental_state=incremental_state))
+            self.assertTrue(torch.allclose(torch.cat(outputs, dim=1), expected, atol=1e-5))
+
+    @unittest.skipUnless(backend.has_mega2_extension, 'requires fairseq.mega2_extension')
+    def test_extension_parity(self):
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        try:
+            for num_groups in [None, 2]:
+                inputs = [t.to(device) for t in self._inputs(num_groups=num_groups)]
+                grads = []
+                for name in ['extension', 'reference']:
+                    backend.set_backend(name)
+                    x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask = inputs
+                    x = x.clone().requires_grad_()
+                    gamma = gamma.clone().requires_grad_()
+                    outputs = timestep_norm(x, prev_count, prev_mean, prev_var, gamma, beta, padding_mask,
+                                            num_groups, 1e-5)
+                    outputs[0].sum().backward()
+                    grads.append((outputs, x.grad, gamma.grad))
+                (out1, x_grad1, gamma_grad1), (out2, x_grad2, gamma_grad2) = grads
+                self._assert_close(out1, out2)
+                self._assert_close([x_grad1, gamma_grad1], [x_grad2, gamma_grad2], atol=1e-3)
+        finally:
+            backend.set_backend('auto')
+
+
+if __name__ == '__main__':
+    unittest.main()
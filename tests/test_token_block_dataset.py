@@ -3,11 +3,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import os
+import tempfile
 import unittest
 
+import numpy as np
 import torch
 
-from fairseq.data import TokenBlockDataset
+from fairseq.data import MonolingualDataset, TokenBlockDataset, data_utils, indexed_dataset
 
 import tests.utils as test_utils
 
@@ -74,5 +77,79 @@ class TestTokenBlockDataset(unittest.TestCase):
         self.assertEqual(ds[2].tolist(), [6, 1])
 
 
+class TestTokenBlockGetBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.d = test_utils.dummy_dictionary(vocab_size=20)
+        torch.manual_seed(1)
+        self.data = [
+            torch.cat([torch.randint(self.d.nspecial, len(self.d), (n,)), torch.tensor([self.d.eos()])])
+            for n in [4, 3, 7, 2, 9, 1, 5]
+        ]
+        self.dirname = tempfile.mkdtemp('test_token_block_dataset')
+        prefix = os.path.join(self.dirname, 'train')
+        builder = indexed_dataset.MMapIndexedDatasetBuilder(
+            indexed_dataset.data_file_path(prefix), dtype=np.uint16,
+        )
+        for item in self.data:
+            builder.add_item(item)
+        builder.finalize(indexed_dataset.index_file_path(prefix))
+        self.mmap_ds = indexed_dataset.MMapIndexedDataset(prefix)
+
+    def tearDown(self):
+        del self.mmap_ds
+        for name in os.listdir(self.dirname):
+            os.remove(os.path.join(self.dirname, name))
+        os.rmdir(self.dirname)
+
+    def test_mmap_get_batch(self):
+        indices = [4, 1, 0, 6]
+        for left_pad in [False, True]:
+            batch = self.mmap_ds.get_batch(indices, self.d.pad(), left_pad=left_pad)
+            expected = data_utils.collate_tokens(
+                [self.mmap_ds[i] for i in indices], self.d.pad(), left_pad=left_pad,
+            )
+            self.assertEqual(batch.dtype, torch.int64)
+            self.assertTrue(torch.equal(batch, expected))
+        batch = self.mmap_ds.get_batch(indices, self.d.pad(), pad_to_length=12, dtype=np.int32)
+        self.assertEqual(batch.dtype, torch.int32)
+        self.assertEqual(batch.size(), (len(indices), 12))
+
+    def test_get_batch(self):
+        for break_mode, block_size in [('none', 3), ('complete', 6), ('eos', None)]:
+            ds = TokenBlockDataset(
+                self.mmap_ds, self.mmap_ds.sizes, block_size, pad=self.d.pad(), eos=self.d.eos(),
+                break_mode=break_mode, include_targets=True,
+            )
+            indices = np.random.RandomState(0).permutation(len(ds))
+            for batch, samples in zip(ds.get_batch(indices), zip(*[ds[i] for i in indices])):
+                expected = data_utils.collate_tokens(samples, self.d.pad())
+                self.assertTrue(torch.equal(batch, expected), break_mode)
+
+    def test_monolingual_fetch_batch(self):
+        ds = TokenBlockDataset(
+            self.mmap_ds, self.mmap_ds.sizes, 5, pad=self.d.pad(), eos=self.d.eos(),
+            break_mode='none', include_targets=True,
+        )
+        for targets in [['future'], ['self', 'future', 'past']]:
+            mono_ds = MonolingualDataset(
+                ds, ds.sizes, self.d, self.d, add_eos_for_other_targets=False, shuffle=False, targets=targets,
+            )
+            self.assertTrue(mono_ds.supports_fetch_batch)
+            indices = [3, 0, 5, 1]
+            batch = mono_ds.fetch_batch(indices)
+            expected = mono_ds.collater([mono_ds[i] for i in indices])
+            self.assertEqual(batch['id'].tolist(), expected['id'].tolist())
+            self.assertEqual(batch['ntokens'], expected['ntokens'])
+            self.assertEqual(batch['nsentences'], expected['nsentences'])
+            for key in ['src_tokens', 'src_lengths']:
+                self.assertTrue(torch.equal(batch['net_input'][key], expected['net_input'][key]))
+            if len(targets) == 1:
+                self.assertTrue(torch.equal(batch['target'], expected['target']))
+            else:
+                for target, expected_target in zip(batch['target'], expected['target']):
+                    self.assertTrue(torch.equal(target, expected_target))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -8,6 +8,7 @@ import os
 import random
 import sys
 import torch
+import torch.nn as nn
 import torch.nn.functional as F
 
 from io import StringIO
@@ -20,6 +21,8 @@ from fairseq.models import (
     FairseqIncrementalDecoder,
 )
 from fairseq.models.fairseq_encoder import EncoderOut
+from fairseq.modules.exponential_moving_average import MultiHeadEMA
+from fairseq.modules.moving_average_gated_attention import MovingAverageGatedAttention
 from fairseq.tasks import FairseqTask
 from fairseq_cli import (
     generate,
@@ -404,6 +407,53 @@ class TestIncrementalDecoder(FairseqIncrementalDecoder):
         return self.args.max_decoder_positions
 
 
+class TestEMADecoder(FairseqIncrementalDecoder):
+    """Language model decoder with a stateful moving average layer, whose
+    incremental state can be reordered and reset."""
+
+    def __init__(self, dictionary, embed_dim=8):
+        super().__init__(dictionary)
+        self.embed_tokens = nn.Embedding(len(dictionary), embed_dim, padding_idx=dictionary.pad())
+        self.move = MultiHeadEMA(embed_dim, ndim=2)
+        self.output_projection = nn.Linear(embed_dim, len(dictionary))
+
+    def forward(self, prev_output_tokens, incremental_state=None, **kwargs):
+        padding_mask = prev_output_tokens.eq(self.dictionary.pad())
+        # B x L x D -> B x D x L
+        x = self.embed_tokens(prev_output_tokens).transpose(1, 2)
+        x = self.move(x, padding_mask, incremental_state)
+        return self.output_projection(x.transpose(1, 2)), None
+
+
+class TestChunkedMegaDecoder(FairseqIncrementalDecoder):
+    """Language model decoder with a causal Mega layer attending within
+    chunks of *chunk_size* tokens."""
+
+    def __init__(self, dictionary, embed_dim=8, chunk_size=4):
+        super().__init__(dictionary)
+        self.chunk_size = chunk_size
+        self.embed_tokens = nn.Embedding(len(dictionary), embed_dim, padding_idx=dictionary.pad())
+        # RMSNorm needs apex and CUDA
+        self.mega = MovingAverageGatedAttention(
+            embed_dim, zdim=4, hdim=12, ndim=2, chunk_size=chunk_size, moving_act='silu', max_positions=64,
+        )
+        self.output_projection = nn.Linear(embed_dim, len(dictionary))
+
+    def forward(self, prev_output_tokens, incremental_state=None, **kwargs):
+        seq_len = prev_output_tokens.size(1)
+        num_paddings = (-seq_len) % self.chunk_size if seq_len > self.chunk_size else 0
+        tokens = F.pad(prev_output_tokens, (0, num_paddings), value=self.dictionary.pad())
+        padding_mask = tokens.eq(self.dictionary.pad())
+        if not padding_mask.any():
+            padding_mask = None
+        attn_mask = None
+        if tokens.size(1) > 1:
+            dim = min(tokens.size(1), self.chunk_size)
+            attn_mask = torch.triu(utils.fill_with_neg_inf(torch.zeros(dim, dim)), 1)
+        x, _ = self.mega(self.embed_tokens(tokens), padding_mask, incremental_state, attn_mask=attn_mask)
+        return self.output_projection(x[:, :seq_len]), None
+
+
 class TestReshapingEncoder(FairseqEncoder):
     def __init__(self, args, dictionary):
         super().__init__(dictionary)